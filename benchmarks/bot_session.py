@@ -0,0 +1,122 @@
+"""
+Проверка общей HTTP-сессии Bot API на локальной заглушке, имитирующей Bot API.
+
+Рассылка шлёт sendMessage по полосе bulk, одновременно идут интерактивные ответы.
+Сравниваются обычная AiohttpSession с тем же размером пула и TunedSession с полосами:
+задержка интерактивных вызовов под нагрузкой и переиспользование соединений.
+
+    python -m benchmarks.bot_session
+    python -m benchmarks.bot_session --latency 0.1 --bulk 2000
+"""
+import argparse
+import asyncio
+import os
+import time
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiohttp import web  # noqa: E402
+
+from services.bot_session import TunedSession, use_bulk_lane  # noqa: E402
+from services.update_queue import percentile  # noqa: E402
+
+
+def stub_app(latency: float) -> web.Application:
+    """Отвечает на любой метод как Bot API, с задержкой latency секунд."""
+    message_ids = iter(range(1, 10**9))
+
+    async def handle(request: web.Request) -> web.Response:
+        await asyncio.sleep(latency)
+        form = await request.post()
+        method = request.match_info["method"]
+        if method in ("sendMessage", "editMessageText"):
+            result = {
+                "message_id": next(message_ids),
+                "date": int(time.time()),
+                "chat": {"id": int(form.get("chat_id", 0)), "type": "private"},
+                "text": form.get("text", ""),
+            }
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", handle)
+    return app
+
+
+async def run(session, args) -> dict:
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+    interactive: list[float] = []
+
+    async def bulk():
+        use_bulk_lane()
+        queue = iter(range(args.bulk))
+
+        async def sender():
+            for user_id in queue:
+                await bot.send_message(user_id, "Рассылка")
+
+        await asyncio.gather(*(sender() for _ in range(args.bulk_senders)))
+
+    async def replies():
+        await asyncio.sleep(args.latency)  # рассылка уже заняла соединения
+        for i in range(args.interactive):
+            started = time.perf_counter()
+            await bot.send_message(i, "👋 Добро пожаловать!")
+            interactive.append(time.perf_counter() - started)
+            await asyncio.sleep(args.latency / 4)
+
+    started = time.perf_counter()
+    await asyncio.gather(bulk(), replies())
+    elapsed = time.perf_counter() - started
+    result = {
+        "elapsed_s": elapsed,
+        "interactive_p50_ms": percentile(interactive, 0.50) * 1000,
+        "interactive_p95_ms": percentile(interactive, 0.95) * 1000,
+        "bulk_per_s": args.bulk / elapsed,
+    }
+    if isinstance(session, TunedSession):
+        stats = session.stats()
+        result.update(reuse_ratio=stats["reuse_ratio"], connections_created=stats["connections_created"])
+    await session.close()
+    return result
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP-сессия Bot API против локальной заглушки")
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка заглушки, сек")
+    parser.add_argument("--bulk", type=int, default=1000, help="сообщений рассылки")
+    parser.add_argument("--bulk-senders", type=int, default=100, help="одновременных отправителей рассылки")
+    parser.add_argument("--interactive", type=int, default=50, help="интерактивных ответов")
+    parser.add_argument("--interactive-limit", type=int, default=10)
+    parser.add_argument("--bulk-limit", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    runner = web.AppRunner(stub_app(args.latency))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    api = TelegramAPIServer.from_base(f"http://127.0.0.1:{port}")
+    pool_size = args.interactive_limit + args.bulk_limit
+
+    shared = AiohttpSession(api=api)
+    shared._connector_init["limit"] = pool_size
+    tuned = TunedSession(
+        interactive_limit=args.interactive_limit, bulk_limit=args.bulk_limit, keepalive_timeout=60,
+        dns_cache_ttl=300, timeout=30, method_timeouts={}, api=api,
+    )
+    for name, session in (("shared pool", shared), ("lanes", tuned)):
+        result = await run(session, args)
+        print(f"== {name} (pool {pool_size})")
+        for key, value in result.items():
+            print(f"  {key:<22} {value:10.2f}")
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,301 @@
+"""
+Бенчмарк обработки апдейтов: синтетические Update прогоняются через dp.feed_update
+с настоящими хендлерами, middleware и БД, но без сети (RecordingSession вместо Telegram).
+
+    python -m benchmarks.dispatch                                  # SQLite во временном файле
+    BENCH_DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.dispatch
+    python -m benchmarks.dispatch --save-baseline bench_dispatch.json
+    python -m benchmarks.dispatch --baseline bench_dispatch.json --threshold 0.2
+
+Для каждого сценария печатаются updates/s, p50/p95/p99 задержки, запросы к БД, исходящие
+вызовы API и вызовы, отданные в ответе на вебхук, на апдейт. Задержки и updates/s считаются
+только по успешным апдейтам, упавшие идут в err. С --baseline код выхода 1, если пропускная
+способность упала или p95 вырос больше чем на threshold, выросло число запросов на апдейт
+или в сценарии есть ошибки. Сценарии, которые выбранная база не поддерживает, пропускаются.
+Базовую линию стоит записывать на той же машине, с той же базой и --concurrency.
+
+ВНИМАНИЕ: таблицы в базе бенчмарка пересоздаются — только для локальной базы.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Callable
+
+# База и окружение бенчмарка подменяют рабочие до импорта config/database
+os.environ["DATABASE_URL"] = os.getenv(
+    "BENCH_DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(tempfile.gettempdir(), 'bench_dispatch.db')}"
+)
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+os.environ["SUPERADMIN_ID"] = "1"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# Один пользователь шлёт много апдейтов подряд — лимиты частоты исказили бы замеры хендлеров
+for kind in ("MESSAGE", "CALLBACK", "ADMIN"):
+    os.environ.setdefault(f"THROTTLE_{kind}_BURST", "1000000000")
+
+from aiogram import Bot  # noqa: E402
+from aiogram.methods import TelegramMethod  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+from sqlalchemy import event, insert  # noqa: E402
+
+from benchmarks.fake_session import RecordingSession  # noqa: E402
+from database import Base, SessionLocal, User, Application, Payout, engine  # noqa: E402
+from services.payout_rollups import rebuild_rollups  # noqa: E402
+from services.payouts import apply_payout  # noqa: E402
+from services.update_queue import percentile  # noqa: E402
+
+SUPERADMIN_ID = 1
+ADMIN_IDS = range(2, 12)
+FIRST_USER_ID = 1000
+
+_ids = itertools.count(1)
+
+
+def message_update(user_id: int, text: str) -> Update:
+    message = {
+        "message_id": next(_ids),
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "language_code": "ru"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return Update.model_validate({"update_id": next(_ids), "message": message})
+
+
+def callback_update(user_id: int, data: str) -> Update:
+    return Update.model_validate({
+        "update_id": next(_ids),
+        "callback_query": {
+            "id": str(next(_ids)),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "language_code": "ru"},
+            "chat_instance": "bench",
+            "data": data,
+            "message": {
+                "message_id": next(_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "menu",
+            },
+        },
+    })
+
+
+@dataclass
+class Scenario:
+    name: str
+    flow: Callable[[int], list[Update]]  # номер прогона -> апдейты одного сценария пользователя
+    backends: tuple[str, ...] = ()  # диалекты БД, на которых сценарий работает; пусто — на любых
+
+
+def build_scenarios(users: int) -> list[Scenario]:
+    def user(i: int) -> int:
+        return FIRST_USER_ID + i % users
+
+    def admin(i: int) -> int:
+        return ADMIN_IDS[i % len(ADMIN_IDS)]
+
+    return [
+        Scenario("start", lambda i: [message_update(user(i), "/start")]),
+        Scenario("profile", lambda i: [message_update(user(i), "👤 Профиль")]),
+        Scenario("top_users", lambda i: [callback_update(user(i), "top_users")]),
+        Scenario("total_today", lambda i: [callback_update(user(i), "total_today")]),
+        Scenario("application", lambda i: [
+            message_update(user(i), "📋 Подать заявку"),
+            message_update(user(i), f"Заявка #{i}: хочу в команду"),
+        ]),
+        Scenario("admin_applications", lambda i: [callback_update(admin(i), "view_applications")]),
+        # Выплата — один запрос с изменяющими данные CTE, SQLite их не поддерживает
+        Scenario("admin_payout", lambda i: [
+            callback_update(admin(i), "manage_payout"),
+            message_update(admin(i), str(user(i))),
+            message_update(admin(i), str(10 + i % 90)),
+        ], backends=("postgresql",)),
+    ]
+
+
+async def seed(users: int, payouts: int, applications: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+        rows = [{"user_id": SUPERADMIN_ID, "name": "owner", "role": "superadmin"}]
+        rows += [{"user_id": admin_id, "name": f"admin{admin_id}", "role": "admin"} for admin_id in ADMIN_IDS]
+        rows += [
+            {"user_id": FIRST_USER_ID + i, "name": f"user{i}", "contact": f"wallet{i}", "role": "user"}
+            for i in range(users)
+        ]
+        await conn.execute(insert(User), rows)
+        await conn.execute(insert(Application), [
+            {"user_id": FIRST_USER_ID + i % users, "message": f"Заявка {i}", "status": "pending"}
+            for i in range(applications)
+        ])
+    if engine.dialect.name == "postgresql":
+        # Тем же путём, что и выплаты из админки: журнал, баланс и сводки одним запросом
+        async with SessionLocal() as session:
+            for i in range(payouts):
+                await apply_payout(session, FIRST_USER_ID + i % users, Decimal(10 + i % 50), SUPERADMIN_ID)
+            await session.commit()
+    else:
+        # SQLite не выполняет изменяющие данные CTE apply_payout: журнал вставкой, сводки — пересборкой
+        async with engine.begin() as conn:
+            await conn.execute(insert(Payout), [
+                {"user_id": FIRST_USER_ID + i % users, "amount": Decimal(10 + i % 50), "issued_by": SUPERADMIN_ID}
+                for i in range(payouts)
+            ])
+        await rebuild_rollups()
+
+
+async def run_scenario(dp, bot: Bot, session: RecordingSession, scenario: Scenario, flows: int,
+                       warmup: int, concurrency: int, counter: list) -> dict:
+    for i in range(warmup):
+        for update in scenario.flow(i):
+            try:
+                await dp.feed_update(bot, update)
+            except Exception:
+                pass
+
+    prepared = [scenario.flow(warmup + i) for i in range(flows)]
+    latencies: list[float] = []  # только успешные апдейты
+    errors = 0
+    inlined = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_flow(updates: list[Update]):
+        nonlocal errors, inlined
+        async with semaphore:
+            for update in updates:
+                started = time.perf_counter()
+                try:
+                    # Возвращённый метод вебхук отдал бы в ответе Telegram — исходящего запроса нет
+                    if isinstance(await dp.feed_update(bot, update), TelegramMethod):
+                        inlined += 1
+                except Exception:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+    session.reset()
+    counter[0] = 0
+    started = time.perf_counter()
+    await asyncio.gather(*(run_flow(updates) for updates in prepared))
+    elapsed = time.perf_counter() - started
+    # Запросы и вызовы API делят на все апдейты, включая упавшие: они тоже их сделали
+    updates = len(latencies) + errors
+    return {
+        "updates": updates,
+        "updates_per_s": len(latencies) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "queries_per_update": counter[0] / updates if updates else 0.0,
+        "api_calls_per_update": len(session.calls) / updates if updates else 0.0,
+        "inlined_per_update": inlined / updates if updates else 0.0,
+        "errors": errors,
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    regressions = []
+    for name, current in results.items():
+        # Ошибки — регрессия сами по себе, даже без базовой линии: сломанный сценарий «быстрее»
+        if current["errors"] > 0:
+            regressions.append(f"{name}: {current['errors']} of {current['updates']} updates failed")
+        base = baseline.get(name)
+        if not base:
+            continue
+        if current["errors"] > base.get("errors", 0):
+            regressions.append(f"{name}: errors {base.get('errors', 0)} -> {current['errors']}")
+        if current["updates_per_s"] < base["updates_per_s"] * (1 - threshold):
+            regressions.append(f"{name}: updates/s {base['updates_per_s']:.0f} -> {current['updates_per_s']:.0f}")
+        if current["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {base['p95_ms']:.2f}ms -> {current['p95_ms']:.2f}ms")
+        # Число запросов почти не зависит от машины (разброс дают только кэши с TTL),
+        # поэтому рост на десятую запроса на апдейт уже считается регрессией
+        if current["queries_per_update"] > base["queries_per_update"] + 0.1:
+            regressions.append(
+                f"{name}: queries/update {base['queries_per_update']:.2f} -> {current['queries_per_update']:.2f}"
+            )
+    return regressions
+
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Бенчмарк dp.feed_update на синтетических апдейтах")
+    parser.add_argument("--flows", type=int, default=500, help="прогонов на сценарий")
+    parser.add_argument("--warmup", type=int, default=50, help="прогонов для прогрева (не учитываются)")
+    parser.add_argument("--concurrency", type=int, default=1, help="одновременных прогонов")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--payouts", type=int, default=2000)
+    parser.add_argument("--applications", type=int, default=200)
+    parser.add_argument("--scenario", action="append", help="запустить только указанные сценарии")
+    parser.add_argument("--output", help="сохранить результаты в JSON")
+    parser.add_argument("--save-baseline", help="сохранить результаты как базовую линию")
+    parser.add_argument("--baseline", help="сравнить с базовой линией из JSON")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое ухудшение, доля")
+    args = parser.parse_args(argv)
+
+    await seed(args.users, args.payouts, args.applications)
+
+    # Диспетчер, middleware и хендлеры — те же, что в проде
+    from main import dp
+    from services.leaderboard import leaderboard
+    await leaderboard.warm_up()
+
+    counter = [0]
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *_: counter.__setitem__(0, counter[0] + 1))
+    session = RecordingSession()
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session)
+
+    results = {}
+    print(f"{'scenario':<20} {'upd/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'q/upd':>6} {'api/upd':>7} {'inl/upd':>7} {'err':>5}")
+    for scenario in build_scenarios(args.users):
+        if args.scenario and scenario.name not in args.scenario:
+            continue
+        if scenario.backends and engine.dialect.name not in scenario.backends:
+            print(f"{scenario.name:<20} skipped: needs {', '.join(scenario.backends)}")
+            continue
+        result = await run_scenario(
+            dp, bot, session, scenario, args.flows, args.warmup, args.concurrency, counter
+        )
+        results[scenario.name] = result
+        print(
+            f"{scenario.name:<20} {result['updates_per_s']:9.0f} {result['p50_ms']:8.2f} {result['p95_ms']:8.2f} "
+            f"{result['p99_ms']:8.2f} {result['queries_per_update']:6.2f} {result['api_calls_per_update']:7.2f} "
+            f"{result['inlined_per_update']:7.2f} {result['errors']:5d}"
+        )
+
+    await engine.dispose()
+
+    report = {
+        "database": engine.url.get_backend_name(),
+        "concurrency": args.concurrency,
+        "flows": args.flows,
+        "scenarios": results,
+    }
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Saved {path}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("database") != report["database"] or baseline.get("concurrency") != args.concurrency:
+            print("Baseline was recorded with a different database or concurrency, comparison is not meaningful.")
+        regressions = compare(results, baseline.get("scenarios", {}), args.threshold)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            return 1
+        print(f"No regressions against {args.baseline} (threshold {args.threshold:.0%}).")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,93 @@
+"""
+Память и скорость потоковой выгрузки payouts (services.export) на 10k / 100k / 1M строк
+в сравнении с наивной выгрузкой через execute().all().
+
+    BENCH_DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.export
+    BENCH_DATABASE_URL=... python -m benchmarks.export --rows 1000000 --format ndjson
+
+Пик памяти считается tracemalloc (только аллокации Python), поэтому время с ним завышено;
+для чистой скорости есть --no-trace.
+ВНИМАНИЕ: таблицы в базе BENCH_DATABASE_URL пересоздаются — только для локального Postgres.
+"""
+import argparse
+import asyncio
+import os
+import time
+import tracemalloc
+
+# База бенчмарка подменяет рабочую до импорта config/database
+if os.getenv("BENCH_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["BENCH_DATABASE_URL"]
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://bench@localhost/bench")
+
+from database import Base, SessionLocal, engine  # noqa: E402
+from services.export import CSV, EXPORTS, MEDIA_TYPES, export_body, export_query  # noqa: E402
+
+
+async def seed(rows: int, users: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql(
+            f"INSERT INTO users (user_id, name, role, payout) "
+            f"SELECT g, 'user' || g, 'user', 0 FROM generate_series(1, {users}) g"
+        )
+        await conn.exec_driver_sql(
+            f"INSERT INTO payouts (id, user_id, amount, issued_by, created_at) "
+            f"SELECT g, 1 + g % {users}, (g % 100000) / 100.0 + 1, 1, "
+            f"now() - make_interval(secs => g % 2592000) FROM generate_series(1, {rows}) g"
+        )
+        await conn.exec_driver_sql("ANALYZE")
+
+
+async def measure(fn, trace: bool) -> dict:
+    if trace:
+        tracemalloc.start()
+    started = time.perf_counter()
+    size = await fn()
+    elapsed = time.perf_counter() - started
+    result = {"time_s": elapsed, "mb": size / 2 ** 20, "mb_per_s": size / 2 ** 20 / elapsed}
+    if trace:
+        result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+    return result
+
+
+async def streamed(fmt: str) -> int:
+    size = 0
+    async for chunk in export_body("payouts", fmt):
+        size += len(chunk)
+    return size
+
+
+async def naive(fmt: str) -> int:
+    # Всё в память: все строки и всё тело ответа целиком
+    spec = EXPORTS["payouts"]
+    async with SessionLocal() as session:
+        rows = (await session.execute(export_query(spec))).all()
+    body = "\n".join(",".join("" if value is None else str(value) for value in row) for row in rows)
+    return len(body.encode())
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк потоковой выгрузки")
+    parser.add_argument("--rows", type=int, nargs="*", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--format", choices=list(MEDIA_TYPES), default=CSV)
+    parser.add_argument("--no-naive", action="store_true", help="не запускать выгрузку через .all()")
+    parser.add_argument("--no-trace", action="store_true", help="без tracemalloc, только скорость")
+    args = parser.parse_args(argv)
+
+    for rows in args.rows:
+        users = max(100, rows // 20)
+        print(f"== {rows} payouts ({args.format})")
+        await seed(rows, users)
+        runs = [("stream", streamed)] + ([] if args.no_naive else [("naive", naive)])
+        for name, fn in runs:
+            result = await measure(lambda: fn(args.format), not args.no_trace)
+            print("  " + name.ljust(8) + "  ".join(f"{key} {value:10.2f}" for key, value in result.items()))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,41 @@
+import itertools
+import time
+import typing
+
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import Chat, Message
+
+
+class RecordingSession(BaseSession):
+    """
+    Сессия бота без сети: запоминает исходящие вызовы и отвечает правдоподобными объектами.
+    Методы, возвращающие Message, получают сообщение с текстом запроса, остальные — True.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.calls: list[TelegramMethod] = []
+        self._message_ids = itertools.count(1)
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def make_request(self, bot, method: TelegramMethod, timeout=None):
+        self.calls.append(method)
+        returning = method.__returning__
+        if returning is Message or Message in typing.get_args(returning):
+            chat_id = getattr(method, "chat_id", None)
+            return Message(
+                message_id=next(self._message_ids),
+                date=int(time.time()),
+                chat=Chat(id=chat_id if isinstance(chat_id, int) else 0, type="private"),
+                text=getattr(method, "text", None),
+            )
+        return True
+
+    def reset(self):
+        self.calls.clear()
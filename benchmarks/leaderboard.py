@@ -0,0 +1,146 @@
+"""
+Сравнение in-memory лидерборда (services.leaderboard) с database.get_top_users
+на 10k / 100k / 1M строк payouts.
+
+    python -m benchmarks.leaderboard                      # только лидерборд в памяти
+    BENCH_DATABASE_URL=postgresql+asyncpg://... python -m benchmarks.leaderboard
+
+ВНИМАНИЕ: с BENCH_DATABASE_URL таблицы в этой базе пересоздаются — только для локального Postgres.
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+# База бенчмарка подменяет рабочую до импорта config/database
+if os.getenv("BENCH_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["BENCH_DATABASE_URL"]
+os.environ.setdefault("DATABASE_URL", "postgresql+asyncpg://bench@localhost/bench")
+
+from sqlalchemy import desc, func, insert, select  # noqa: E402
+
+import database  # noqa: E402
+from database import Base, Payout, User, engine, SessionLocal, get_top_users  # noqa: E402
+from services.leaderboard import Leaderboard  # noqa: E402
+from services.payout_rollups import rebuild_rollups  # noqa: E402
+
+PERIODS = ("day", "week", "month")
+
+
+def generate_payouts(rows: int, users: int, seed: int = 42):
+    rnd = random.Random(seed)
+    now = datetime.utcnow()
+    for payout_id in range(1, rows + 1):
+        yield {
+            "id": payout_id,
+            "user_id": rnd.randint(1, users),
+            "amount": Decimal(rnd.randint(100, 100000)) / 100,
+            "created_at": now - timedelta(seconds=rnd.randint(0, 30 * 24 * 3600 - 1)),
+        }
+
+
+def timeit(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) / repeat
+
+
+async def atimeit(fn, repeat: int) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await fn()
+    return (time.perf_counter() - started) / repeat
+
+
+def bench_memory(rows: int, users: int) -> dict:
+    board = Leaderboard()
+    started = time.perf_counter()
+    for payout in generate_payouts(rows, users):
+        board.record(payout["user_id"], payout["amount"], payout["created_at"])
+    result = {"load_s": time.perf_counter() - started}
+    for period in PERIODS:
+        result[f"top_{period}_us"] = timeit(lambda: board.top(period), 10000) * 1e6
+        # Худший случай: уменьшение суммы у лидера заставляет пересчитать топ окна
+        leader = board.top(period, 1)[0]["user_id"]
+
+        def top_after_decrease():
+            board.record(leader, Decimal("-0.01"))
+            board.top(period)
+
+        result[f"top_{period}_dirty_us"] = timeit(top_after_decrease, 50) * 1e6
+    return result
+
+
+async def raw_top(period: str):
+    # Исходная реализация get_top_users: агрегация по сырому журналу payouts
+    since = datetime.utcnow() - {"day": timedelta(days=1), "week": timedelta(weeks=1)}.get(period, timedelta(days=30))
+    async with SessionLocal() as session:
+        result = await session.execute(
+            select(User.name, func.sum(Payout.amount).label("earned"))
+            .join(Payout, Payout.user_id == User.user_id)
+            .where(Payout.created_at >= since)
+            .group_by(User.user_id)
+            .order_by(desc("earned"))
+            .limit(10)
+        )
+        return result.mappings().all()
+
+
+async def seed(rows: int, users: int):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    async with engine.begin() as conn:
+        await conn.execute(insert(User), [{"user_id": i, "name": f"user{i}"} for i in range(1, users + 1)])
+        batch = []
+        for payout in generate_payouts(rows, users):
+            batch.append(payout)
+            if len(batch) == 20000:
+                await conn.execute(insert(Payout), batch)
+                batch = []
+        if batch:
+            await conn.execute(insert(Payout), batch)
+        await conn.exec_driver_sql("ANALYZE")
+    await rebuild_rollups()
+
+
+async def bench_database(rows: int, users: int, repeat: int) -> dict:
+    await seed(rows, users)
+    result = {}
+    for period in PERIODS:
+        result[f"raw_{period}_ms"] = await atimeit(lambda: raw_top(period), repeat) * 1e3
+        result[f"rollup_{period}_ms"] = await atimeit(lambda: get_top_users(period), repeat) * 1e3
+    board = Leaderboard()
+    started = time.perf_counter()
+    await board.warm_up()
+    database.payout_listeners.remove(board.on_payout)
+    result["warm_up_s"] = time.perf_counter() - started
+    for period in PERIODS:
+        result[f"memory_{period}_us"] = timeit(lambda: board.top(period), 10000) * 1e6
+    return result
+
+
+async def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк лидерборда")
+    parser.add_argument("--rows", type=int, nargs="*", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeat", type=int, default=20, help="повторов для запросов к БД")
+    args = parser.parse_args(argv)
+
+    use_db = bool(os.getenv("BENCH_DATABASE_URL"))
+    for rows in args.rows:
+        users = max(100, rows // 20)
+        print(f"== {rows} payouts, {users} users")
+        for key, value in bench_memory(rows, users).items():
+            print(f"  memory  {key:<22} {value:12.2f}")
+        if use_db:
+            for key, value in (await bench_database(rows, users, args.repeat)).items():
+                print(f"  db      {key:<22} {value:12.2f}")
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+"""
+Микробенчмарк разбора тела вебхука: старый путь (request.json() -> dict -> Update(**data),
+f-строка с payload в лог, перемонтирование апдейта в feed_update, JSONResponse)
+против нового (Update.model_validate_json по байтам с контекстом bot, готовый ответ).
+
+    python -m benchmarks.webhook
+    python -m benchmarks.webhook --number 20000
+
+Печатает CPU-время на запрос для типичных message и callback_query.
+"""
+import argparse
+import json
+import os
+import time
+
+os.environ.setdefault("BOT_TOKEN", "123456:bench")
+
+from aiogram import Bot  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+from fastapi.responses import JSONResponse, Response  # noqa: E402
+
+PAYLOADS = {
+    "message": {
+        "update_id": 912345678,
+        "message": {
+            "message_id": 4821,
+            "date": 1717171717,
+            "chat": {"id": 123456789, "type": "private", "first_name": "Иван", "username": "ivan_petrov"},
+            "from": {
+                "id": 123456789, "is_bot": False, "first_name": "Иван",
+                "username": "ivan_petrov", "language_code": "ru",
+            },
+            "text": "👤 Профиль",
+        },
+    },
+    "callback_query": {
+        "update_id": 912345679,
+        "callback_query": {
+            "id": "5300163648316913154",
+            "from": {
+                "id": 123456789, "is_bot": False, "first_name": "Иван",
+                "username": "ivan_petrov", "language_code": "ru",
+            },
+            "chat_instance": "-3718429930417298071",
+            "data": "apps:gt:1717171717000000:42:5",
+            "message": {
+                "message_id": 4822,
+                "date": 1717171720,
+                "chat": {"id": 123456789, "type": "private", "first_name": "Иван", "username": "ivan_petrov"},
+                "from": {"id": 7000000001, "is_bot": True, "first_name": "Bot", "username": "bench_bot"},
+                "text": "📬 Заявки 1–5",
+                "reply_markup": {"inline_keyboard": [
+                    [{"text": "✅ Одобрить", "callback_data": "appact:approve:42:1717171717000000:42:5"},
+                     {"text": "❌ Отклонить", "callback_data": "appact:reject:42:1717171717000000:42:5"}],
+                    [{"text": "➡️ Далее", "callback_data": "apps:gt:1717171717000000:42:5"}],
+                ]},
+            },
+        },
+    },
+}
+
+OK = Response(content=b'{"status":"ok"}', media_type="application/json")
+
+
+def old_path(body: bytes, bot: Bot):
+    data = json.loads(body)
+    message = f"Received update: {data}"
+    update = Update(**data)
+    # feed_update перемонтирует апдейт, не привязанный к bot
+    update = Update.model_validate(update.model_dump(), context={"bot": bot})
+    message = f"Update processed: {data}"
+    return update, message, JSONResponse(content={"status": "ok"})
+
+
+def new_path(body: bytes, bot: Bot):
+    return Update.model_validate_json(body, context={"bot": bot}), OK
+
+
+def cpu_per_call(fn, number: int) -> float:
+    started = time.process_time()
+    for _ in range(number):
+        fn()
+    return (time.process_time() - started) / number
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Микробенчмарк разбора тела вебхука")
+    parser.add_argument("--number", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    bot = Bot(token=os.environ["BOT_TOKEN"])
+    print(f"{'payload':<16} {'bytes':>6} {'old us':>9} {'new us':>9} {'saved us':>9} {'speedup':>8}")
+    for name, payload in PAYLOADS.items():
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        # Прогрев: ленивые схемы pydantic и кэши
+        for _ in range(200):
+            old_path(body, bot)
+            new_path(body, bot)
+        old = cpu_per_call(lambda: old_path(body, bot), args.number) * 1e6
+        new = cpu_per_call(lambda: new_path(body, bot), args.number) * 1e6
+        print(f"{name:<16} {len(body):6d} {old:9.1f} {new:9.1f} {old - new:9.1f} {old / new:7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
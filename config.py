@@ -9,3 +9,96 @@ SUPERADMIN_ID = int(os.getenv("SUPERADMIN_ID", "0"))
 SUPER_ADMINS = list(map(int, os.getenv("SUPER_ADMINS", "").split(","))) if os.getenv("SUPER_ADMINS") else []
 CHANNEL_IDS = list(map(int, os.getenv("CHANNEL_IDS", "").split(","))) if os.getenv("CHANNEL_IDS") else []
 WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+
+# HTTP-сессия Bot API (одна на процесс)
+BOT_API_URL = os.getenv("BOT_API_URL")  # свой Bot API сервер или локальная заглушка, по умолчанию api.telegram.org
+BOT_INTERACTIVE_CONCURRENCY = int(os.getenv("BOT_INTERACTIVE_CONCURRENCY", "50"))  # ответы на апдейты
+BOT_BULK_CONCURRENCY = int(os.getenv("BOT_BULK_CONCURRENCY", "20"))  # рассылки
+BOT_KEEPALIVE_TIMEOUT = float(os.getenv("BOT_KEEPALIVE_TIMEOUT", "60"))
+BOT_DNS_CACHE_TTL = int(os.getenv("BOT_DNS_CACHE_TTL", "300"))
+BOT_REQUEST_TIMEOUT = float(os.getenv("BOT_REQUEST_TIMEOUT", "30"))
+# Таймауты по методам, сек: "sendMessage=10,answerCallbackQuery=5"
+BOT_METHOD_TIMEOUTS = {
+    "answerCallbackQuery": 5.0,
+    "sendMessage": 10.0,
+    "editMessageText": 10.0,
+    **{
+        name.strip(): float(value)
+        for name, _, value in (item.partition("=") for item in os.getenv("BOT_METHOD_TIMEOUTS", "").split(","))
+        if name.strip() and value
+    },
+}
+
+# Рассылка "Пост в бота"
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "30"))  # сообщений в секунду, лимит Telegram
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "500"))
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+BROADCAST_LEASE_SECONDS = int(os.getenv("BROADCAST_LEASE_SECONDS", "120"))
+
+# Быстрый ответ вебхука: апдейты обрабатываются воркерами из очереди
+WEBHOOK_QUEUE_ENABLED = os.getenv("WEBHOOK_QUEUE_ENABLED", "0") == "1"
+WEBHOOK_QUEUE_WORKERS = int(os.getenv("WEBHOOK_QUEUE_WORKERS", "16"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1024"))
+WEBHOOK_QUEUE_PUT_TIMEOUT = float(os.getenv("WEBHOOK_QUEUE_PUT_TIMEOUT", "2"))
+# Последний вызов API хендлера отдаётся в ответе на вебхук (без очереди), а не отдельным запросом
+WEBHOOK_REPLY_INLINE = os.getenv("WEBHOOK_REPLY_INLINE", "1") == "1"
+
+# Дедупликация повторных доставок апдейтов (Telegram повторяет апдейт при таймауте или 500)
+UPDATE_DEDUPE_WINDOW = int(os.getenv("UPDATE_DEDUPE_WINDOW", "10000"))  # последних update_id в памяти
+UPDATE_DEDUPE_DB = os.getenv("UPDATE_DEDUPE_DB", "0") == "1"  # общая таблица для всех воркеров
+UPDATE_DEDUPE_TTL = int(os.getenv("UPDATE_DEDUPE_TTL", "86400"))  # сек, Telegram хранит апдейты сутки
+# сек, после которых незавершённую обработку (воркер упал) может перехватить повтор
+UPDATE_DEDUPE_CLAIM_TIMEOUT = int(os.getenv("UPDATE_DEDUPE_CLAIM_TIMEOUT", "120"))
+
+# Лидерборд в памяти: как часто перечитывать сегодняшние суммы из payout_daily (выплаты других воркеров)
+LEADERBOARD_SYNC_INTERVAL = float(os.getenv("LEADERBOARD_SYNC_INTERVAL", "30"))
+
+# Кэш пользователей (роль, ранг, бан) для проверок прав без запросов к БД
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "50000"))
+
+# Индекс банов в памяти: апдейты забаненных отбрасываются до FSM, хендлеров и БД
+BAN_INDEX_REFRESH_INTERVAL = float(os.getenv("BAN_INDEX_REFRESH_INTERVAL", "30"))  # сек, догрузка изменений
+BAN_DURATION_DAYS = int(os.getenv("BAN_DURATION_DAYS", "36500"))  # срок бана из админки, по умолчанию бессрочно
+
+# Ограничение частоты апдейтов на пользователя (token bucket): rate — апдейтов в секунду, burst — запас
+THROTTLE_MESSAGE_RATE = float(os.getenv("THROTTLE_MESSAGE_RATE", "1"))
+THROTTLE_MESSAGE_BURST = int(os.getenv("THROTTLE_MESSAGE_BURST", "5"))
+THROTTLE_CALLBACK_RATE = float(os.getenv("THROTTLE_CALLBACK_RATE", "2"))
+THROTTLE_CALLBACK_BURST = int(os.getenv("THROTTLE_CALLBACK_BURST", "10"))
+THROTTLE_ADMIN_RATE = float(os.getenv("THROTTLE_ADMIN_RATE", "5"))  # апдейты админов (листание заявок и т.п.)
+THROTTLE_ADMIN_BURST = int(os.getenv("THROTTLE_ADMIN_BURST", "30"))
+THROTTLE_MAX_USERS = int(os.getenv("THROTTLE_MAX_USERS", "50000"))  # корзин на класс, LRU
+THROTTLE_NOTICE_INTERVAL = float(os.getenv("THROTTLE_NOTICE_INTERVAL", "10"))  # сек между «не так быстро» одному пользователю; 0 — молча отбрасывать
+
+# Очередь заявок в админке: сколько заявок на одной странице
+APPLICATIONS_PAGE_SIZE = int(os.getenv("APPLICATIONS_PAGE_SIZE", "5"))
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", "8"))  # список пользователей
+
+# Хранилище FSM в Postgres (общее для всех воркеров и реплик)
+FSM_STATE_TTL = int(os.getenv("FSM_STATE_TTL", "86400"))  # сек, брошенные состояния удаляются
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "1"))  # сек, локальный кэш чтений между апдейтами
+FSM_CACHE_MAX_ENTRIES = int(os.getenv("FSM_CACHE_MAX_ENTRIES", "10000"))
+FSM_CLEANUP_INTERVAL = int(os.getenv("FSM_CLEANUP_INTERVAL", "600"))
+
+# Пул соединений с БД (один engine на процесс)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "256"))  # prepared statements asyncpg
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1"
+
+# Логирование: JSON через очередь, payload апдейтов — выборочно
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_JSON = os.getenv("LOG_JSON", "1") == "1"
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0"))  # доля апдейтов с полным payload
+LOG_ERROR_RATE_LIMIT = int(os.getenv("LOG_ERROR_RATE_LIMIT", "5"))  # одинаковых ошибок за окно, 0 — без лимита
+LOG_ERROR_RATE_WINDOW = float(os.getenv("LOG_ERROR_RATE_WINDOW", "60"))
+
+# Выгрузки /export/* для финансов; тем же токеном закрыта диагностика с чувствительными данными
+EXPORT_TOKEN = os.getenv("EXPORT_TOKEN")  # Authorization: Bearer <токен>; не задан — эндпоинты выключены
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "5000"))  # строк на пачку серверного курсора
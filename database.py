@@ -1,15 +1,96 @@
 import os
+import logging
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
+from typing import NamedTuple
 from sqlalchemy import (
     Column, Integer, BigInteger, String, Text, Boolean, DateTime,
-    ForeignKey, func, select, update, desc, text, Numeric
+    ForeignKey, func, select, update, desc, text, Numeric, case, Date, Index, tuple_, and_, or_
 )
+from sqlalchemy.dialects.postgresql import insert as pg_insert, JSONB
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
-from config import DATABASE_URL, SUPERADMIN_ID
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy import event
+from sqlalchemy.orm import declarative_base, sessionmaker, relationship, Session
+from config import (
+    DATABASE_URL, SUPERADMIN_ID, DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE, DB_POOL_PRE_PING, DB_STATEMENT_CACHE_SIZE
+)
+
+logger = logging.getLogger(__name__)
+
+
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    """Пул, который считает ожидание свободного соединения, overflow-соединения и таймауты."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.overflow_events = 0
+        self.timeouts = 0
+
+    def _do_get(self):
+        overflow_before = self._overflow
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            if self._overflow > overflow_before and self._overflow > 0:
+                self.overflow_events += 1
+
+    def stats(self) -> dict:
+        return {
+            "size": self.size(),
+            "checked_in": self.checkedin(),
+            "checked_out": self.checkedout(),
+            "overflow": max(self.overflow(), 0),
+            "max_overflow": self._max_overflow,
+            "checkouts": self.checkouts,
+            "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+            "overflow_events": self.overflow_events,
+            "timeouts": self.timeouts,
+        }
+
+
+def make_engine(url: str = DATABASE_URL):
+    """Единственная фабрика engine: настройки пула берутся из config."""
+    # DB_ECHO включает логгер sqlalchemy.engine в logging_setup, а не отдельный обработчик echo
+    kwargs = {"future": True}
+    if not url.startswith("sqlite"):
+        kwargs.update(
+            poolclass=InstrumentedPool,
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING,
+        )
+    if url.startswith("postgresql+asyncpg"):
+        kwargs["connect_args"] = {"prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+    return create_async_engine(url, **kwargs)
+
+
+def pool_stats() -> dict:
+    pool = engine.pool
+    if isinstance(pool, InstrumentedPool):
+        return pool.stats()
+    return {"status": pool.status()}
+
 
 Base = declarative_base()
-engine = create_async_engine(DATABASE_URL, future=True)
+engine = make_engine()
 SessionLocal = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession)
 
 
@@ -19,9 +100,10 @@ class User(Base):
     name = Column(String, nullable=True)
     contact = Column(String, nullable=True)
     role = Column(String, default="user")
-    payout = Column(BigInteger, default=0)
+    payout = Column(Numeric(14, 2), default=0)  # баланс; меняется только через services/payouts.py
     joined_at = Column(DateTime, server_default=func.now())
     banned_until = Column(DateTime, nullable=True)
+    ban_updated_at = Column(DateTime, nullable=True)  # по нему индекс банов догружает изменения
     user_rank = Column(String, nullable=True)  # убедился, что это user_rank, не rank
 
     # Указываем foreign_keys, чтобы убрать неоднозначность, тк в Application 2 fk к User
@@ -38,6 +120,27 @@ class User(Base):
         foreign_keys="[Payout.user_id]"
     )
 
+    __table_args__ = (
+        Index(
+            "ix_users_ban_updated_at", "ban_updated_at",
+            postgresql_where=text("ban_updated_at IS NOT NULL"),
+        ),
+        # Список пользователей в админке: фильтры с keyset по user_id и поиск по началу имени / контакта
+        Index("ix_users_role_user_id", "role", "user_id"),
+        Index("ix_users_rank_user_id", "user_rank", "user_id"),
+        Index("ix_users_banned_user_id", "user_id", postgresql_where=text("banned_until IS NOT NULL")),
+        Index(
+            "ix_users_name_prefix", func.lower(name).label("name_lower"),
+            postgresql_ops={"name_lower": "text_pattern_ops"},
+        ),
+        Index(
+            "ix_users_contact_prefix", func.lower(contact).label("contact_lower"),
+            postgresql_ops={"contact_lower": "text_pattern_ops"},
+        ),
+        # Выгрузка /export с фильтром по дате регистрации
+        Index("ix_users_joined_at", "joined_at"),
+    )
+
 
 class Application(Base):
     __tablename__ = "applications"
@@ -49,6 +152,16 @@ class Application(Base):
     resolved_by = Column(BigInteger, ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
     resolved_at = Column(DateTime, nullable=True)
 
+    # Частичный индекс под очередь на рассмотрение: keyset-пагинация по (created_at, id)
+    __table_args__ = (
+        Index(
+            "ix_applications_pending", "created_at", "id",
+            postgresql_where=text("status = 'pending'"),
+        ),
+        # Выгрузка /export с фильтром по дате подачи
+        Index("ix_applications_created_at", "created_at"),
+    )
+
     user = relationship(
         "User",
         foreign_keys=[user_id],
@@ -68,6 +181,17 @@ class Payout(Base):
     amount = Column(Numeric(12, 2), nullable=False)  # числовой формат для сумм, лучше decimal
     issued_by = Column(BigInteger, ForeignKey("users.user_id", ondelete="SET NULL"), nullable=True)
     created_at = Column(DateTime, server_default=func.now())
+    idempotency_key = Column(String, nullable=True)  # повтор той же отправки не создаёт вторую выплату
+
+    # Индексы под диапазонные запросы по времени (общие и по пользователю)
+    __table_args__ = (
+        Index("ix_payouts_created_at", "created_at"),
+        Index("ix_payouts_user_id_created_at", "user_id", "created_at"),
+        Index(
+            "ux_payouts_idempotency_key", "idempotency_key", unique=True,
+            postgresql_where=text("idempotency_key IS NOT NULL"),
+        ),
+    )
 
     user = relationship(
         "User",
@@ -81,71 +205,336 @@ class Payout(Base):
     )
 
 
+class PayoutDaily(Base):
+    """Дневная сводка выплат по пользователю. Обновляется в той же транзакции, что и вставка в payouts."""
+    __tablename__ = "payout_daily"
+    user_id = Column(BigInteger, ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    amount = Column(Numeric(14, 2), nullable=False, default=0)
+    payouts_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_payout_daily_day", "day"),
+    )
+
+
+class PayoutDailyTotal(Base):
+    """Дневная сумма выплат по всем пользователям — итог за день одним чтением по ключу."""
+    __tablename__ = "payout_daily_total"
+    day = Column(Date, primary_key=True)
+    amount = Column(Numeric(14, 2), nullable=False, default=0)
+    payouts_count = Column(Integer, nullable=False, default=0)
+
+
 class News(Base):
     __tablename__ = "news"
     id = Column(Integer, primary_key=True)
     content = Column(Text)
     created_at = Column(DateTime, server_default=func.now())
     sent = Column(Boolean, default=False)
+    # Прогресс рассылки, чтобы перезапущенный воркер продолжил с того же места
+    author_id = Column(BigInteger, nullable=True)
+    last_user_id = Column(BigInteger, default=0)  # курсор keyset-пагинации по users.user_id
+    delivered = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    total = Column(Integer, nullable=True)
+    lease_until = Column(DateTime, nullable=True)  # аренда рассылки воркером
+    lease_owner = Column(String, nullable=True)  # токен воркера-владельца аренды
+    finished_at = Column(DateTime, nullable=True)
+
+
+class FsmState(Base):
+    """Состояние FSM aiogram (см. services/fsm_storage.py). Ключ повторяет StorageKey."""
+    __tablename__ = "fsm_states"
+    bot_id = Column(BigInteger, primary_key=True)
+    chat_id = Column(BigInteger, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
+    thread_id = Column(BigInteger, primary_key=True, default=0)
+    business_connection_id = Column(String, primary_key=True, default="")
+    destiny = Column(String, primary_key=True, default="default")
+    state = Column(String, nullable=True)
+    data = Column(JSONB, nullable=False, default=dict)
+    expires_at = Column(DateTime, nullable=False)  # брошенные состояния удаляются по TTL
+
+    __table_args__ = (
+        Index("ix_fsm_states_expires_at", "expires_at"),
+    )
+
+
+class ProcessedUpdate(Base):
+    """Принятые update_id для дедупликации между воркерами (см. services/dedupe.py)."""
+    __tablename__ = "processed_updates"
+    bot_id = Column(BigInteger, primary_key=True)
+    update_id = Column(BigInteger, primary_key=True)
+    received_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # когда занят в обработку
+    processed_at = Column(DateTime, nullable=True)  # NULL — ещё обрабатывается
+
+    __table_args__ = (
+        Index("ix_processed_updates_received_at", "received_at"),
+    )
+
 
+@asynccontextmanager
+async def session_scope(session: AsyncSession | None = None):
+    """
+    Сессия для хелпера: переданная (одна на апдейт, см. middlewares/db.py) или своя.
+    Переданную коммитит владелец, своя коммитится на выходе из блока.
+    """
+    if session is not None:
+        yield session
+        return
+    async with SessionLocal() as own:
+        yield own
+        await own.commit()
 
-# Вспомогательные функции
-async def get_user_by_id(user_id: int):
-    async with SessionLocal() as session:
+
+# Вспомогательные функции. Все принимают необязательную session: без неё открывают свою
+async def get_user_by_id(user_id: int, session: AsyncSession | None = None):
+    async with session_scope(session) as session:
         result = await session.execute(select(User).where(User.user_id == user_id))
         return result.scalar_one_or_none()
 
-async def create_user_if_not_exists(user_id: int):
-    async with SessionLocal() as session:
-        user = await get_user_by_id(user_id)
-        if not user:
-            role = "superadmin" if user_id == SUPERADMIN_ID else "user"
-            new_user = User(user_id=user_id, role=role)
-            session.add(new_user)
-            await session.commit()
-            return new_user
-        else:
-            if user.user_id == SUPERADMIN_ID and user.role != "superadmin":
-                await session.execute(
-                    update(User).where(User.user_id == user_id).values(role="superadmin")
-                )
-                await session.commit()
-                user.role = "superadmin"
-            return user
-
-async def update_user_name(user_id: int, name: str):
-    async with SessionLocal() as session:
+async def create_user_if_not_exists(user_id: int, session: AsyncSession | None = None):
+    # Один INSERT ... ON CONFLICT ... RETURNING: без гонки двух /start и без отдельного SELECT.
+    # DO UPDATE (а не DO NOTHING) нужен, чтобы RETURNING вернул и уже существующую строку;
+    # заодно так повышается до superadmin SUPERADMIN_ID.
+    stmt = pg_insert(User).values(
+        user_id=user_id, role="superadmin" if user_id == SUPERADMIN_ID else "user"
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[User.user_id],
+        set_={"role": case((User.user_id == SUPERADMIN_ID, "superadmin"), else_=User.role)},
+    ).returning(User)
+    async with session_scope(session) as session:
+        return (await session.execute(stmt)).scalar_one()
+
+async def create_users_bulk(user_ids, session: AsyncSession | None = None, chunk_size: int = 5000):
+    """
+    Регистрирует пачку user_id (импорт, пул воркеров) тем же upsert, что create_user_if_not_exists:
+    по одному INSERT ... ON CONFLICT на chunk_size id. Возвращает строки User — новые и уже существующие.
+    """
+    users = []
+    ids = sorted(set(user_ids))
+    async with session_scope(session) as session:
+        for start in range(0, len(ids), chunk_size):
+            stmt = pg_insert(User).values([
+                {"user_id": user_id, "role": "superadmin" if user_id == SUPERADMIN_ID else "user"}
+                for user_id in ids[start:start + chunk_size]
+            ])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[User.user_id],
+                set_={"role": case((User.user_id == SUPERADMIN_ID, "superadmin"), else_=User.role)},
+            ).returning(User)
+            users.extend((await session.execute(stmt)).scalars().all())
+    return users
+
+async def update_user_name(user_id: int, name: str, session: AsyncSession | None = None):
+    async with session_scope(session) as session:
         await session.execute(update(User).where(User.user_id == user_id).values(name=name))
-        await session.commit()
 
-async def update_user_wallet(user_id: int, wallet: str):
-    async with SessionLocal() as session:
+async def update_user_wallet(user_id: int, wallet: str, session: AsyncSession | None = None):
+    async with session_scope(session) as session:
         await session.execute(update(User).where(User.user_id == user_id).values(contact=wallet))
-        await session.commit()
 
-async def get_top_users(period="day"):
-    now = datetime.utcnow()
-    since = now - {
-        "day": timedelta(days=1),
-        "week": timedelta(weeks=1),
-        "month": timedelta(days=30),
-    }.get(period, timedelta(days=1))
+PERIOD_DAYS = {"day": 1, "week": 7, "month": 30}
+
+def period_bounds(period="day", today=None):
+    """Полуоткрытый диапазон дней [start, end) для периода: сегодня, 7 или 30 дней включая сегодня."""
+    today = today or datetime.utcnow().date()
+    days = PERIOD_DAYS.get(period, 1)
+    return today - timedelta(days=days - 1), today + timedelta(days=1)
 
-    async with SessionLocal() as session:
+# Подписчики на закоммиченные выплаты: fn(payout_id, user_id, amount, created_at, name).
+# Вызываются синхронно после коммита, поэтому должны быть быстрыми и не ходить в БД.
+payout_listeners = []
+
+@event.listens_for(Session, "after_commit")
+def _dispatch_payout_events(session):
+    for args in session.info.pop("payout_events", ()):
+        for listener in payout_listeners:
+            try:
+                listener(*args)
+            except Exception as e:
+                logger.error(f"Payout listener {listener} failed: {e}")
+
+@event.listens_for(Session, "after_rollback")
+def _drop_payout_events(session):
+    session.info.pop("payout_events", None)
+
+async def get_top_users(period="day", session: AsyncSession | None = None):
+    start, end = period_bounds(period)
+    async with session_scope(session) as session:
         result = await session.execute(
-            select(User.name, func.sum(Payout.amount).label("earned"))
-            .join(Payout)
-            .where(Payout.created_at >= since)
+            select(User.name, func.sum(PayoutDaily.amount).label("earned"))
+            .join(PayoutDaily, PayoutDaily.user_id == User.user_id)
+            .where(PayoutDaily.day >= start, PayoutDaily.day < end)
             .group_by(User.user_id)
             .order_by(desc("earned"))
             .limit(10)
         )
         return result.mappings().all()
 
-async def get_total_earned_today():
-    today = datetime.utcnow().date()
-    async with SessionLocal() as session:
+async def get_total_earned(period="day", session: AsyncSession | None = None):
+    # Не больше 30 строк по первичному ключу, независимо от размера payouts
+    start, end = period_bounds(period)
+    async with session_scope(session) as session:
         res = await session.execute(
-            select(func.sum(Payout.amount)).where(func.date(Payout.created_at) == today)
+            select(func.sum(PayoutDailyTotal.amount))
+            .where(PayoutDailyTotal.day >= start, PayoutDailyTotal.day < end)
         )
         return res.scalar()
+
+async def get_total_earned_today(session: AsyncSession | None = None):
+    return await get_total_earned("day", session)
+
+# Курсор keyset-пагинации: created_at в микросекундах от эпохи (влезает в callback_data)
+EPOCH = datetime(1970, 1, 1)
+
+def to_cursor(moment: datetime) -> int:
+    return (moment - EPOCH) // timedelta(microseconds=1)
+
+def from_cursor(value: int) -> datetime:
+    return EPOCH + timedelta(microseconds=value)
+
+async def get_pending_applications(cursor_ts: int = 0, cursor_id: int = 0, direction: str = "gte", limit: int = 5,
+                                   session: AsyncSession | None = None):
+    """
+    Страница заявок в статусе pending, упорядоченных по (created_at, id).
+    direction: "gte" — начиная с курсора, "gt" — после курсора, "lt" — перед курсором.
+    Возвращает (заявки, есть_ещё_в_направлении_листания).
+    """
+    key = tuple_(Application.created_at, Application.id)
+    bound = (from_cursor(cursor_ts), cursor_id)
+    query = select(Application).where(Application.status == "pending")
+    if direction == "lt":
+        query = query.where(key < bound).order_by(Application.created_at.desc(), Application.id.desc())
+    else:
+        query = query.where(key >= bound if direction == "gte" else key > bound)
+        query = query.order_by(Application.created_at, Application.id)
+    async with session_scope(session) as session:
+        result = await session.execute(query.limit(limit + 1))
+        applications = result.scalars().all()
+    has_more = len(applications) > limit
+    applications = applications[:limit]
+    if direction == "lt":
+        applications.reverse()
+    return applications, has_more
+
+def _prefix_match(column, prefix: str):
+    # Диапазон вместо LIKE 'x%': индекс text_pattern_ops подходит и для generic-плана prepared statement
+    value = func.lower(column)
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return and_(value.op("~>=~")(prefix), value.op("~<~")(upper))
+
+async def get_users_page(cursor_id: int = 0, direction: str = "gte", limit: int = 8, role: str | None = None,
+                         rank: str | None = None, banned: bool | None = None, search: str | None = None,
+                         session: AsyncSession | None = None):
+    """
+    Страница пользователей по user_id с фильтрами; direction как в get_pending_applications.
+    rank="" — пользователи без ранга. search — user_id или начало имени / контакта (без учёта регистра).
+    Возвращает (пользователи, есть_ещё_в_направлении_листания).
+    """
+    query = select(User)
+    if role is not None:
+        query = query.where(User.role == role)
+    if rank is not None:
+        query = query.where(User.user_rank == rank if rank else User.user_rank.is_(None))
+    if banned is not None:
+        active = User.banned_until > datetime.utcnow()
+        query = query.where(active if banned else or_(User.banned_until.is_(None), ~active))
+    if search:
+        prefix = search.lower()
+        conditions = [_prefix_match(User.name, prefix), _prefix_match(User.contact, prefix)]
+        if search.isdigit() and len(search) < 19:
+            conditions.append(User.user_id == int(search))
+        query = query.where(or_(*conditions))
+    if direction == "lt":
+        query = query.where(User.user_id < cursor_id).order_by(User.user_id.desc())
+    else:
+        query = query.where(User.user_id >= cursor_id if direction == "gte" else User.user_id > cursor_id)
+        query = query.order_by(User.user_id)
+    async with session_scope(session) as session:
+        result = await session.execute(query.limit(limit + 1))
+        users = result.scalars().all()
+    has_more = len(users) > limit
+    users = users[:limit]
+    if direction == "lt":
+        users.reverse()
+    return users, has_more
+
+class ResolveResult(NamedTuple):
+    won: bool  # именно этот вызов перевёл заявку из pending
+    user_id: int | None  # автор заявки (None — заявки нет)
+    status: str | None  # текущий статус
+    resolved_by: int | None
+    resolver_name: str | None
+
+async def resolve_application(app_id: int, status: str, resolved_by: int,
+                              session: AsyncSession | None = None) -> ResolveResult:
+    """
+    Атомарно забирает заявку: UPDATE ... WHERE id = :id AND status = 'pending' RETURNING.
+    Если два админа нажали одновременно, выигрывает один; второй получает won=False
+    и того, кто заявку уже обработал (это единственный путь со вторым запросом).
+    С переданной session решение фиксируется коммитом вызывающего.
+    """
+    async with session_scope(session) as session:
+        result = await session.execute(
+            update(Application)
+            .where(Application.id == app_id, Application.status == "pending")
+            .values(status=status, resolved_by=resolved_by, resolved_at=func.now())
+            .returning(Application.user_id)
+        )
+        user_id = result.scalar_one_or_none()
+        if user_id is not None:
+            return ResolveResult(True, user_id, status, resolved_by, None)
+
+        result = await session.execute(
+            select(Application.user_id, Application.status, Application.resolved_by, User.name)
+            .outerjoin(User, User.user_id == Application.resolved_by)
+            .where(Application.id == app_id)
+        )
+        row = result.first()
+    if row is None:
+        return ResolveResult(False, None, None, None, None)
+    return ResolveResult(False, row.user_id, row.status, row.resolved_by, row.name)
+
+async def resolve_pending_range(first_ts: int, first_id: int, last_ts: int, last_id: int, status: str,
+                                resolved_by: int, limit: int, session: AsyncSession | None = None):
+    """
+    Одним UPDATE переводит все ещё pending заявки с ключом (created_at, id) в диапазоне
+    [first, last] (это страница, которую видел админ). Возвращает [(id, user_id)] обработанных.
+    """
+    key = tuple_(Application.created_at, Application.id)
+    page = (
+        select(Application.id)
+        .where(
+            Application.status == "pending",
+            key >= (from_cursor(first_ts), first_id),
+            key <= (from_cursor(last_ts), last_id),
+        )
+        .order_by(Application.created_at, Application.id)
+        .limit(limit)
+    )
+    async with session_scope(session) as session:
+        result = await session.execute(
+            update(Application)
+            .where(Application.id.in_(page.scalar_subquery()), Application.status == "pending")
+            .values(status=status, resolved_by=resolved_by, resolved_at=func.now())
+            .returning(Application.id, Application.user_id)
+        )
+        return result.all()
+
+async def get_user_payout_history(user_id: int, days: int = 30, session: AsyncSession | None = None):
+    """Заработок пользователя по дням за последние days дней (только дни с выплатами)."""
+    today = datetime.utcnow().date()
+    async with session_scope(session) as session:
+        result = await session.execute(
+            select(PayoutDaily.day, PayoutDaily.amount, PayoutDaily.payouts_count)
+            .where(
+                PayoutDaily.user_id == user_id,
+                PayoutDaily.day >= today - timedelta(days=days - 1),
+                PayoutDaily.day < today + timedelta(days=1),
+            )
+            .order_by(PayoutDaily.day)
+        )
+        return result.mappings().all()
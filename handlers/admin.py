@@ -1,20 +1,32 @@
+import csv
+import html
 import logging
 from aiogram import Router, types, F
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters import StateFilter
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.fsm.context import FSMContext
-from database import Application, SessionLocal, User, Payout
-from sqlalchemy.future import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import (
+    User, Payout, get_pending_applications, get_users_page, to_cursor,
+    resolve_application, resolve_pending_range, ResolveResult
+)
 from datetime import datetime, timedelta
-from config import CHANNEL_IDS
+from config import CHANNEL_IDS, APPLICATIONS_PAGE_SIZE, USERS_PAGE_SIZE, BAN_DURATION_DAYS
+from services.ban_index import ban_index
+from services.broadcast import start_broadcast
+from services.payout_import import import_payouts, telegram_file_chunks
+from services.payouts import apply_payout, parse_amount, PayoutResult, APPLIED, DUPLICATE, RANK_FACTORS
+from services.user_cache import user_cache, UserSnapshot
 
 router = Router()
 
-# Настройка логирования (вывод в консоль)
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+# Логирование настраивается один раз в logging_setup
 logger = logging.getLogger(__name__)
 
-# Обработчик для получения номера телефона
-@router.message(F.entities)
+# Обработчик для получения номера телефона (только вне сценариев: поиск и посты тоже бывают со ссылками)
+@router.message(StateFilter(None), F.entities)
 async def handle_phone_number(message: types.Message):
     # Проверяем, есть ли в сообщении телефон
     phone_entity = next((entity for entity in message.entities if entity.type == 'phone_number'), None)
@@ -30,369 +42,749 @@ admin_panel_kb = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text="➕ Назначить админа", callback_data="assign_admin")],
     [InlineKeyboardButton(text="🔧 Изменить ранг пользователя", callback_data="change_rank")],
     [InlineKeyboardButton(text="💰 Выдача / Вычитание выплат", callback_data="manage_payout")],
+    [InlineKeyboardButton(text="📥 Импорт выплат (CSV)", callback_data="import_payouts")],
     [InlineKeyboardButton(text="🚫 Бан / Заморозка пользователя", callback_data="ban_user")],
     [InlineKeyboardButton(text="📝 Пост в бота", callback_data="post_bot")],
     [InlineKeyboardButton(text="📢 Пост в канал", callback_data="post_channel")],
 ])
 
-# Утилиты проверки роли
-async def is_admin(user_id: int):
-    async with SessionLocal() as session:
-        result = await session.execute(select(User).where(User.user_id == user_id))
-        user = result.scalar_one_or_none()
-        return user and user.role in ("admin", "superadmin")
+# Утилиты проверки роли (через кэш, хендлерам обычно хватает db_user из UserMiddleware)
+async def is_admin(user_id: int, session: AsyncSession | None = None):
+    user = await user_cache.get(user_id, session)
+    return bool(user and user.is_admin)
 
-async def is_superadmin(user_id: int):
-    async with SessionLocal() as session:
-        result = await session.execute(select(User).where(User.user_id == user_id))
-        user = result.scalar_one_or_none()
-        return user and user.role == "superadmin"
+async def is_superadmin(user_id: int, session: AsyncSession | None = None):
+    user = await user_cache.get(user_id, session)
+    return bool(user and user.is_superadmin)
 
 # Показываем админ-панель
 @router.message(F.text == "🛠 Админ-панель")
-async def admin_panel(message: types.Message):
-    if not await is_admin(message.from_user.id):
+async def admin_panel(message: types.Message, db_user: UserSnapshot | None):
+    if not (db_user and db_user.is_admin):
         await message.answer("❌ У вас нет прав администратора.")
         logger.warning(f"User {message.from_user.id} tried to access admin panel without permissions.")
         return
     await message.answer("👷‍♂️ Админ-панель", reply_markup=admin_panel_kb)
     logger.info(f"Admin panel accessed by {message.from_user.id}")
 
-# 1) Просмотр заявок
+# 1) Просмотр заявок: одна страница в одном сообщении, листание редактирует его на месте
+class AppsPage(CallbackData, prefix="apps"):
+    dir: str  # gte — с курсора (перерисовка), gt — следующая, lt — предыдущая
+    ts: int  # курсор: created_at в микросекундах
+    id: int
+    size: int
+
+class AppAction(CallbackData, prefix="appact"):
+    action: str  # approve / reject
+    app_id: int
+    ts: int  # начало текущей страницы, чтобы перерисовать её после действия
+    id: int
+    size: int
+
+class AppsApproveAll(CallbackData, prefix="appall"):
+    ts: int  # первая заявка страницы
+    id: int
+    last_ts: int  # последняя заявка страницы
+    last_id: int
+    size: int
+
+MAX_PAGE_SIZE = 10
+MAX_APPLICATION_TEXT = 500
+
+async def render_applications_page(ts: int, app_id: int, direction: str, size: int, session: AsyncSession):
+    size = max(1, min(size, MAX_PAGE_SIZE))
+    applications, has_more = await get_pending_applications(ts, app_id, direction, size, session)
+    if not applications and (ts, app_id) != (0, 0):
+        # Заявки на этой странице уже разобрали — показываем первую
+        ts, app_id, direction = 0, 0, "gte"
+        applications, has_more = await get_pending_applications(ts, app_id, direction, size, session)
+    if not applications:
+        return "Нет новых заявок.", None
+
+    first, last = applications[0], applications[-1]
+    page_ts, page_id = to_cursor(first.created_at), first.id
+    text = "<b>📬 Заявки на рассмотрении</b>\n\n"
+    rows = []
+    for app in applications:
+        message_text = app.message or ""
+        if len(message_text) > MAX_APPLICATION_TEXT:
+            message_text = message_text[:MAX_APPLICATION_TEXT] + "…"
+        text += (
+            f"<b>#{app.id}</b> от пользователя {app.user_id} · {app.created_at:%d.%m %H:%M}\n"
+            f"{html.escape(message_text)}\n\n"
+        )
+        rows.append([
+            InlineKeyboardButton(
+                text=f"✅ #{app.id}",
+                callback_data=AppAction(action="approve", app_id=app.id, ts=page_ts, id=page_id, size=size).pack()
+            ),
+            InlineKeyboardButton(
+                text=f"❌ #{app.id}",
+                callback_data=AppAction(action="reject", app_id=app.id, ts=page_ts, id=page_id, size=size).pack()
+            ),
+        ])
+
+    rows.append([InlineKeyboardButton(
+        text="✅ Одобрить все на странице",
+        callback_data=AppsApproveAll(
+            ts=page_ts, id=page_id, last_ts=to_cursor(last.created_at), last_id=last.id, size=size
+        ).pack()
+    )])
+
+    has_prev = has_more if direction == "lt" else (ts, app_id) != (0, 0)
+    has_next = has_more if direction != "lt" else True
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(
+            text="⬅️ Назад", callback_data=AppsPage(dir="lt", ts=page_ts, id=page_id, size=size).pack()
+        ))
+    if has_next:
+        nav.append(InlineKeyboardButton(
+            text="Вперёд ➡️",
+            callback_data=AppsPage(dir="gt", ts=to_cursor(last.created_at), id=last.id, size=size).pack()
+        ))
+    if nav:
+        rows.append(nav)
+    return text, InlineKeyboardMarkup(inline_keyboard=rows)
+
+async def show_applications_page(callback: types.CallbackQuery, ts: int, app_id: int, direction: str, size: int,
+                                 session: AsyncSession):
+    text, keyboard = await render_applications_page(ts, app_id, direction, size, session)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest as e:
+        # "message is not modified" — страница не изменилась
+        logger.debug(f"Applications page not edited: {e}")
+
 @router.callback_query(F.data == "view_applications")
-async def view_applications(callback: types.CallbackQuery):
+async def view_applications(callback: types.CallbackQuery, db_user: UserSnapshot | None, session: AsyncSession):
     await callback.answer()
 
-    if not await is_admin(callback.from_user.id):
+    if not (db_user and db_user.is_admin):
         await callback.answer("Нет доступа", show_alert=True)
         logger.warning(f"User {callback.from_user.id} tried to view applications without admin rights.")
         return
-    async with SessionLocal() as session:
-        result = await session.execute(select(Application).where(Application.status == "pending"))
-        applications = result.scalars().all()
 
-    if not applications:
-        await callback.message.answer("Нет новых заявок.")
+    text, keyboard = await render_applications_page(0, 0, "gte", APPLICATIONS_PAGE_SIZE, session)
+    await callback.message.answer(text, reply_markup=keyboard)
+    if keyboard is None:
         logger.info(f"No new applications available for {callback.from_user.id}.")
+
+@router.callback_query(AppsPage.filter())
+async def applications_page(callback: types.CallbackQuery, callback_data: AppsPage, db_user: UserSnapshot | None,
+                            session: AsyncSession):
+    if not (db_user and db_user.is_admin):
+        await callback.answer("Нет доступа", show_alert=True)
         return
+    await callback.answer()
+    await show_applications_page(
+        callback, callback_data.ts, callback_data.id, callback_data.dir, callback_data.size, session
+    )
 
-    for app in applications:
-        text = (
-            f"<b>Заявка от пользователя {app.user_id}</b>\n\n"
-            f"Сообщение:\n{app.message}\n\n"
-            f"Статус: {app.status}"
+# 2) Одобрение или отклонение заявки
+STATUS_LABELS = {"approved": "одобрена", "rejected": "отклонена", "pending": "ожидает"}
+
+def already_resolved_text(app_id: int, result: ResolveResult) -> str:
+    if result.user_id is None:
+        return "Заявка не найдена."
+    who = result.resolver_name or result.resolved_by or "другим администратором"
+    return f"Заявка #{app_id} уже обработана ({STATUS_LABELS.get(result.status, result.status)}): {who}."
+
+@router.callback_query(AppAction.filter())
+async def application_action(callback: types.CallbackQuery, callback_data: AppAction, db_user: UserSnapshot | None,
+                             session: AsyncSession):
+    if not (db_user and db_user.is_admin):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    status = "approved" if callback_data.action == "approve" else "rejected"
+    result = await resolve_application(callback_data.app_id, status, callback.from_user.id, session)
+    # Фиксируем решение до ответа админу и перерисовки страницы
+    await session.commit()
+    if result.won:
+        await callback.answer(f"Заявка #{callback_data.app_id} {STATUS_LABELS[status]}.")
+        logger.info(f"Application {callback_data.app_id} {status} by {callback.from_user.id}.")
+    else:
+        await callback.answer(already_resolved_text(callback_data.app_id, result), show_alert=True)
+        logger.info(f"Application {callback_data.app_id} already resolved, {callback.from_user.id} lost the race.")
+    await show_applications_page(callback, callback_data.ts, callback_data.id, "gte", callback_data.size, session)
+
+@router.callback_query(AppsApproveAll.filter())
+async def approve_applications_page(callback: types.CallbackQuery, callback_data: AppsApproveAll,
+                                    db_user: UserSnapshot | None, session: AsyncSession):
+    if not (db_user and db_user.is_admin):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    resolved = await resolve_pending_range(
+        callback_data.ts, callback_data.id, callback_data.last_ts, callback_data.last_id,
+        "approved", callback.from_user.id, MAX_PAGE_SIZE, session
+    )
+    await session.commit()
+    await callback.answer(f"Одобрено заявок: {len(resolved)}.")
+    logger.info(f"Applications {[app_id for app_id, _ in resolved]} approved by {callback.from_user.id}.")
+    await show_applications_page(callback, callback_data.ts, callback_data.id, "gte", callback_data.size, session)
+
+# Кнопки из старых сообщений (по одной заявке на сообщение)
+async def resolve_single_application(callback: types.CallbackQuery, db_user: UserSnapshot | None, status: str,
+                                     session: AsyncSession):
+    if not (db_user and db_user.is_admin):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    app_id = int(callback.data.split("_")[1])
+    result = await resolve_application(app_id, status, callback.from_user.id, session)
+    await session.commit()
+    if result.won:
+        await callback.message.answer(f"Заявка от пользователя {result.user_id} {STATUS_LABELS[status]}.")
+        logger.info(f"Application {app_id} {status} by {callback.from_user.id}.")
+    else:
+        await callback.message.answer(already_resolved_text(app_id, result))
+        logger.warning(f"Application {app_id} not resolved by {callback.from_user.id}: {result.status}.")
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("approve_"))
+async def approve_application(callback: types.CallbackQuery, db_user: UserSnapshot | None, session: AsyncSession):
+    await resolve_single_application(callback, db_user, "approved", session)
+
+@router.callback_query(F.data.startswith("reject_"))
+async def reject_application(callback: types.CallbackQuery, db_user: UserSnapshot | None, session: AsyncSession):
+    await resolve_single_application(callback, db_user, "rejected", session)
+
+# 2a) Список пользователей: фильтры лежат в данных FSM, листание редактирует одно сообщение на месте
+class UsersPage(CallbackData, prefix="users"):
+    dir: str  # gte / gt / lt, как у заявок
+    id: int  # курсор: user_id
+
+class UsersFilter(CallbackData, prefix="usrf"):
+    field: str  # role / rank / banned — следующее значение по кругу; search — поиск; reset — сброс
+
+class UserAction(CallbackData, prefix="usract"):
+    action: str  # ban / rank / payout
+    user_id: int
+    page: int  # первый user_id страницы, чтобы перерисовать её после действия
+
+USERS_FILTERS = {
+    "role": [None, "user", "admin", "superadmin"],
+    "rank": [None, *RANK_FACTORS, ""],  # "" — без ранга
+    "banned": [None, True, False],
+}
+MAX_SEARCH_LENGTH = 64
+
+def users_filter_label(field: str, value) -> str:
+    if field == "role":
+        return f"Роль: {value or 'все'}"
+    if field == "rank":
+        return f"Ранг: {'все' if value is None else value or 'без ранга'}"
+    return f"Бан: {'все' if value is None else 'да' if value else 'нет'}"
+
+async def get_users_filter(state: FSMContext) -> dict:
+    return (await state.get_data()).get("users_filter", {})
+
+async def render_users_page(cursor_id: int, direction: str, filters: dict, session: AsyncSession):
+    def load(cursor_id, direction):
+        return get_users_page(
+            cursor_id, direction, USERS_PAGE_SIZE, filters.get("role"), filters.get("rank"),
+            filters.get("banned"), filters.get("search"), session
+        )
+
+    users, has_more = await load(cursor_id, direction)
+    if not users and (cursor_id, direction) != (0, "gte"):
+        # Страница опустела (фильтр больше не подходит) — показываем первую
+        cursor_id, direction = 0, "gte"
+        users, has_more = await load(cursor_id, direction)
+
+    text = "<b>👥 Пользователи</b>\n"
+    if filters.get("search"):
+        text += f"Поиск: «{html.escape(filters['search'])}»\n"
+    text += "\n"
+    if not users:
+        text += "Никого не найдено."
+    now = datetime.utcnow()
+    page_id = users[0].user_id if users else 0
+    rows = []
+    for user in users:
+        banned = bool(user.banned_until and user.banned_until > now)
+        text += (
+            f"<b>{user.user_id}</b> {html.escape(user.name or '—')} · {html.escape(user.contact or '—')}\n"
+            f"{user.role} · {user.user_rank or 'без ранга'} · 💰 {user.payout or 0}"
+            f"{f' · 🚫 до {user.banned_until:%d.%m.%Y}' if banned else ''}\n\n"
         )
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[ 
-            [
-                InlineKeyboardButton(text="✅ Одобрить", callback_data=f"approve_{app.id}"),
-                InlineKeyboardButton(text="❌ Отклонить", callback_data=f"reject_{app.id}")
-            ]
+        rows.append([
+            InlineKeyboardButton(
+                text=f"{'✅' if banned else '🚫'} {user.user_id}",
+                callback_data=UserAction(action="ban", user_id=user.user_id, page=page_id).pack()
+            ),
+            InlineKeyboardButton(
+                text=f"🎖 {user.user_id}",
+                callback_data=UserAction(action="rank", user_id=user.user_id, page=page_id).pack()
+            ),
+            InlineKeyboardButton(
+                text=f"💰 {user.user_id}",
+                callback_data=UserAction(action="payout", user_id=user.user_id, page=page_id).pack()
+            ),
         ])
-        await callback.message.answer(text, reply_markup=keyboard)
 
+    has_prev = has_more if direction == "lt" else cursor_id != 0
+    has_next = has_more if direction != "lt" else True
+    nav = []
+    if users and has_prev:
+        nav.append(InlineKeyboardButton(
+            text="⬅️ Назад", callback_data=UsersPage(dir="lt", id=page_id).pack()
+        ))
+    if users and has_next:
+        nav.append(InlineKeyboardButton(
+            text="Вперёд ➡️", callback_data=UsersPage(dir="gt", id=users[-1].user_id).pack()
+        ))
+    if nav:
+        rows.append(nav)
+    rows.append([
+        InlineKeyboardButton(
+            text=users_filter_label(field, filters.get(field)), callback_data=UsersFilter(field=field).pack()
+        )
+        for field in USERS_FILTERS
+    ])
+    tools = [InlineKeyboardButton(text="🔍 Поиск", callback_data=UsersFilter(field="search").pack())]
+    if filters:
+        tools.append(InlineKeyboardButton(text="✖️ Сбросить", callback_data=UsersFilter(field="reset").pack()))
+    rows.append(tools)
+    return text, InlineKeyboardMarkup(inline_keyboard=rows)
+
+async def show_users_page(callback: types.CallbackQuery, cursor_id: int, direction: str, state: FSMContext,
+                          session: AsyncSession):
+    text, keyboard = await render_users_page(cursor_id, direction, await get_users_filter(state), session)
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest as e:
+        logger.debug(f"Users page not edited: {e}")
+
+@router.callback_query(F.data == "view_users")
+async def view_users(callback: types.CallbackQuery, state: FSMContext, db_user: UserSnapshot | None,
+                     session: AsyncSession):
     await callback.answer()
 
-# 2) Одобрение или отклонение заявки
-@router.callback_query(F.data.startswith("approve_"))
-async def approve_application(callback: types.CallbackQuery):
-    app_id = callback.data.split("_")[1]
-    async with SessionLocal() as session:
-        result = await session.execute(select(Application).where(Application.id == app_id))
-        application = result.scalar_one_or_none()
-        if application:
-            application.status = "approved"
-            session.add(application)
-            await session.commit()
-            await callback.message.answer(f"Заявка от пользователя {application.user_id} одобрена.")
-            logger.info(f"Application {app_id} approved by {callback.from_user.id}.")
-        else:
-            await callback.message.answer("Заявка не найдена.")
-            logger.warning(f"Application {app_id} not found.")
+    if not (db_user and db_user.is_admin):
+        await callback.answer("Нет доступа", show_alert=True)
+        logger.warning(f"User {callback.from_user.id} tried to view users without admin rights.")
+        return
+
+    await state.update_data(users_filter={})
+    text, keyboard = await render_users_page(0, "gte", {}, session)
+    await callback.message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(UsersPage.filter())
+async def users_page(callback: types.CallbackQuery, callback_data: UsersPage, state: FSMContext,
+                     db_user: UserSnapshot | None, session: AsyncSession):
+    if not (db_user and db_user.is_admin):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
     await callback.answer()
+    await show_users_page(callback, callback_data.id, callback_data.dir, state, session)
 
-@router.callback_query(F.data.startswith("reject_"))
-async def reject_application(callback: types.CallbackQuery):
-    app_id = callback.data.split("_")[1]
-    async with SessionLocal() as session:
-        result = await session.execute(select(Application).where(Application.id == app_id))
-        application = result.scalar_one_or_none()
-        if application:
-            application.status = "rejected"
-            session.add(application)
-            await session.commit()
-            await callback.message.answer(f"Заявка от пользователя {application.user_id} отклонена.")
-            logger.info(f"Application {app_id} rejected by {callback.from_user.id}.")
-        else:
-            await callback.message.answer("Заявка не найдена.")
-            logger.warning(f"Application {app_id} not found.")
+@router.callback_query(UsersFilter.filter())
+async def users_filter(callback: types.CallbackQuery, callback_data: UsersFilter, state: FSMContext,
+                       db_user: UserSnapshot | None, session: AsyncSession):
+    if not (db_user and db_user.is_admin):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
     await callback.answer()
 
+    if callback_data.field == "search":
+        await state.update_data(users_message_id=callback.message.message_id)
+        await state.set_state("users_search_waiting_for_query")
+        await callback.message.answer("Введите ID пользователя или начало имени / контакта:")
+        return
+
+    filters = await get_users_filter(state)
+    if callback_data.field == "reset":
+        filters = {}
+    elif callback_data.field in USERS_FILTERS:
+        values = USERS_FILTERS[callback_data.field]
+        current = filters.get(callback_data.field)
+        filters[callback_data.field] = values[(values.index(current) + 1) % len(values)] if current in values else None
+        filters = {field: value for field, value in filters.items() if value is not None}
+    await state.update_data(users_filter=filters)
+    await show_users_page(callback, 0, "gte", state, session)
+
+@router.message(StateFilter("users_search_waiting_for_query"))
+async def users_search(message: types.Message, state: FSMContext, db_user: UserSnapshot | None,
+                       session: AsyncSession):
+    # Права могли отозвать, пока ждали запрос
+    if not (db_user and db_user.is_admin):
+        await state.clear()
+        await message.answer("❌ У вас нет прав администратора.")
+        return
+
+    search = (message.text or "").strip()[:MAX_SEARCH_LENGTH]
+    if not search:
+        await message.answer("Введите текст для поиска.")
+        return
+
+    data = await state.get_data()
+    filters = {**data.get("users_filter", {}), "search": search}
+    await state.update_data(users_filter=filters)
+    await state.set_state(None)
+    text, keyboard = await render_users_page(0, "gte", filters, session)
+    try:
+        # Обновляем исходный список, а не присылаем новый
+        await message.bot.edit_message_text(
+            text, chat_id=message.chat.id, message_id=data.get("users_message_id"), reply_markup=keyboard
+        )
+    except TelegramBadRequest as e:
+        logger.debug(f"Users page not edited, sending a new one: {e}")
+        await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(UserAction.filter())
+async def user_action(callback: types.CallbackQuery, callback_data: UserAction, state: FSMContext,
+                      db_user: UserSnapshot | None, session: AsyncSession):
+    if not (db_user and db_user.is_admin):
+        await callback.answer("Нет доступа", show_alert=True)
+        return
+    user_id = callback_data.user_id
+    user = await session.get(User, user_id)
+    if not user:
+        await callback.answer("Пользователь не найден.", show_alert=True)
+        return
+
+    if callback_data.action == "payout":
+        # Дальше — обычный сценарий выдачи выплаты, с уже выбранным пользователем
+        await callback.answer()
+        await state.update_data(user_id=user_id)
+        await state.set_state("manage_payout_waiting_for_amount")
+        await callback.message.answer(f"Введите сумму выплаты для пользователя {user_id}:")
+        return
+
+    if callback_data.action == "ban":
+        banned = toggle_ban(user)
+        await session.commit()
+        ban_index.set(user_id, user.banned_until)
+        result = "заблокирован" if banned else "разморожен"
+        logger.info(f"User {callback.from_user.id} {'banned' if banned else 'unbanned'} user {user_id}.")
+    else:
+        ranks = list(RANK_FACTORS)
+        rank = ranks[(ranks.index(user.user_rank) + 1) % len(ranks)] if user.user_rank in ranks else ranks[0]
+        user.user_rank = rank
+        await session.commit()
+        result = f"теперь {rank}"
+        logger.info(f"User {callback.from_user.id} changed rank for {user_id} to {rank}.")
+    user_cache.invalidate(user_id)
+    await callback.answer(f"Пользователь {user_id} {result}.")
+    await show_users_page(callback, callback_data.page, "gte", state, session)
+
 # 3) Назначение админа (только супер-админ)
 @router.callback_query(F.data == "assign_admin")
-async def assign_admin_start(callback: types.CallbackQuery, state: FSMContext):
+async def assign_admin_start(callback: types.CallbackQuery, state: FSMContext, db_user: UserSnapshot | None):
     await callback.answer()
 
-    if not await is_superadmin(callback.from_user.id):
+    if not (db_user and db_user.is_superadmin):
         await callback.answer("Нет доступа", show_alert=True)
         logger.warning(f"User {callback.from_user.id} tried to assign admin without superadmin rights.")
         return
     await callback.message.answer("Введите ID пользователя, чтобы назначить администратором:")
     await state.set_state("assign_admin_waiting_for_user_id")
 
-@router.message(F.state == "assign_admin_waiting_for_user_id")
-async def assign_admin_confirm(message: types.Message, state: FSMContext):
+@router.message(StateFilter("assign_admin_waiting_for_user_id"))
+async def assign_admin_confirm(message: types.Message, state: FSMContext, session: AsyncSession):
     user_id = message.text.strip()
     if not user_id.isdigit():
         await message.answer("Введите корректный ID пользователя.")
         return
 
     user_id = int(user_id)
-    async with SessionLocal() as session:
-        user = await session.get(User, user_id)
-        if not user:
-            await message.answer("Пользователь не найден.")
-            logger.warning(f"User {user_id} not found for admin {message.from_user.id}.")
-        else:
-            user.role = "admin"
-            session.add(user)
-            await session.commit()
-            await message.answer(f"Пользователь {user_id} назначен администратором.")
-            logger.info(f"User {message.from_user.id} assigned admin role to user {user_id}.")
+    user = await session.get(User, user_id)
+    if not user:
+        await message.answer("Пользователь не найден.")
+        logger.warning(f"User {user_id} not found for admin {message.from_user.id}.")
+    else:
+        user.role = "admin"
+        session.add(user)
+        await session.commit()
+        user_cache.invalidate(user_id)
+        await message.answer(f"Пользователь {user_id} назначен администратором.")
+        logger.info(f"User {message.from_user.id} assigned admin role to user {user_id}.")
     await state.clear()
 
 # 4) Смена ранга пользователя
 @router.callback_query(F.data == "change_rank")
-async def change_rank_start(callback: types.CallbackQuery, state: FSMContext):
+async def change_rank_start(callback: types.CallbackQuery, state: FSMContext, db_user: UserSnapshot | None):
     await callback.answer()
 
-    if not await is_admin(callback.from_user.id):
+    if not (db_user and db_user.is_admin):
         await callback.answer("Нет доступа", show_alert=True)
         logger.warning(f"User {callback.from_user.id} tried to change rank without admin rights.")
         return
     await callback.message.answer("Введите ID пользователя, чтобы изменить его ранг:")
     await state.set_state("change_rank_waiting_for_user_id")
 
-@router.message(F.state == "change_rank_waiting_for_user_id")
-async def change_rank_user_id(message: types.Message, state: FSMContext):
+@router.message(StateFilter("change_rank_waiting_for_user_id"))
+async def change_rank_user_id(message: types.Message, state: FSMContext, session: AsyncSession):
     user_id = message.text.strip()
     if not user_id.isdigit():
         await message.answer("Введите корректный ID пользователя.")
         return
 
     user_id = int(user_id)
-    async with SessionLocal() as session:
-        user = await session.get(User, user_id)
-        if not user:
-            await message.answer("Пользователь не найден.")
-            logger.warning(f"User {user_id} not found for admin {message.from_user.id}.")
-        else:
-            await message.answer(f"Выберите новый ранг для пользователя {user_id}:")
-            await state.update_data(user_id=user_id)
-            await state.set_state("change_rank_waiting_for_rank")
-
-@router.message(F.state == "change_rank_waiting_for_rank")
-async def change_rank_select(message: types.Message, state: FSMContext):
+    user = await session.get(User, user_id)
+    if not user:
+        await message.answer("Пользователь не найден.")
+        logger.warning(f"User {user_id} not found for admin {message.from_user.id}.")
+    else:
+        await message.answer(f"Выберите новый ранг для пользователя {user_id}:")
+        await state.update_data(user_id=user_id)
+        await state.set_state("change_rank_waiting_for_rank")
+
+@router.message(StateFilter("change_rank_waiting_for_rank"))
+async def change_rank_select(message: types.Message, state: FSMContext, session: AsyncSession):
     rank = message.text.strip().lower()
-    if rank not in ["прихлебала", "лошадь", "музыкант"]:
-        await message.answer("Неверный ранг. Выберите из: прихлебала, лошадь, музыкант.")
+    if rank not in RANK_FACTORS:
+        await message.answer(f"Неверный ранг. Выберите из: {', '.join(RANK_FACTORS)}.")
         return
 
     data = await state.get_data()
     user_id = data.get("user_id")
-    async with SessionLocal() as session:
-        user = await session.get(User, user_id)
-        if user:
-            user.user_rank = rank
-            session.add(user)
-            await session.commit()
-            await message.answer(f"Ранг пользователя {user_id} изменен на {rank}.")
-            logger.info(f"User {message.from_user.id} changed rank for {user_id} to {rank}.")
+    user = await session.get(User, user_id)
+    if user:
+        user.user_rank = rank
+        session.add(user)
+        await session.commit()
+        user_cache.invalidate(user_id)
+        await message.answer(f"Ранг пользователя {user_id} изменен на {rank}.")
+        logger.info(f"User {message.from_user.id} changed rank for {user_id} to {rank}.")
     await state.clear()
 
 # 5) Бан / Заморозка пользователя
+def toggle_ban(user: User) -> bool:
+    """Банит пользователя или снимает действующий бан; True — теперь забанен. Коммит делает вызывающий."""
+    now = datetime.utcnow()
+    is_banned = bool(user.banned_until and user.banned_until > now)
+    user.banned_until = None if is_banned else now + timedelta(days=BAN_DURATION_DAYS)
+    user.ban_updated_at = now
+    return not is_banned
+
 @router.callback_query(F.data == "ban_user")
-async def ban_user_start(callback: types.CallbackQuery, state: FSMContext):
+async def ban_user_start(callback: types.CallbackQuery, state: FSMContext, db_user: UserSnapshot | None):
     await callback.answer()
 
-    if not await is_admin(callback.from_user.id):
+    if not (db_user and db_user.is_admin):
         await callback.answer("Нет доступа", show_alert=True)
         logger.warning(f"User {callback.from_user.id} tried to ban user without admin rights.")
         return
     await callback.message.answer("Введите ID пользователя, чтобы заблокировать или разморозить:")
     await state.set_state("ban_user_waiting_for_user_id")
 
-@router.message(F.state == "ban_user_waiting_for_user_id")
-async def ban_user_confirm(message: types.Message, state: FSMContext):
+@router.message(StateFilter("ban_user_waiting_for_user_id"))
+async def ban_user_confirm(message: types.Message, state: FSMContext, session: AsyncSession):
     user_id = message.text.strip()
     if not user_id.isdigit():
         await message.answer("Введите корректный ID пользователя.")
         return
 
     user_id = int(user_id)
-    async with SessionLocal() as session:
-        user = await session.get(User, user_id)
-        if not user:
-            await message.answer("Пользователь не найден.")
-            logger.warning(f"User {user_id} not found for admin {message.from_user.id}.")
-        else:
-            user.banned = not user.banned
-            session.add(user)
-            await session.commit()
-            status = "заблокирован" if user.banned else "разморожен"
-            await message.answer(f"Пользователь {user_id} {status}.")
-            logger.info(f"User {message.from_user.id} banned/unbanned user {user_id}.")
+    user = await session.get(User, user_id)
+    if not user:
+        await message.answer("Пользователь не найден.")
+        logger.warning(f"User {user_id} not found for admin {message.from_user.id}.")
+    else:
+        # Повторный бан снимает действующий бан
+        banned = toggle_ban(user)
+        session.add(user)
+        await session.commit()
+        user_cache.invalidate(user_id)
+        # Индекс этого процесса обновляется сразу, остальные воркеры догрузят изменение
+        ban_index.set(user_id, user.banned_until)
+        status = "заблокирован" if banned else "разморожен"
+        await message.answer(f"Пользователь {user_id} {status}.")
+        logger.info(f"User {message.from_user.id} banned/unbanned user {user_id}.")
     await state.clear()
 
 # 6) Выдача / Вычитание выплат
+def payout_key(message: types.Message) -> str:
+    # Повторная доставка того же сообщения админа даёт тот же ключ
+    return f"tg:{message.chat.id}:{message.message_id}"
+
+async def report_payout(message: types.Message, result: PayoutResult, user_id: int, applied_text: str):
+    if result.status == APPLIED:
+        user_cache.invalidate(user_id)
+        await message.answer(applied_text)
+    elif result.status == DUPLICATE:
+        await message.answer(f"Эта операция уже проведена (выплата #{result.payout_id}).")
+    else:
+        await message.answer("Пользователь не найден.")
+        logger.warning(f"User {user_id} not found for payout by {message.from_user.id}.")
+
 @router.callback_query(F.data == "manage_payout")
-async def manage_payout_start(callback: types.CallbackQuery, state: FSMContext):
+async def manage_payout_start(callback: types.CallbackQuery, state: FSMContext, db_user: UserSnapshot | None):
     await callback.answer()
 
-    if not await is_admin(callback.from_user.id):
+    if not (db_user and db_user.is_admin):
         await callback.answer("Нет доступа", show_alert=True)
         logger.warning(f"User {callback.from_user.id} tried to manage payouts without admin rights.")
         return
     await callback.message.answer("Введите ID пользователя для управления выплатами:")
     await state.set_state("manage_payout_waiting_for_user_id")
 
-@router.message(F.state == "manage_payout_waiting_for_user_id")
-async def manage_payout_amount(message: types.Message, state: FSMContext):
+@router.message(StateFilter("manage_payout_waiting_for_user_id"))
+async def manage_payout_amount(message: types.Message, state: FSMContext, session: AsyncSession):
     user_id = message.text.strip()
     if not user_id.isdigit():
         await message.answer("Введите корректный ID пользователя.")
         return
 
     user_id = int(user_id)
-    async with SessionLocal() as session:
-        user = await session.get(User, user_id)
-        if not user:
-            await message.answer("Пользователь не найден.")
-            logger.warning(f"User {user_id} not found for payout management.")
-        else:
-            await message.answer(f"Введите сумму выплаты для пользователя {user_id}:")
-            await state.update_data(user_id=user_id)
-            await state.set_state("manage_payout_waiting_for_amount")
-
-@router.message(F.state == "manage_payout_waiting_for_amount")
-async def manage_payout_confirm(message: types.Message, state: FSMContext):
-    amount = message.text.strip()
-    if not amount.isdigit():
+    user = await session.get(User, user_id)
+    if not user:
+        await message.answer("Пользователь не найден.")
+        logger.warning(f"User {user_id} not found for payout management.")
+    else:
+        await message.answer(f"Введите сумму выплаты для пользователя {user_id}:")
+        await state.update_data(user_id=user_id)
+        await state.set_state("manage_payout_waiting_for_amount")
+
+@router.message(StateFilter("manage_payout_waiting_for_amount"))
+async def manage_payout_confirm(message: types.Message, state: FSMContext, session: AsyncSession):
+    amount = parse_amount(message.text)
+    if amount is None:
         await message.answer("Введите корректную сумму.")
         return
 
-    amount = int(amount)
     data = await state.get_data()
     user_id = data.get("user_id")
 
-    # Расчет выплаты в зависимости от ранга
-    async with SessionLocal() as session:
-        user = await session.get(User, user_id)
-        if user:
-            rank_factor = 0.6 if user.user_rank == "прихлебала" else 0.7 if user.user_rank == "лошадь" else 0.8
-            payout = amount * rank_factor
-            user.balance += payout
-            session.add(user)
-            await session.commit()
-            await message.answer(f"Выплата {payout} выдана пользователю {user_id}.")
-            logger.info(f"User {message.from_user.id} made a payout of {payout} to {user_id}.")
+    # Коэффициент ранга применяется в services/payouts.py; повтор того же сообщения не проведёт выплату снова
+    result = await apply_payout(
+        session, user_id, amount, message.from_user.id, idempotency_key=payout_key(message)
+    )
+    await session.commit()
+    await report_payout(message, result, user_id, f"Выплата {result.amount} выдана пользователю {user_id}.")
+    if result.status == APPLIED:
+        logger.info(f"User {message.from_user.id} made a payout of {result.amount} to {user_id}.")
     await state.clear()
 
 # 7) Отмена выплаты
 @router.callback_query(F.data == "cancel_payout")
-async def cancel_payout_start(callback: types.CallbackQuery, state: FSMContext):
+async def cancel_payout_start(callback: types.CallbackQuery, state: FSMContext, db_user: UserSnapshot | None):
     await callback.answer()
 
-    if not await is_admin(callback.from_user.id):
+    if not (db_user and db_user.is_admin):
         await callback.answer("Нет доступа", show_alert=True)
         logger.warning(f"User {callback.from_user.id} tried to cancel payout without admin rights.")
         return
     await callback.message.answer("Введите ID пользователя для отмены выплаты:")
     await state.set_state("cancel_payout_waiting_for_user_id")
 
-@router.message(F.state == "cancel_payout_waiting_for_user_id")
-async def cancel_payout_confirm(message: types.Message, state: FSMContext):
+@router.message(StateFilter("cancel_payout_waiting_for_user_id"))
+async def cancel_payout_confirm(message: types.Message, state: FSMContext, session: AsyncSession):
     user_id = message.text.strip()
     if not user_id.isdigit():
         await message.answer("Введите корректный ID пользователя.")
         return
 
     user_id = int(user_id)
-    async with SessionLocal() as session:
-        user = await session.get(User, user_id)
-        if not user:
-            await message.answer("Пользователь не найден.")
-            logger.warning(f"User {user_id} not found for payout cancellation.")
-        else:
-            await message.answer(f"Введите сумму, которую нужно отменить для пользователя {user_id}:")
-            await state.update_data(user_id=user_id)
-            await state.set_state("cancel_payout_waiting_for_amount")
-
-@router.message(F.state == "cancel_payout_waiting_for_amount")
-async def cancel_payout_confirm_amount(message: types.Message, state: FSMContext):
-    amount = message.text.strip()
-    if not amount.isdigit():
+    user = await session.get(User, user_id)
+    if not user:
+        await message.answer("Пользователь не найден.")
+        logger.warning(f"User {user_id} not found for payout cancellation.")
+    else:
+        await message.answer(f"Введите сумму, которую нужно отменить для пользователя {user_id}:")
+        await state.update_data(user_id=user_id)
+        await state.set_state("cancel_payout_waiting_for_amount")
+
+@router.message(StateFilter("cancel_payout_waiting_for_amount"))
+async def cancel_payout_confirm_amount(message: types.Message, state: FSMContext, session: AsyncSession):
+    amount = parse_amount(message.text)
+    if amount is None:
         await message.answer("Введите корректную сумму.")
         return
 
-    amount = int(amount)
     data = await state.get_data()
     user_id = data.get("user_id")
 
-    # Отменяем выплату
-    async with SessionLocal() as session:
-        user = await session.get(User, user_id)
-        if user:
-            user.balance -= amount
-            session.add(user)
-            await session.commit()
-            await message.answer(f"Выплата в размере {amount} отменена для пользователя {user_id}.")
-            logger.info(f"User {message.from_user.id} cancelled payout of {amount} for {user_id}.")
+    # Отмена — выплата с обратным знаком, без коэффициента ранга
+    result = await apply_payout(
+        session, user_id, -amount, message.from_user.id, idempotency_key=payout_key(message), apply_rank=False
+    )
+    await session.commit()
+    await report_payout(message, result, user_id, f"Выплата в размере {amount} отменена для пользователя {user_id}.")
+    if result.status == APPLIED:
+        logger.info(f"User {message.from_user.id} cancelled payout of {amount} for {user_id}.")
+    await state.clear()
+
+# 7a) Импорт выплат из CSV
+@router.callback_query(F.data == "import_payouts")
+async def import_payouts_start(callback: types.CallbackQuery, state: FSMContext, db_user: UserSnapshot | None):
+    await callback.answer()
+
+    if not (db_user and db_user.is_admin):
+        await callback.answer("Нет доступа", show_alert=True)
+        logger.warning(f"User {callback.from_user.id} tried to import payouts without admin rights.")
+        return
+    await callback.message.answer(
+        "Отправьте CSV-файл с колонками user_id,amount (заголовок необязателен).\n"
+        "Коэффициенты рангов применяются как при обычной выплате; повторная загрузка того же файла ничего не проведёт."
+    )
+    await state.set_state("import_payouts_waiting_for_file")
+
+@router.message(StateFilter("import_payouts_waiting_for_file"), F.document)
+async def import_payouts_file(message: types.Message, state: FSMContext, session: AsyncSession):
+    await message.answer("⏳ Импортирую выплаты...")
+    try:
+        summary = await import_payouts(
+            session, telegram_file_chunks(message.bot, message.document.file_id), message.from_user.id
+        )
+    except (UnicodeDecodeError, csv.Error) as e:
+        await session.rollback()
+        await message.answer("Не удалось разобрать файл: нужен CSV в кодировке UTF-8.")
+        logger.warning(f"Payout import by {message.from_user.id} failed: {e}")
+        return
+    await session.commit()
+    for user_id in summary.applied_users:
+        user_cache.invalidate(user_id)
+    await message.answer(summary.report())
     await state.clear()
 
+@router.message(StateFilter("import_payouts_waiting_for_file"))
+async def import_payouts_no_file(message: types.Message):
+    await message.answer("Отправьте CSV-файл документом.")
+
 # 8) Пост в бота
 @router.callback_query(F.data == "post_bot")
-async def post_to_bot_start(callback: types.CallbackQuery, state: FSMContext):
+async def post_to_bot_start(callback: types.CallbackQuery, state: FSMContext, db_user: UserSnapshot | None):
     await callback.answer()
 
-    if not await is_admin(callback.from_user.id):
+    if not (db_user and db_user.is_admin):
         await callback.answer("Нет доступа", show_alert=True)
         logger.warning(f"User {callback.from_user.id} tried to post to bot without admin rights.")
         return
     await callback.message.answer("Введите текст для поста в бота:")
     await state.set_state("post_bot_waiting_for_text")
 
-@router.message(F.state == "post_bot_waiting_for_text")
+@router.message(StateFilter("post_bot_waiting_for_text"))
 async def post_to_bot_confirm(message: types.Message, state: FSMContext):
     text = message.text.strip()
     if not text:
         await message.answer("Текст не может быть пустым.")
         return
 
-    # Отправляем сообщение всем пользователям бота
-    async with SessionLocal() as session:
-        users = await session.execute(select(User))
-        users = users.scalars().all()
-
-        for user in users:
-            await bot.send_message(user.user_id, text)
-    await message.answer("Пост опубликован в боте.")
-    logger.info(f"User {message.from_user.id} posted to bot.")
+    # Рассылка идёт в фоне порциями, прогресс обновляется в этом сообщении
+    status = await message.answer("📨 Рассылка запущена...")
+    news_id = await start_broadcast(
+        message.bot, message.from_user.id, text,
+        status_chat_id=status.chat.id, status_message_id=status.message_id
+    )
+    logger.info(f"User {message.from_user.id} posted to bot, broadcast {news_id}.")
 
     await state.clear()
 
 # 9) Пост в канал
 @router.callback_query(F.data == "post_channel")
-async def post_to_channel_start(callback: types.CallbackQuery, state: FSMContext):
+async def post_to_channel_start(callback: types.CallbackQuery, state: FSMContext, db_user: UserSnapshot | None):
     await callback.answer()
 
-    if not await is_admin(callback.from_user.id):
+    if not (db_user and db_user.is_admin):
         await callback.answer("Нет доступа", show_alert=True)
         logger.warning(f"User {callback.from_user.id} tried to post to channel without admin rights.")
         return
     await callback.message.answer("Введите текст для поста в канал:")
     await state.set_state("post_channel_waiting_for_text")
 
-@router.message(F.state == "post_channel_waiting_for_text")
+@router.message(StateFilter("post_channel_waiting_for_text"))
 async def post_to_channel_confirm(message: types.Message, state: FSMContext):
     text = message.text.strip()
     if not text:
@@ -401,7 +793,7 @@ async def post_to_channel_confirm(message: types.Message, state: FSMContext):
 
     # Отправляем сообщение в канал
     for channel_id in CHANNEL_IDS:
-        await bot.send_message(channel_id, text)
+        await message.bot.send_message(channel_id, text)
     await message.answer("Пост опубликован в канал.")
     logger.info(f"User {message.from_user.id} posted to channel.")
 
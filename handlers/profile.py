@@ -4,13 +4,16 @@ from aiogram.filters import CommandStart
 from aiogram.fsm.context import FSMContext
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.fsm.state import State, StatesGroup
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from database import (
-    get_user_by_id, update_user_name, update_user_wallet,
-    get_top_users, get_total_earned_today, SessionLocal, Application,
+    update_user_name, update_user_wallet,
+    get_top_users, get_total_earned_today, Application,
     create_user_if_not_exists
 )
 from config import SUPERADMIN_ID
+from services.user_cache import user_cache, UserSnapshot
+from services.leaderboard import leaderboard
 
 router = Router()
 
@@ -40,21 +43,27 @@ def get_main_menu(is_new: bool, role: str = "user"):
     return ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
 
 @router.message(CommandStart())
-async def cmd_start(message: types.Message):
-    user = await create_user_if_not_exists(message.from_user.id)
+async def cmd_start(message: types.Message, db_user: UserSnapshot | None, session: AsyncSession):
+    user = db_user
+    # В БД идём только для новых пользователей и для повышения супер-админа
+    if user is None or (user.user_id == SUPERADMIN_ID and not user.is_superadmin):
+        user = await create_user_if_not_exists(message.from_user.id, session)
+        await session.commit()
+        user = user_cache.put(user)
     is_new = not user.name and not user.contact if user.role not in ("admin", "superadmin") else False
-    await message.answer(
+    # Последний вызов API возвращается, а не выполняется: вебхук может отдать его в ответе Telegram
+    return message.answer(
         "👋 Добро пожаловать! Выберите действие:",
         reply_markup=get_main_menu(is_new, role=user.role)
     )
 
 @router.message(F.text == "👤 Профиль")
-async def profile(message: types.Message):
-    user = await get_user_by_id(message.from_user.id)
-    from datetime import datetime
-    if user.banned_until and user.banned_until > datetime.utcnow():
-        await message.answer("🚫 Вы заблокированы и не можете пользоваться ботом.")
-        return
+async def profile(message: types.Message, db_user: UserSnapshot | None):
+    user = db_user
+    if user is None:
+        return message.answer("Сначала нажмите /start.")
+    if user.is_banned:
+        return message.answer("🚫 Вы заблокированы и не можете пользоваться ботом.")
 
     text = (
         f"<b>👤 Ваш профиль</b>\n\n"
@@ -64,35 +73,41 @@ async def profile(message: types.Message):
         f"🎖 Роль: {user.role or 'Новичок'}\n"
         f"🏅 Ранг: {getattr(user, 'user_rank', 'не назначен')}"
     )
-    await message.answer(text, reply_markup=profile_kb())
+    return message.answer(text, reply_markup=profile_kb())
 
 @router.callback_query(F.data == "edit_name")
 async def edit_name_handler(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.answer("Введите новое имя:")
     await state.set_state(EditProfile.name)
-    await callback.answer()
+    return callback.answer()
 
 @router.message(EditProfile.name)
-async def save_new_name(message: types.Message, state: FSMContext):
-    await update_user_name(message.from_user.id, message.text)
-    await message.answer("Имя обновлено")
+async def save_new_name(message: types.Message, state: FSMContext, session: AsyncSession):
+    await update_user_name(message.from_user.id, message.text, session)
+    await session.commit()
+    user_cache.invalidate(message.from_user.id)
+    leaderboard.set_name(message.from_user.id, message.text)
     await state.clear()
+    return message.answer("Имя обновлено")
 
 @router.callback_query(F.data == "edit_wallet")
 async def edit_wallet_handler(callback: types.CallbackQuery, state: FSMContext):
     await callback.message.answer("Введите новый адрес кошелька:")
     await state.set_state(EditProfile.wallet)
-    await callback.answer()
+    return callback.answer()
 
 @router.message(EditProfile.wallet)
-async def save_new_wallet(message: types.Message, state: FSMContext):
-    await update_user_wallet(message.from_user.id, message.text)
-    await message.answer("Кошелек обновлен")
+async def save_new_wallet(message: types.Message, state: FSMContext, session: AsyncSession):
+    await update_user_wallet(message.from_user.id, message.text, session)
+    await session.commit()
+    user_cache.invalidate(message.from_user.id)
     await state.clear()
+    return message.answer("Кошелек обновлен")
 
 @router.callback_query(F.data == "top_users")
-async def top_users(callback: types.CallbackQuery):
-    top = await get_top_users("day")
+async def top_users(callback: types.CallbackQuery, session: AsyncSession):
+    # Пока лидерборд прогревается после старта — считаем по БД
+    top = leaderboard.top("day") if leaderboard.ready else await get_top_users("day", session)
     if not top:
         text = "Нет данных."
     else:
@@ -102,26 +117,24 @@ async def top_users(callback: types.CallbackQuery):
             earned = float(row['earned']) if row['earned'] else 0
             text += f"{i}. {name} — {earned:.2f} USDT\n"
     await callback.message.answer(text)
-    await callback.answer()
+    return callback.answer()
 
 @router.callback_query(F.data == "total_today")
-async def total_today(callback: types.CallbackQuery):
-    total = await get_total_earned_today()
+async def total_today(callback: types.CallbackQuery, session: AsyncSession):
+    total = await get_total_earned_today(session)
     total_val = float(total) if total else 0
     text = f"💰 Общая сумма заработка всех пользователей за сегодня: {total_val:.2f} USDT"
     await callback.message.answer(text)
-    await callback.answer()
+    return callback.answer()
 
 @router.message(F.text == "📋 Подать заявку")
 async def start_application(message: types.Message, state: FSMContext):
-    await message.answer("Опишите вашу заявку, пожалуйста:")
     await state.set_state(ApplicationForm.message)
+    return message.answer("Опишите вашу заявку, пожалуйста:")
 
 @router.message(ApplicationForm.message)
-async def save_application(message: types.Message, state: FSMContext):
-    async with SessionLocal() as session:
-        new_app = Application(user_id=message.from_user.id, message=message.text, status="pending")
-        session.add(new_app)
-        await session.commit()
-    await message.answer("Ваша заявка принята! Ожидайте обработки.")
+async def save_application(message: types.Message, state: FSMContext, session: AsyncSession):
+    # Коммит делает DbSessionMiddleware — до того, как ответ уйдёт пользователю
+    session.add(Application(user_id=message.from_user.id, message=message.text, status="pending"))
     await state.clear()
+    return message.answer("Ваша заявка принята! Ожидайте обработки.")
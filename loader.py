@@ -1,6 +1,11 @@
 from aiogram import Bot, Dispatcher
+from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from config import BOT_TOKEN
+from services.bot_session import create_bot_session
+from services.fsm_storage import fsm_storage
 
-bot = Bot(token=BOT_TOKEN, parse_mode=ParseMode.HTML)
-dp = Dispatcher(bot)  # передаём bot в Dispatcher
+# Единственный Bot на процесс: общая настроенная HTTP-сессия для ответов, рассылок и админки
+bot = Bot(token=BOT_TOKEN, session=create_bot_session(), default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+# FSM хранится в Postgres, чтобы состояние не терялось между воркерами и репликами
+dp = Dispatcher(storage=fsm_storage)
@@ -0,0 +1,127 @@
+"""
+Единая настройка логирования процесса.
+
+Логгеры пишут только в QueueHandler (положить запись в очередь), а форматирование
+и запись в stdout делает QueueListener в отдельном потоке — event loop не ждёт вывод.
+Записи выводятся как JSON, поля из extra (update_id, handler, duration_ms, ...)
+попадают в объект как есть. Повторяющиеся ошибки из одной строки кода ограничены
+LOG_ERROR_RATE_LIMIT записями за LOG_ERROR_RATE_WINDOW секунд.
+"""
+import atexit
+import copy
+import json
+import logging
+import queue
+import random
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from config import (
+    LOG_LEVEL, LOG_JSON, LOG_PAYLOAD_SAMPLE_RATE, LOG_ERROR_RATE_LIMIT,
+    LOG_ERROR_RATE_WINDOW, DB_ECHO
+)
+
+# Стандартные атрибуты LogRecord — всё остальное пришло через extra
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_listener: QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                payload[key] = value
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class ErrorRateLimitFilter(logging.Filter):
+    """
+    Пропускает не больше limit ошибок за window секунд с одного места в коде.
+    Число подавленных записей добавляется полем suppressed в следующую пропущенную.
+    """
+
+    def __init__(self, limit: int, window: float):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._windows: dict[tuple, list] = {}  # место -> [начало окна, пропущено, подавлено]
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.ERROR or self.limit <= 0:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        state = self._windows.get(key)
+        if state is None or now - state[0] >= self.window:
+            suppressed = state[2] if state else 0
+            self._windows[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if state[1] < self.limit:
+            state[1] += 1
+            return True
+        state[2] += 1
+        return False
+
+
+class _QueueHandler(QueueHandler):
+    """В очередь кладётся запись с уже подставленными args и текстом исключения, но без форматирования."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def sample_payload() -> bool:
+    """Нужно ли логировать полный payload этого апдейта (доля LOG_PAYLOAD_SAMPLE_RATE)."""
+    return LOG_PAYLOAD_SAMPLE_RATE > 0 and random.random() < LOG_PAYLOAD_SAMPLE_RATE
+
+
+def setup_logging():
+    """Настраивает корневой логгер один раз на процесс; повторные вызовы ничего не делают."""
+    global _listener
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler()
+    if LOG_JSON:
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    handler = _QueueHandler(log_queue)
+    handler.addFilter(ErrorRateLimitFilter(LOG_ERROR_RATE_LIMIT, LOG_ERROR_RATE_WINDOW))
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    # Собственные логи по каждому апдейту пишет middlewares.log с полями update_id/handler
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    # SQL пишется через общий конвейер, а не через отдельный обработчик echo
+    logging.getLogger("sqlalchemy.engine").setLevel(logging.INFO if DB_ECHO else logging.WARNING)
+    # Пул логирует под именем своего класса (database.InstrumentedPool)
+    logging.getLogger("database.InstrumentedPool").setLevel(logging.WARNING)
+
+    _listener = QueueListener(log_queue, output, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
@@ -1,141 +1,220 @@
+import asyncio
 import logging
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-from aiogram import Bot, Dispatcher
+from fastapi import FastAPI, Query, Request
+from datetime import datetime
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from aiogram.types import Update
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy import text
+from logging_setup import setup_logging, sample_payload
 
 # Конфиги
-from config import BOT_TOKEN, DATABASE_URL
+from config import (
+    WEBHOOK_QUEUE_ENABLED, WEBHOOK_QUEUE_WORKERS,
+    WEBHOOK_QUEUE_SIZE, WEBHOOK_QUEUE_PUT_TIMEOUT, FSM_CLEANUP_INTERVAL, WEBHOOK_REPLY_INLINE,
+    UPDATE_DEDUPE_DB
+)
+from database import engine, pool_stats  # Единый engine и пул соединений на процесс
 from handlers import router as handlers_router  # Импортируем единый router с админом и профилем
-
-# Настраиваем логирование
-logging.basicConfig(level=logging.INFO)
+from loader import bot, dp  # Единственные Bot (с общей HTTP-сессией) и Dispatcher на процесс
+from migrations import run_migrations
+from middlewares import setup_middlewares
+from services.broadcast import watch_broadcasts
+from services.update_queue import UpdateQueue
+from services.user_cache import user_cache
+from services.leaderboard import leaderboard, sync_leaderboard
+from services.fsm_storage import fsm_storage, expire_states
+from services.metrics import instrument_engine, render_metrics, TelegramMetricsMiddleware
+from services.webhook_reply import resolve_reply
+from services.dedupe import update_deduplicator, expire_processed_updates, PROCESSED, IN_PROGRESS
+from services.ban_index import ban_index, refresh_bans
+from services.throttle import throttler
+from services.export import EXPORTS, MEDIA_TYPES, is_authorized, is_valid_range, export_body
+
+# Настраиваем логирование (JSON через очередь, один раз на процесс)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 # FastAPI-приложение
 app = FastAPI()
 
-# Создаем экземпляр бота
-bot = Bot(token=BOT_TOKEN, parse_mode="HTML")
-
-# Dispatcher без передачи бота напрямую — правильно для aiogram 3.x
-dp = Dispatcher()
+# Метрики: время каждого вызова Telegram API и каждого запроса к БД
+bot.session.middleware(TelegramMetricsMiddleware())
+instrument_engine(engine)
 
 # Подключаем единый router, где уже собраны все подроутеры (admin, profile и др.)
 # 💡 Важно: router подключается только один раз, чтобы избежать RuntimeError
 dp.include_router(handlers_router)
+setup_middlewares(dp)
 
-# Создаем подключение к базе данных
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
-
-# Миграции: Преобразование колонок integer -> bigint, добавление колонок, переименование и т.п.
-async def run_migrations():
-    """
-    Выполняет все необходимые миграции для базы данных:
-    - Преобразование колонок user_id, resolved_by, issued_by с integer на bigint, если нужно
-    - Добавление колонки banned_until, если её нет
-    - Переименование колонки rank в user_rank, если есть старая колонка rank
-    - Добавление колонки user_rank, если её нет
-    """
-    async with engine.begin() as conn:
-        await conn.execute(text(""" 
-        DO $$
-        BEGIN
-            -- bigint миграции
-            IF EXISTS (
-                SELECT 1 FROM information_schema.columns
-                WHERE table_name='users' AND column_name='user_id' AND data_type='integer'
-            ) THEN
-                ALTER TABLE users ALTER COLUMN user_id TYPE BIGINT;
-            END IF;
-
-            IF EXISTS (
-                SELECT 1 FROM information_schema.columns
-                WHERE table_name='applications' AND column_name='user_id' AND data_type='integer'
-            ) THEN
-                ALTER TABLE applications ALTER COLUMN user_id TYPE BIGINT;
-            END IF;
-
-            IF EXISTS (
-                SELECT 1 FROM information_schema.columns
-                WHERE table_name='applications' AND column_name='resolved_by' AND data_type='integer'
-            ) THEN
-                ALTER TABLE applications ALTER COLUMN resolved_by TYPE BIGINT;
-            END IF;
-
-            IF EXISTS (
-                SELECT 1 FROM information_schema.columns
-                WHERE table_name='payouts' AND column_name='user_id' AND data_type='integer'
-            ) THEN
-                ALTER TABLE payouts ALTER COLUMN user_id TYPE BIGINT;
-            END IF;
-
-            IF EXISTS (
-                SELECT 1 FROM information_schema.columns
-                WHERE table_name='payouts' AND column_name='issued_by' AND data_type='integer'
-            ) THEN
-                ALTER TABLE payouts ALTER COLUMN issued_by TYPE BIGINT;
-            END IF;
-
-            -- Добавление колонки banned_until, если её нет
-            IF NOT EXISTS (
-                SELECT 1 FROM information_schema.columns
-                WHERE table_name='users' AND column_name='banned_until'
-            ) THEN
-                ALTER TABLE users ADD COLUMN banned_until TIMESTAMP NULL;
-            END IF;
-
-            -- Переименование колонки rank в user_rank, если есть старая
-            IF EXISTS (
-                SELECT 1 FROM information_schema.columns
-                WHERE table_name='users' AND column_name='rank'
-            ) THEN
-                ALTER TABLE users RENAME COLUMN rank TO user_rank;
-            END IF;
-
-            -- Добавление колонки user_rank, если её нет и нет колонки rank
-            IF NOT EXISTS (
-                SELECT 1 FROM information_schema.columns
-                WHERE table_name='users' AND column_name='user_rank'
-            ) THEN
-                ALTER TABLE users ADD COLUMN user_rank VARCHAR(255) NULL;
-            END IF;
-
-        END;
-        $$;
-        """))
-
+# Очередь апдейтов: вебхук сразу отвечает 200, обработка идёт в воркерах
+update_queue = UpdateQueue(
+    dp, bot, WEBHOOK_QUEUE_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_QUEUE_PUT_TIMEOUT
+) if WEBHOOK_QUEUE_ENABLED else None
 
 # Запускается при старте FastAPI
 @app.on_event("startup")
 async def on_startup():
     logging.info("📦 Выполняем миграции...")
-    await run_migrations()
+    await run_migrations(engine)
     logging.info("✅ Миграции выполнены")
+    # Продолжаем рассылки, прерванные рестартом
+    asyncio.create_task(watch_broadcasts(bot))
+    # Топ пользователей считается в памяти: прогрев из payout_daily с повторами, затем синхронизация с БД
+    asyncio.create_task(sync_leaderboard(leaderboard))
+    # Индекс банов: загрузка из users.banned_until и догрузка изменений других воркеров
+    asyncio.create_task(refresh_bans(ban_index))
+    # Брошенные состояния FSM удаляются по TTL
+    asyncio.create_task(expire_states(fsm_storage, FSM_CLEANUP_INTERVAL))
+    if UPDATE_DEDUPE_DB:
+        asyncio.create_task(expire_processed_updates(update_deduplicator, FSM_CLEANUP_INTERVAL))
+    if update_queue:
+        update_queue.start()
     logging.info("🚀 Бот готов к приему запросов!")
 
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    if update_queue:
+        await update_queue.stop()
+    await fsm_storage.close()
+    await bot.session.close()
+
+
+# Готовые ответы вебхука: тело сериализовано один раз, объекты не создаются на каждый запрос
+WEBHOOK_OK = Response(content=b'{"status":"ok"}', media_type="application/json")
+WEBHOOK_BUSY = Response(content=b'{"status":"busy"}', status_code=503, media_type="application/json")
+
+
 # Webhook для Telegram
 @app.post("/bot-webhook")
 async def bot_webhook(request: Request):
+    update = None
+    acquired = processed = False
     try:
-        # Логируем полученные данные
-        data = await request.json()
-        logger.info(f"Received update: {data}")  # Логируем входящее обновление
-
-        # Передаем данные в диспетчер
-        update = Update(**data)
-        await dp.feed_update(bot, update)
-        logger.info(f"Update processed: {data}")  # Логируем успешную обработку
+        body = await request.body()
+        # Полный payload пишем только для выборки апдейтов (LOG_PAYLOAD_SAMPLE_RATE)
+        if sample_payload():
+            logger.info("update payload", extra={"payload": body.decode("utf-8", "replace")})
+
+        # Байты тела валидируются сразу в Update, без промежуточного dict.
+        # Контекст с bot монтирует апдейт, иначе feed_update пересобрал бы его через model_dump
+        update = Update.model_validate_json(body, context={"bot": bot})
+        # Повторная доставка уже обработанного апдейта: отвечаем 200, не трогая хендлеры и БД.
+        # Если первая доставка ещё обрабатывается — 503: она может упасть, и тогда нужен повтор
+        state = await update_deduplicator.acquire(bot.id, update.update_id)
+        if state == PROCESSED:
+            return WEBHOOK_OK
+        if state == IN_PROGRESS:
+            return WEBHOOK_BUSY
+        acquired = True
+        reply = None
+        if update_queue:
+            # Очередь заполнена — отвечаем 503, Telegram повторит доставку позже
+            if not await update_queue.put(update):
+                acquired = False
+                await update_deduplicator.release(bot.id, update.update_id)
+                return WEBHOOK_BUSY
+        else:
+            result = await dp.feed_update(bot, update)
+            # Возвращённый хендлером вызов API уходит в ответе на вебхук, если это возможно
+            reply = await resolve_reply(bot, result, WEBHOOK_REPLY_INLINE)
+        processed = True
+        # 200 отдаём только после отметки «обработан»: до неё повторы получают 503
+        await update_deduplicator.complete(bot.id, update.update_id)
+        if reply is not None:
+            return Response(content=reply, media_type="application/json")
 
     except Exception as e:
         # Логируем ошибки
         logger.error(f"Error processing webhook: {e}")
+        if processed:
+            # Хендлеры уже отработали: повтор от Telegram выполнил бы их второй раз
+            return WEBHOOK_OK
+        if acquired:
+            # Снимаем заявку, иначе повтор от Telegram будет отброшен и апдейт потеряется
+            try:
+                await update_deduplicator.release(bot.id, update.update_id)
+            except Exception as release_error:
+                logger.error(f"Failed to release update {update.update_id}: {release_error}")
         return JSONResponse(content={"status": "error", "detail": str(e)}, status_code=500)
 
-    return JSONResponse(content={"status": "ok"})
+    return WEBHOOK_OK
+
+# Состояние очереди апдейтов (для диагностики)
+@app.get("/queue-stats")
+async def queue_stats():
+    if not update_queue:
+        return {"status": "disabled"}
+    return {"status": "ok", **update_queue.stats()}
+
+# Отброшенные повторные доставки апдейтов (для диагностики)
+@app.get("/dedupe-stats")
+async def dedupe_stats():
+    return {"status": "ok", **update_deduplicator.stats()}
+
+# Диагностика с данными пользователей и инфраструктуры закрыта тем же токеном, что и выгрузки
+def unauthorized(request: Request) -> JSONResponse | None:
+    if is_authorized(request.headers.get("authorization")):
+        return None
+    return JSONResponse(content={"status": "error", "detail": "unauthorized"}, status_code=401)
+
+# Лимиты частоты: сколько апдейтов отброшено и кем (для диагностики)
+@app.get("/throttle-stats")
+async def throttle_stats(request: Request):
+    if denied := unauthorized(request):
+        return denied
+    return {"status": "ok", **throttler.stats()}
+
+# Статистика кэша пользователей (для подбора TTL и размера)
+@app.get("/cache-stats")
+async def cache_stats(request: Request):
+    if denied := unauthorized(request):
+        return denied
+    return {
+        "status": "ok", **user_cache.stats(), "fsm": fsm_storage.stats(), "bans": ban_index.stats(),
+        "leaderboard": leaderboard.stats(),
+    }
+
+# Потоковая выгрузка таблиц для финансов: CSV или NDJSON, фильтры по датам и keyset (after)
+@app.get("/export/{table}")
+async def export(table: str, request: Request, format: str = "csv", since: datetime | None = None,
+                 until: datetime | None = None, after: int | None = Query(None, ge=0),
+                 limit: int | None = Query(None, ge=1)):
+    # Всё проверяется до начала потока: после первых байтов статус 200 уже не поменять
+    if denied := unauthorized(request):
+        return denied
+    if table not in EXPORTS:
+        return JSONResponse(content={"status": "error", "detail": "unknown table"}, status_code=404)
+    if format not in MEDIA_TYPES:
+        return JSONResponse(content={"status": "error", "detail": "format must be csv or ndjson"}, status_code=400)
+    if not is_valid_range(since, until):
+        return JSONResponse(content={"status": "error", "detail": "since must not be after until"}, status_code=400)
+    logger.info(f"Export {table}.{format}: since={since} until={until} after={after} limit={limit}")
+    return StreamingResponse(
+        export_body(table, format, since=since, until=until, after=after, limit=limit),
+        media_type=MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'},
+    )
+
+# Метрики Prometheus (хендлеры, БД, Telegram API)
+@app.get("/metrics")
+async def metrics(request: Request):
+    # Prometheus передаёт токен через authorization: {credentials: ...} в scrape_config
+    if denied := unauthorized(request):
+        return denied
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+# Соединения и очереди HTTP-сессии Bot API (для диагностики)
+@app.get("/bot-session")
+async def bot_session():
+    return {"status": "ok", **bot.session.stats()}
+
+# Состояние пула соединений с БД (для диагностики)
+@app.get("/db-pool")
+async def db_pool(request: Request):
+    if denied := unauthorized(request):
+        return denied
+    return {"status": "ok", **pool_stats()}
 
 # Проверка вебхука (для диагностики)
 @app.get("/check-webhook")
@@ -0,0 +1,33 @@
+from aiogram import Dispatcher
+
+from .ban import BanMiddleware
+from .db import DbSessionMiddleware
+from .fsm import FsmFlushMiddleware
+from .log import LoggingMiddleware
+from .metrics import HandlerMetricsMiddleware, UpdateMetricsMiddleware
+from .throttle import ThrottlingMiddleware
+from .user import UserMiddleware
+
+
+def setup_middlewares(dp: Dispatcher):
+    # Внешние middleware апдейта. Метрики должны видеть и чтение состояния FSM,
+    # поэтому FSMContextMiddleware переставляется после них.
+    # Баны и лимит частоты проверяются до FSM: отброшенный апдейт не читает состояние из БД
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(UpdateMetricsMiddleware())
+    dp.update.outer_middleware(BanMiddleware())
+    dp.update.outer_middleware(ThrottlingMiddleware())
+    dp.update.outer_middleware(dp.fsm)
+    dp.update.outer_middleware(FsmFlushMiddleware())
+
+    # Внутренние middleware: срабатывают только когда фильтры уже выбрали хендлер
+    metrics_middleware = HandlerMetricsMiddleware()
+    logging_middleware = LoggingMiddleware()
+    session_middleware = DbSessionMiddleware()
+    user_middleware = UserMiddleware()
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(metrics_middleware)
+        observer.middleware(logging_middleware)
+        # Сессия закрывается до FsmFlushMiddleware: на апдейт не больше одного соединения сразу
+        observer.middleware(session_middleware)
+        observer.middleware(user_middleware)
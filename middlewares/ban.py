@@ -0,0 +1,23 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from services.ban_index import ban_index
+from services.metrics import BANNED_UPDATES
+
+
+class BanMiddleware(BaseMiddleware):
+    """Отбрасывает апдейты забаненных пользователей до FSM и хендлеров (проверка по индексу в памяти)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user: User | None = data.get("event_from_user")
+        if from_user is not None and ban_index.is_banned(from_user.id):
+            BANNED_UPDATES.inc()
+            return None
+        return await handler(event, data)
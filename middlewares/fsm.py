@@ -0,0 +1,22 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+
+class FsmFlushMiddleware(BaseMiddleware):
+    """Сохраняет изменения FSM, накопленные за апдейт, одним запросом после его обработки."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        try:
+            return await handler(event, data)
+        finally:
+            storage = data.get("fsm_storage")
+            context = data.get("state")
+            if context is not None and hasattr(storage, "flush"):
+                await storage.flush(context.key)
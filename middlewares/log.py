@@ -0,0 +1,40 @@
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+logger = logging.getLogger("bot.updates")
+
+
+class LoggingMiddleware(BaseMiddleware):
+    """Одна структурированная запись на обработанный апдейт: update_id, хендлер, длительность."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            return await handler(event, data)
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            update = data.get("event_update")
+            handler_object = data.get("handler")
+            from_user = data.get("event_from_user")
+            logger.info(
+                "update handled",
+                extra={
+                    "update_id": update.update_id if update else None,
+                    "handler": getattr(handler_object.callback, "__name__", None) if handler_object else None,
+                    "user_id": from_user.id if from_user else None,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+                    "status": status,
+                },
+            )
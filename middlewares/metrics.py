@@ -0,0 +1,56 @@
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from services.metrics import (
+    HANDLER_ERRORS, HANDLER_LATENCY, UPDATE_DB_QUERIES, UPDATE_DB_TIME, UPDATE_LATENCY,
+    UpdateStats, current_update,
+)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware апдейта: полное время обработки и запросы к БД за апдейт."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        stats = UpdateStats()
+        token = current_update.set(stats)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            current_update.reset(token)
+            UPDATE_LATENCY.labels(event.event_type).observe(time.perf_counter() - started)
+            UPDATE_DB_QUERIES.labels(stats.handler).observe(stats.queries)
+            UPDATE_DB_TIME.labels(stats.handler).observe(stats.db_time)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: гистограмма времени по роутеру (модулю) и функции хендлера."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        callback = data["handler"].callback
+        router = callback.__module__
+        name = callback.__name__
+        stats = current_update.get()
+        if stats is not None:
+            stats.handler = name
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.labels(router, name).inc()
+            raise
+        finally:
+            HANDLER_LATENCY.labels(router, name).observe(time.perf_counter() - started)
@@ -0,0 +1,49 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.methods import AnswerCallbackQuery, SendMessage
+from aiogram.types import TelegramObject, Update, User
+
+from services.metrics import THROTTLED_UPDATES
+from services.throttle import throttler, ADMIN, CALLBACK, MESSAGE
+from services.user_cache import user_cache
+
+SLOW_DOWN_TEXT = "⏳ Слишком часто, подождите немного."
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """
+    Внешний middleware апдейта: отбрасывает апдейты сверх лимита частоты пользователя
+    до FSM и хендлеров. Класс апдейта определяется без БД: админом считается тот,
+    чей снимок уже лежит в кэше пользователей.
+    Предупреждение возвращается как метод — вебхук отдаёт его в ответе Telegram.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user: User | None = data.get("event_from_user")
+        if from_user is None or (event.message is None and event.callback_query is None):
+            return await handler(event, data)
+
+        snapshot = user_cache.peek(from_user.id)
+        if snapshot is not None and snapshot.is_admin:
+            kind = ADMIN
+        else:
+            kind = CALLBACK if event.callback_query is not None else MESSAGE
+        allowed, notify = throttler.check(kind, from_user.id)
+        if allowed:
+            return await handler(event, data)
+
+        THROTTLED_UPDATES.labels(kind, "notified" if notify else "dropped").inc()
+        if event.callback_query is not None:
+            # На колбэк отвечаем всегда, иначе у пользователя крутятся «часики» на кнопке
+            return AnswerCallbackQuery(
+                callback_query_id=event.callback_query.id, text=SLOW_DOWN_TEXT if notify else None
+            )
+        if notify:
+            return SendMessage(chat_id=event.message.chat.id, text=SLOW_DOWN_TEXT)
+        return None
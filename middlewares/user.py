@@ -0,0 +1,20 @@
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User
+
+from services.user_cache import user_cache
+
+
+class UserMiddleware(BaseMiddleware):
+    """Кладёт в data["db_user"] снимок пользователя из кэша (None, если его ещё нет в БД)."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        from_user: User | None = data.get("event_from_user")
+        data["db_user"] = await user_cache.get(from_user.id, data.get("session")) if from_user else None
+        return await handler(event, data)
@@ -0,0 +1,135 @@
+"""
+Версионированные миграции схемы.
+
+Каждый файл в migrations/versions называется NNNN_описание.py и содержит:
+- statements — список SQL, выполняется одной транзакцией вместе с записью версии;
+- concurrent_indexes — список (имя, "ON таблица (...)"), строится через CREATE INDEX CONCURRENTLY
+  вне транзакции (недостроенный INVALID индекс с тем же именем сначала удаляется);
+- concurrent_unique_indexes — то же для CREATE UNIQUE INDEX CONCURRENTLY.
+
+Применённые версии хранятся в schema_version. Если схема актуальна, старт стоит один SELECT.
+Иначе процесс берёт advisory lock, остальные воркеры/реплики ждут его и затем
+видят, что миграции уже применены.
+"""
+import asyncio
+import importlib
+import logging
+import pkgutil
+import time
+from dataclasses import dataclass, field
+
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from . import versions
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_advisory_lock для миграций (произвольная константа, общая для всех процессов)
+MIGRATIONS_LOCK_ID = 0x6D696772
+MIGRATIONS_LOCK_POLL = 0.5  # сек между попытками взять блокировку
+
+
+@dataclass
+class Migration:
+    version: int
+    name: str
+    statements: list = field(default_factory=list)
+    concurrent_indexes: list = field(default_factory=list)
+    concurrent_unique_indexes: list = field(default_factory=list)
+
+
+def load_migrations() -> list[Migration]:
+    migrations = []
+    for module_info in pkgutil.iter_modules(versions.__path__):
+        number, _, name = module_info.name.partition("_")
+        if not number.isdigit():
+            continue
+        module = importlib.import_module(f"{versions.__name__}.{module_info.name}")
+        migrations.append(Migration(
+            version=int(number),
+            name=name,
+            statements=list(getattr(module, "statements", [])),
+            concurrent_indexes=list(getattr(module, "concurrent_indexes", [])),
+            concurrent_unique_indexes=list(getattr(module, "concurrent_unique_indexes", [])),
+        ))
+    migrations.sort(key=lambda migration: migration.version)
+    return migrations
+
+
+async def current_version(conn) -> int:
+    try:
+        result = await conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_version"))
+        return result.scalar()
+    except ProgrammingError:
+        # Таблицы schema_version ещё нет — база до появления версионированных миграций
+        await conn.rollback()
+        return 0
+
+
+async def _apply(engine, lock_conn, migration: Migration):
+    started = time.monotonic()
+    record = text("INSERT INTO schema_version (version, name) VALUES (:version, :name)")
+    params = {"version": migration.version, "name": migration.name}
+
+    indexes = [("INDEX", name, definition) for name, definition in migration.concurrent_indexes]
+    indexes += [("UNIQUE INDEX", name, definition) for name, definition in migration.concurrent_unique_indexes]
+    if indexes:
+        # lock_conn в режиме AUTOCOMMIT: CONCURRENTLY нельзя выполнять внутри транзакции
+        for statement in migration.statements:
+            await lock_conn.execute(text(statement))
+        for kind, index_name, definition in indexes:
+            invalid = await lock_conn.execute(
+                text(
+                    "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                    "WHERE c.relname = :name AND NOT i.indisvalid"
+                ),
+                {"name": index_name},
+            )
+            if invalid.first():
+                await lock_conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}"))
+            await lock_conn.execute(text(f"CREATE {kind} CONCURRENTLY IF NOT EXISTS {index_name} {definition}"))
+        await lock_conn.execute(record, params)
+    else:
+        async with engine.begin() as conn:
+            for statement in migration.statements:
+                await conn.execute(text(statement))
+            await conn.execute(record, params)
+
+    logger.info(f"Migration {migration.version:04d}_{migration.name} applied in {time.monotonic() - started:.2f}s.")
+
+
+async def run_migrations(engine):
+    migrations = load_migrations()
+    latest = migrations[-1].version if migrations else 0
+
+    async with engine.connect() as conn:
+        version = await current_version(conn)
+    if version >= latest:
+        logger.info(f"Schema is up to date (version {version}).")
+        return
+
+    async with engine.connect() as lock_conn:
+        lock_conn = await lock_conn.execution_options(isolation_level="AUTOCOMMIT")
+        # Ждём блокировку опросом, а не pg_advisory_lock: висящий запрос ожидающего процесса
+        # держит снимок, и CREATE INDEX CONCURRENTLY у мигрирующего ждал бы его — взаимная блокировка
+        while not (await lock_conn.execute(
+            text("SELECT pg_try_advisory_lock(:id)"), {"id": MIGRATIONS_LOCK_ID}
+        )).scalar():
+            await asyncio.sleep(MIGRATIONS_LOCK_POLL)
+        try:
+            await lock_conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                "version INTEGER PRIMARY KEY, name VARCHAR NOT NULL, applied_at TIMESTAMP NOT NULL DEFAULT now())"
+            ))
+            # Пока ждали блокировку, миграции мог применить другой процесс
+            version = await current_version(lock_conn)
+            pending = [migration for migration in migrations if migration.version > version]
+            for migration in pending:
+                await _apply(engine, lock_conn, migration)
+        finally:
+            await lock_conn.execute(text("SELECT pg_advisory_unlock(:id)"), {"id": MIGRATIONS_LOCK_ID})
+    if pending:
+        logger.info(f"Schema migrated from version {version} to {latest}.")
+    else:
+        logger.info(f"Schema was migrated to version {latest} by another process.")
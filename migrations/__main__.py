@@ -0,0 +1,16 @@
+"""Ручной запуск миграций: python -m migrations"""
+import asyncio
+
+from database import engine
+from logging_setup import setup_logging
+from migrations import run_migrations
+
+
+async def main():
+    await run_migrations(engine)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+"""Исходная схема и прежние ALTER-миграции (bigint, banned_until, rank -> user_rank)."""
+
+statements = [
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        user_id BIGINT PRIMARY KEY,
+        name VARCHAR NULL,
+        contact VARCHAR NULL,
+        role VARCHAR DEFAULT 'user',
+        payout BIGINT DEFAULT 0,
+        joined_at TIMESTAMP DEFAULT now(),
+        banned_until TIMESTAMP NULL,
+        user_rank VARCHAR NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS applications (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+        message TEXT,
+        status VARCHAR DEFAULT 'pending',
+        created_at TIMESTAMP DEFAULT now(),
+        resolved_by BIGINT NULL REFERENCES users(user_id) ON DELETE SET NULL,
+        resolved_at TIMESTAMP NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS payouts (
+        id SERIAL PRIMARY KEY,
+        user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+        amount NUMERIC(12, 2) NOT NULL,
+        issued_by BIGINT NULL REFERENCES users(user_id) ON DELETE SET NULL,
+        created_at TIMESTAMP DEFAULT now()
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS news (
+        id SERIAL PRIMARY KEY,
+        content TEXT,
+        created_at TIMESTAMP DEFAULT now(),
+        sent BOOLEAN DEFAULT false
+    )
+    """,
+    # Базы, созданные до появления миграций, доводим до текущей схемы
+    """
+    DO $$
+    BEGIN
+        -- bigint миграции
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name='users' AND column_name='user_id' AND data_type='integer'
+        ) THEN
+            ALTER TABLE users ALTER COLUMN user_id TYPE BIGINT;
+        END IF;
+
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name='applications' AND column_name='user_id' AND data_type='integer'
+        ) THEN
+            ALTER TABLE applications ALTER COLUMN user_id TYPE BIGINT;
+        END IF;
+
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name='applications' AND column_name='resolved_by' AND data_type='integer'
+        ) THEN
+            ALTER TABLE applications ALTER COLUMN resolved_by TYPE BIGINT;
+        END IF;
+
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name='payouts' AND column_name='user_id' AND data_type='integer'
+        ) THEN
+            ALTER TABLE payouts ALTER COLUMN user_id TYPE BIGINT;
+        END IF;
+
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name='payouts' AND column_name='issued_by' AND data_type='integer'
+        ) THEN
+            ALTER TABLE payouts ALTER COLUMN issued_by TYPE BIGINT;
+        END IF;
+
+        -- Добавление колонки banned_until, если её нет
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name='users' AND column_name='banned_until'
+        ) THEN
+            ALTER TABLE users ADD COLUMN banned_until TIMESTAMP NULL;
+        END IF;
+
+        -- Переименование колонки rank в user_rank, если есть старая
+        IF EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name='users' AND column_name='rank'
+        ) THEN
+            ALTER TABLE users RENAME COLUMN rank TO user_rank;
+        END IF;
+
+        -- Добавление колонки user_rank, если её нет и нет колонки rank
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name='users' AND column_name='user_rank'
+        ) THEN
+            ALTER TABLE users ADD COLUMN user_rank VARCHAR(255) NULL;
+        END IF;
+    END;
+    $$
+    """,
+]
@@ -0,0 +1,14 @@
+"""Колонки прогресса рассылки в news."""
+
+statements = [
+    """
+    ALTER TABLE news
+        ADD COLUMN IF NOT EXISTS author_id BIGINT NULL,
+        ADD COLUMN IF NOT EXISTS last_user_id BIGINT DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS delivered INTEGER DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS failed INTEGER DEFAULT 0,
+        ADD COLUMN IF NOT EXISTS total INTEGER NULL,
+        ADD COLUMN IF NOT EXISTS lease_until TIMESTAMP NULL,
+        ADD COLUMN IF NOT EXISTS finished_at TIMESTAMP NULL
+    """,
+]
@@ -0,0 +1,34 @@
+"""Дневные сводки выплат payout_daily / payout_daily_total, заполняются из payouts при создании."""
+
+statements = [
+    """
+    DO $$
+    BEGIN
+        IF to_regclass('payout_daily') IS NULL THEN
+            CREATE TABLE payout_daily (
+                user_id BIGINT NOT NULL REFERENCES users(user_id) ON DELETE CASCADE,
+                day DATE NOT NULL,
+                amount NUMERIC(14, 2) NOT NULL DEFAULT 0,
+                payouts_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, day)
+            );
+            CREATE INDEX ix_payout_daily_day ON payout_daily (day);
+            INSERT INTO payout_daily (user_id, day, amount, payouts_count)
+            SELECT user_id, created_at::date, SUM(amount), COUNT(*)
+            FROM payouts GROUP BY user_id, created_at::date;
+        END IF;
+
+        IF to_regclass('payout_daily_total') IS NULL THEN
+            CREATE TABLE payout_daily_total (
+                day DATE PRIMARY KEY,
+                amount NUMERIC(14, 2) NOT NULL DEFAULT 0,
+                payouts_count INTEGER NOT NULL DEFAULT 0
+            );
+            INSERT INTO payout_daily_total (day, amount, payouts_count)
+            SELECT created_at::date, SUM(amount), COUNT(*)
+            FROM payouts GROUP BY created_at::date;
+        END IF;
+    END;
+    $$
+    """,
+]
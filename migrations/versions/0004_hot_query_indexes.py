@@ -0,0 +1,8 @@
+"""Индексы под горячие запросы: payouts по времени и очередь заявок pending."""
+
+# Строятся через CREATE INDEX CONCURRENTLY вне транзакции, не блокируя запись в таблицы
+concurrent_indexes = [
+    ("ix_payouts_created_at", "ON payouts (created_at)"),
+    ("ix_payouts_user_id_created_at", "ON payouts (user_id, created_at)"),
+    ("ix_applications_pending", "ON applications (created_at, id) WHERE status = 'pending'"),
+]
@@ -0,0 +1,19 @@
+"""Таблица fsm_states для общего между воркерами хранилища FSM."""
+
+statements = [
+    """
+    CREATE TABLE IF NOT EXISTS fsm_states (
+        bot_id BIGINT NOT NULL,
+        chat_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        thread_id BIGINT NOT NULL DEFAULT 0,
+        business_connection_id VARCHAR NOT NULL DEFAULT '',
+        destiny VARCHAR NOT NULL DEFAULT 'default',
+        state VARCHAR NULL,
+        data JSONB NOT NULL DEFAULT '{}',
+        expires_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (bot_id, chat_id, user_id, thread_id, business_connection_id, destiny)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_fsm_states_expires_at ON fsm_states (expires_at)",
+]
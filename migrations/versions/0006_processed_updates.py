@@ -0,0 +1,13 @@
+"""Таблица processed_updates для дедупликации повторных доставок апдейтов между воркерами."""
+
+statements = [
+    """
+    CREATE TABLE IF NOT EXISTS processed_updates (
+        bot_id BIGINT NOT NULL,
+        update_id BIGINT NOT NULL,
+        received_at TIMESTAMP NOT NULL DEFAULT (now() AT TIME ZONE 'utc'),
+        PRIMARY KEY (bot_id, update_id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_processed_updates_received_at ON processed_updates (received_at)",
+]
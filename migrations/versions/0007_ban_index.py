@@ -0,0 +1,10 @@
+"""Время последнего изменения бана — по нему индекс банов в памяти догружает изменения."""
+
+statements = [
+    "ALTER TABLE users ADD COLUMN IF NOT EXISTS ban_updated_at TIMESTAMP NULL",
+]
+
+# Частичный индекс: в нём только пользователи, которых когда-либо банили
+concurrent_indexes = [
+    ("ix_users_ban_updated_at", "ON users (ban_updated_at) WHERE ban_updated_at IS NOT NULL"),
+]
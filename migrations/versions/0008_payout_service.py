@@ -0,0 +1,15 @@
+"""
+Выплаты через services/payouts.py: баланс users.payout в Numeric, как суммы в payouts,
+и ключ идемпотентности в payouts, чтобы повторная отправка не провела выплату дважды.
+Смена типа users.payout переписывает таблицу users под эксклюзивной блокировкой.
+"""
+
+statements = [
+    "ALTER TABLE users ALTER COLUMN payout TYPE NUMERIC(14, 2)",
+    "ALTER TABLE payouts ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR NULL",
+]
+
+# Частичный уникальный индекс: строки без ключа (старые и из сидов) в него не попадают
+concurrent_unique_indexes = [
+    ("ux_payouts_idempotency_key", "ON payouts (idempotency_key) WHERE idempotency_key IS NOT NULL"),
+]
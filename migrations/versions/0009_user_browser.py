@@ -0,0 +1,13 @@
+"""
+Индексы под список пользователей в админке: keyset по user_id с фильтрами по роли, рангу
+и бану, поиск по началу имени и контакта (lower(...) text_pattern_ops, без расширений).
+"""
+
+concurrent_indexes = [
+    ("ix_users_role_user_id", "ON users (role, user_id)"),
+    ("ix_users_rank_user_id", "ON users (user_rank, user_id)"),
+    # Частичный индекс: только пользователи с баном (действующим или истёкшим)
+    ("ix_users_banned_user_id", "ON users (user_id) WHERE banned_until IS NOT NULL"),
+    ("ix_users_name_prefix", "ON users (lower(name) text_pattern_ops)"),
+    ("ix_users_contact_prefix", "ON users (lower(contact) text_pattern_ops)"),
+]
@@ -0,0 +1,7 @@
+"""Индексы под фильтры since / until выгрузки (/export): users по joined_at, applications по created_at."""
+
+concurrent_indexes = [
+    ("ix_users_joined_at", "ON users (joined_at)"),
+    # ix_applications_pending частичный и для всех заявок не подходит
+    ("ix_applications_created_at", "ON applications (created_at)"),
+]
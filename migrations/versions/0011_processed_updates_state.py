@@ -0,0 +1,7 @@
+"""Состояние апдейта в processed_updates: processed_at NULL — ещё обрабатывается."""
+
+statements = [
+    "ALTER TABLE processed_updates ADD COLUMN IF NOT EXISTS processed_at TIMESTAMP NULL",
+    # Раньше строка означала «принят»: считаем уже занятые апдейты обработанными
+    "UPDATE processed_updates SET processed_at = received_at WHERE processed_at IS NULL",
+]
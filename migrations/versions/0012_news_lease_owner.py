@@ -0,0 +1,5 @@
+"""Владелец аренды рассылки: прогресс пишет только воркер, чья аренда ещё действует."""
+
+statements = [
+    "ALTER TABLE news ADD COLUMN IF NOT EXISTS lease_owner VARCHAR NULL",
+]
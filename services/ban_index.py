@@ -0,0 +1,109 @@
+"""
+Индекс банов в памяти процесса: user_id -> banned_until (unix-время).
+
+Загружается при старте из users.banned_until, затем раз в BAN_INDEX_REFRESH_INTERVAL
+догружает строки, у которых изменился ban_updated_at (баны и разбаны из других воркеров).
+Хендлер бана обновляет индекс своего процесса сразу. Истёкшие баны удаляются при проверке,
+поэтому is_banned — один поиск в dict, без запросов к БД.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select
+
+from config import BAN_INDEX_REFRESH_INTERVAL
+from database import SessionLocal, User
+
+logger = logging.getLogger(__name__)
+
+# Перекрытие окна догрузки: транзакция бана могла закоммититься позже, чем началась
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+
+def _timestamp(value: datetime) -> float:
+    # banned_until хранится как наивное UTC-время
+    return value.replace(tzinfo=timezone.utc).timestamp()
+
+
+class BanIndex:
+    """Действующие баны по user_id; проверка не обращается к БД."""
+
+    def __init__(self):
+        self._until: dict[int, float] = {}
+        self._cursor: datetime | None = None
+        self.hits = 0
+        self.refreshes = 0
+
+    def is_banned(self, user_id: int) -> bool:
+        until = self._until.get(user_id)
+        if until is None:
+            return False
+        if until <= time.time():
+            del self._until[user_id]
+            return False
+        self.hits += 1
+        return True
+
+    def set(self, user_id: int, banned_until: datetime | None):
+        """Применяет значение users.banned_until (None или прошедшее время — бана нет)."""
+        if banned_until is not None and _timestamp(banned_until) > time.time():
+            self._until[user_id] = _timestamp(banned_until)
+        else:
+            self._until.pop(user_id, None)
+
+    async def load(self):
+        """Полная загрузка действующих банов (при старте)."""
+        async with SessionLocal() as session:
+            rows = (await session.execute(
+                select(User.user_id, User.banned_until).where(User.banned_until > datetime.utcnow())
+            )).all()
+            cursor = (await session.execute(select(func.max(User.ban_updated_at)))).scalar()
+        self._until.clear()
+        for user_id, banned_until in rows:
+            self.set(user_id, banned_until)
+        self._cursor = cursor
+        logger.info(f"Ban index loaded: {len(self._until)} active bans.")
+
+    async def refresh(self):
+        """Догружает баны и разбаны, изменённые после прошлой загрузки."""
+        query = select(User.user_id, User.banned_until, User.ban_updated_at).where(
+            User.ban_updated_at.is_not(None)
+        )
+        if self._cursor is not None:
+            query = query.where(User.ban_updated_at > self._cursor - REFRESH_OVERLAP)
+        async with SessionLocal() as session:
+            rows = (await session.execute(query)).all()
+        for user_id, banned_until, updated_at in rows:
+            self.set(user_id, banned_until)
+            if self._cursor is None or updated_at > self._cursor:
+                self._cursor = updated_at
+        self.refreshes += 1
+
+    def stats(self) -> dict:
+        return {
+            "active": len(self._until),
+            "hits": self.hits,
+            "refreshes": self.refreshes,
+        }
+
+
+async def refresh_bans(index: BanIndex, interval: float = BAN_INDEX_REFRESH_INTERVAL):
+    """Загружает индекс банов и периодически догружает изменения."""
+    while True:
+        try:
+            await index.load()
+            break
+        except Exception as e:
+            logger.error(f"Ban index load failed: {e}")
+            await asyncio.sleep(interval)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await index.refresh()
+        except Exception as e:
+            logger.error(f"Ban index refresh failed: {e}")
+
+
+ban_index = BanIndex()
@@ -0,0 +1,160 @@
+"""
+Общая HTTP-сессия Bot API на процесс.
+
+Один aiohttp-коннектор с keep-alive и кэшем DNS на все вызовы. Запросы идут по двум полосам
+со своими лимитами одновременности: interactive (ответы на апдейты) и bulk (рассылки).
+Размер пула коннектора равен сумме лимитов, поэтому рассылка не может занять соединения,
+нужные для ответа на /start. Полоса выбирается через contextvar: код рассылки вызывает
+use_bulk_lane() в своей задаче.
+"""
+import asyncio
+import time
+from contextvars import ContextVar
+
+import aiohttp
+from aiohttp.hdrs import USER_AGENT
+from aiohttp.http import SERVER_SOFTWARE
+from aiogram import Bot, __version__ as aiogram_version
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.methods import TelegramMethod
+
+from config import (
+    BOT_API_URL, BOT_INTERACTIVE_CONCURRENCY, BOT_BULK_CONCURRENCY, BOT_KEEPALIVE_TIMEOUT,
+    BOT_DNS_CACHE_TTL, BOT_REQUEST_TIMEOUT, BOT_METHOD_TIMEOUTS
+)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+
+current_lane: ContextVar[str] = ContextVar("bot_api_lane", default=INTERACTIVE)
+
+
+def use_bulk_lane():
+    """Все вызовы Bot API из текущей задачи (и её дочерних) идут по полосе bulk."""
+    current_lane.set(BULK)
+
+
+class _Lane:
+    __slots__ = ("limit", "semaphore", "requests", "waiting", "in_flight", "wait_total", "wait_max")
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.semaphore = asyncio.Semaphore(limit)
+        self.requests = 0
+        self.waiting = 0
+        self.in_flight = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "requests": self.requests,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "wait_avg_ms": round(self.wait_total / self.requests * 1000, 2) if self.requests else 0.0,
+            "wait_max_ms": round(self.wait_max * 1000, 2),
+        }
+
+
+class TunedSession(AiohttpSession):
+    """AiohttpSession с полосами interactive/bulk, таймаутами по методам и статистикой соединений."""
+
+    def __init__(self, interactive_limit: int, bulk_limit: int, keepalive_timeout: float,
+                 dns_cache_ttl: int, timeout: float, method_timeouts: dict[str, float], **kwargs):
+        super().__init__(timeout=timeout, **kwargs)
+        self.method_timeouts = method_timeouts
+        self._lanes = {INTERACTIVE: _Lane(interactive_limit), BULK: _Lane(bulk_limit)}
+        pool_size = interactive_limit + bulk_limit
+        self._connector_init.update(
+            limit=pool_size,
+            limit_per_host=pool_size,
+            keepalive_timeout=keepalive_timeout,
+            ttl_dns_cache=dns_cache_ttl,
+            use_dns_cache=True,
+        )
+        self.connections_created = 0
+        self.connections_reused = 0
+        self.pool_waits = 0
+        self.timeouts = 0
+
+    def _trace_config(self) -> aiohttp.TraceConfig:
+        trace = aiohttp.TraceConfig()
+
+        async def on_create(session, context, params):
+            self.connections_created += 1
+
+        async def on_reuse(session, context, params):
+            self.connections_reused += 1
+
+        async def on_queued(session, context, params):
+            self.pool_waits += 1
+
+        trace.on_connection_create_end.append(on_create)
+        trace.on_connection_reuseconn.append(on_reuse)
+        trace.on_connection_queued_start.append(on_queued)
+        return trace
+
+    async def create_session(self) -> aiohttp.ClientSession:
+        if self._should_reset_connector:
+            await self.close()
+        if self._session is None or self._session.closed:
+            # Как в AiohttpSession.create_session, но с трассировкой соединений
+            self._session = aiohttp.ClientSession(
+                connector=self._connector_type(**self._connector_init),
+                headers={USER_AGENT: f"{SERVER_SOFTWARE} aiogram/{aiogram_version}"},
+                trace_configs=[self._trace_config()],
+            )
+            self._should_reset_connector = False
+        return self._session
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: int | None = None):
+        if timeout is None:
+            timeout = self.method_timeouts.get(method.__api_method__, self.timeout)
+        lane = self._lanes[current_lane.get()]
+        started = time.monotonic()
+        lane.waiting += 1
+        async with lane.semaphore:
+            lane.waiting -= 1
+            waited = time.monotonic() - started
+            lane.requests += 1
+            lane.wait_total += waited
+            lane.wait_max = max(lane.wait_max, waited)
+            lane.in_flight += 1
+            try:
+                return await super().make_request(bot, method, timeout)
+            except TelegramNetworkError as e:
+                if "timeout" in e.message.lower():
+                    self.timeouts += 1
+                raise
+            finally:
+                lane.in_flight -= 1
+
+    def stats(self) -> dict:
+        total = self.connections_created + self.connections_reused
+        return {
+            "connections_created": self.connections_created,
+            "connections_reused": self.connections_reused,
+            "reuse_ratio": round(self.connections_reused / total, 3) if total else 0.0,
+            "pool_waits": self.pool_waits,
+            "timeouts": self.timeouts,
+            "lanes": {name: lane.stats() for name, lane in self._lanes.items()},
+        }
+
+
+def create_bot_session(api_url: str | None = BOT_API_URL) -> TunedSession:
+    kwargs = {}
+    if api_url:
+        # Свой Bot API сервер или локальная заглушка для тестов/бенчмарков
+        kwargs["api"] = TelegramAPIServer.from_base(api_url)
+    return TunedSession(
+        interactive_limit=BOT_INTERACTIVE_CONCURRENCY,
+        bulk_limit=BOT_BULK_CONCURRENCY,
+        keepalive_timeout=BOT_KEEPALIVE_TIMEOUT,
+        dns_cache_ttl=BOT_DNS_CACHE_TTL,
+        timeout=BOT_REQUEST_TIMEOUT,
+        method_timeouts=BOT_METHOD_TIMEOUTS,
+        **kwargs,
+    )
@@ -0,0 +1,364 @@
+import asyncio
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+)
+from sqlalchemy import func, or_, select, update
+
+from config import (
+    BROADCAST_RATE, BROADCAST_CONCURRENCY, BROADCAST_CHUNK_SIZE,
+    BROADCAST_MAX_RETRIES, BROADCAST_PROGRESS_INTERVAL, BROADCAST_LEASE_SECONDS
+)
+from database import SessionLocal, News, User
+from services.bot_session import use_bulk_lane
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Глобальный ограничитель скорости: rate токенов в секунду, не больше capacity подряд."""
+
+    def __init__(self, rate: float, capacity: int | None = None):
+        self.rate = rate
+        self.capacity = capacity or max(1, int(rate))
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        # Telegram вернул retry_after — останавливаем всех отправителей, а не только один
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                since = max(self._updated, self._paused_until)
+                self._tokens = min(self.capacity, self._tokens + (now - since) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Один лимитер на процесс: все рассылки вместе укладываются в лимит Telegram
+bulk_limiter = TokenBucket(BROADCAST_RATE)
+
+
+@dataclass
+class BroadcastStats:
+    total: int
+    delivered: int = 0
+    failed: int = 0
+    resumed_from: int = 0  # сколько уже было обработано до этого запуска
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def processed(self) -> int:
+        return self.delivered + self.failed
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started_at
+        done = self.processed - self.resumed_from
+        return done / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self) -> float | None:
+        remaining = max(self.total - self.processed, 0)
+        if not remaining:
+            return 0.0
+        return remaining / self.rate if self.rate else None
+
+    def render(self, finished: bool = False) -> str:
+        header = "✅ Рассылка завершена" if finished else "📨 Рассылка идёт"
+        eta = self.eta
+        eta_text = "—" if eta is None else str(timedelta(seconds=int(eta)))
+        return (
+            f"<b>{header}</b>\n\n"
+            f"Доставлено: {self.delivered}\n"
+            f"Ошибок: {self.failed}\n"
+            f"Обработано: {self.processed} из {self.total}\n"
+            f"Скорость: {self.rate:.1f} сообщ./сек\n"
+            f"Осталось: {eta_text}"
+        )
+
+
+class Broadcaster:
+    """
+    Рассылка одного поста (строка News) всем пользователям:
+    - получатели читаются порциями по user_id (keyset), сессия не держится открытой;
+    - отправка идёт параллельно под общим TokenBucket, retry_after соблюдается;
+    - после каждой порции прогресс пишется в News, поэтому после рестарта рассылка продолжается;
+    - аренду (lease_until, lease_owner) продлевает фоновая задача, пока идёт рассылка. Потеряв аренду,
+      воркер останавливается и не трогает прогресс нового владельца.
+    """
+
+    def __init__(self, bot: Bot, news_id: int, *, limiter: TokenBucket = bulk_limiter,
+                 concurrency: int = BROADCAST_CONCURRENCY, chunk_size: int = BROADCAST_CHUNK_SIZE,
+                 status_chat_id: int | None = None, status_message_id: int | None = None,
+                 lease_owner: str | None = None):
+        self.bot = bot
+        self.news_id = news_id
+        self.limiter = limiter
+        self.chunk_size = chunk_size
+        self.status_chat_id = status_chat_id
+        self.status_message_id = status_message_id
+        # Токен владельца аренды; start_broadcast передаёт тот, с которым создал News
+        self.lease_owner = lease_owner or uuid.uuid4().hex
+        self._lease_lost = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._last_report = 0.0
+        self.text = ""
+        self.stats: BroadcastStats | None = None
+
+    async def run(self) -> BroadcastStats | None:
+        # Рассылка идёт своей полосой HTTP-сессии и не отнимает соединения у ответов на апдейты
+        use_bulk_lane()
+        news = await self._claim()
+        if news is None:
+            logger.info(f"Broadcast {self.news_id} is finished or leased by another worker.")
+            return None
+
+        self.text = news.content
+        cursor = news.last_user_id or 0
+        total = news.total
+        if total is None:
+            async with SessionLocal() as session:
+                total = (await session.execute(select(func.count()).select_from(User))).scalar()
+        processed = (news.delivered or 0) + (news.failed or 0)
+        self.stats = BroadcastStats(
+            total=total, delivered=news.delivered or 0, failed=news.failed or 0, resumed_from=processed
+        )
+        if self.status_chat_id is None:
+            self.status_chat_id = news.author_id
+        logger.info(f"Broadcast {self.news_id} started from user_id > {cursor}, total {total}.")
+
+        heartbeat = asyncio.create_task(self._keep_lease())
+        try:
+            return await self._send_all(cursor, total)
+        finally:
+            heartbeat.cancel()
+
+    async def _send_all(self, cursor: int, total: int) -> BroadcastStats | None:
+        while True:
+            async with SessionLocal() as session:
+                result = await session.execute(
+                    select(User.user_id)
+                    .where(User.user_id > cursor)
+                    .order_by(User.user_id)
+                    .limit(self.chunk_size)
+                )
+                chunk = result.scalars().all()
+            if not chunk:
+                break
+
+            results = await asyncio.gather(*(self._deliver(user_id) for user_id in chunk))
+            cursor = chunk[-1]
+            if self._lease_lost.is_set() or not await self._save_progress(cursor, total, results):
+                logger.warning(f"Broadcast {self.news_id}: lease lost, stopping at user_id > {cursor}.")
+                return None
+            await self._report()
+
+        await self._finish()
+        await self._report(finished=True)
+        logger.info(
+            f"Broadcast {self.news_id} finished: delivered {self.stats.delivered}, failed {self.stats.failed}."
+        )
+        return self.stats
+
+    async def _claim(self):
+        # Берём рассылку в аренду: второй воркер не начнёт ту же самую News параллельно
+        now = datetime.utcnow()
+        async with SessionLocal() as session:
+            result = await session.execute(
+                update(News)
+                .where(
+                    News.id == self.news_id,
+                    News.sent.is_not(True),
+                    or_(News.lease_until.is_(None), News.lease_until < now, News.lease_owner == self.lease_owner),
+                )
+                .values(lease_until=now + timedelta(seconds=BROADCAST_LEASE_SECONDS), lease_owner=self.lease_owner)
+                .returning(
+                    News.content, News.author_id, News.last_user_id,
+                    News.delivered, News.failed, News.total
+                )
+            )
+            news = result.first()
+            await session.commit()
+        return news
+
+    def _owned(self, now: datetime):
+        # Аренда всё ещё наша: тот же владелец и срок не истёк (иначе News мог забрать другой воркер)
+        return News.id == self.news_id, News.lease_owner == self.lease_owner, News.lease_until >= now
+
+    async def _renew_lease(self) -> bool:
+        now = datetime.utcnow()
+        async with SessionLocal() as session:
+            result = await session.execute(
+                update(News)
+                .where(*self._owned(now), News.sent.is_not(True))
+                .values(lease_until=now + timedelta(seconds=BROADCAST_LEASE_SECONDS))
+                .returning(News.id)
+            )
+            renewed = result.first() is not None
+            await session.commit()
+        return renewed
+
+    async def _keep_lease(self):
+        """Продлевает аренду, пока идёт рассылка: порция с паузами flood control может длиться дольше срока."""
+        while True:
+            await asyncio.sleep(BROADCAST_LEASE_SECONDS / 3)
+            try:
+                renewed = await self._renew_lease()
+            except Exception as e:
+                # Не смогли продлить — попробуем ещё раз; если срок успеет истечь, следующая попытка это покажет
+                logger.error(f"Broadcast {self.news_id}: failed to renew lease: {e}")
+                continue
+            if not renewed:
+                self._lease_lost.set()
+                return
+
+    async def _save_progress(self, cursor: int, total: int, results: list[bool]) -> bool:
+        """Пишет прогресс порции, только если аренда ещё наша. False — аренда потеряна."""
+        delivered = sum(results)
+        now = datetime.utcnow()
+        async with SessionLocal() as session:
+            result = await session.execute(
+                update(News)
+                .where(*self._owned(now))
+                .values(
+                    last_user_id=cursor,
+                    delivered=self.stats.delivered + delivered,
+                    failed=self.stats.failed + len(results) - delivered,
+                    total=total,
+                    lease_until=now + timedelta(seconds=BROADCAST_LEASE_SECONDS),
+                )
+                .returning(News.id)
+            )
+            saved = result.first() is not None
+            await session.commit()
+        if saved:
+            self.stats.delivered += delivered
+            self.stats.failed += len(results) - delivered
+        return saved
+
+    async def _finish(self):
+        async with SessionLocal() as session:
+            await session.execute(
+                update(News)
+                .where(News.id == self.news_id, News.lease_owner == self.lease_owner)
+                .values(sent=True, finished_at=datetime.utcnow(), lease_until=None, lease_owner=None)
+            )
+            await session.commit()
+
+    async def _deliver(self, user_id: int) -> bool:
+        async with self._semaphore:
+            for attempt in range(BROADCAST_MAX_RETRIES + 1):
+                await self.limiter.acquire()
+                if self._lease_lost.is_set():
+                    # Рассылку забрал другой воркер — остаток порции отправит он
+                    return False
+                try:
+                    await self.bot.send_message(user_id, self.text)
+                    return True
+                except TelegramRetryAfter as e:
+                    logger.warning(f"Broadcast {self.news_id}: flood control, retry after {e.retry_after}s.")
+                    self.limiter.pause(e.retry_after)
+                except (TelegramForbiddenError, TelegramBadRequest):
+                    # Пользователь заблокировал бота или чат не существует — повторять бессмысленно
+                    return False
+                except TelegramAPIError as e:
+                    logger.warning(f"Broadcast {self.news_id}: error sending to {user_id}: {e}")
+                    await asyncio.sleep(2 ** attempt)
+            return False
+
+    async def _report(self, finished: bool = False):
+        if self.status_chat_id is None:
+            return
+        now = time.monotonic()
+        if not finished and now - self._last_report < BROADCAST_PROGRESS_INTERVAL:
+            return
+        self._last_report = now
+        text = self.stats.render(finished)
+        try:
+            if self.status_message_id is None:
+                message = await self.bot.send_message(self.status_chat_id, text)
+                self.status_message_id = message.message_id
+            else:
+                await self.bot.edit_message_text(
+                    text, chat_id=self.status_chat_id, message_id=self.status_message_id
+                )
+        except TelegramAPIError as e:
+            logger.warning(f"Broadcast {self.news_id}: failed to report progress: {e}")
+
+
+# Ссылки на фоновые задачи, чтобы их не собрал сборщик мусора
+_tasks: dict[int, asyncio.Task] = {}
+
+
+def _spawn(broadcaster: Broadcaster) -> asyncio.Task:
+    task = asyncio.create_task(broadcaster.run())
+    _tasks[broadcaster.news_id] = task
+    task.add_done_callback(lambda _: _tasks.pop(broadcaster.news_id, None))
+    return task
+
+
+async def start_broadcast(bot: Bot, author_id: int, text: str,
+                          status_chat_id: int | None = None, status_message_id: int | None = None) -> int:
+    """Создаёт News и запускает рассылку в фоне. Возвращает id новости."""
+    async with SessionLocal() as session:
+        # Новость сразу создаётся в аренде, иначе resume_broadcasts другого воркера может забрать её раньше нас
+        lease_owner = uuid.uuid4().hex
+        news = News(
+            content=text, author_id=author_id, sent=False, last_user_id=0, delivered=0, failed=0,
+            lease_until=datetime.utcnow() + timedelta(seconds=BROADCAST_LEASE_SECONDS), lease_owner=lease_owner,
+        )
+        session.add(news)
+        await session.commit()
+        news_id = news.id
+    _spawn(Broadcaster(
+        bot, news_id, status_chat_id=status_chat_id or author_id, status_message_id=status_message_id,
+        lease_owner=lease_owner,
+    ))
+    logger.info(f"Broadcast {news_id} created by {author_id}.")
+    return news_id
+
+
+async def resume_broadcasts(bot: Bot):
+    """Подхватывает незавершённые рассылки, чья аренда истекла (воркер упал или перезапущен)."""
+    async with SessionLocal() as session:
+        result = await session.execute(
+            select(News.id).where(
+                News.sent.is_not(True),
+                News.author_id.is_not(None),
+                or_(News.lease_until.is_(None), News.lease_until < datetime.utcnow()),
+            )
+        )
+        news_ids = [news_id for news_id in result.scalars().all() if news_id not in _tasks]
+    for news_id in news_ids:
+        _spawn(Broadcaster(bot, news_id))
+    if news_ids:
+        logger.info(f"Resuming broadcasts: {news_ids}")
+
+
+async def watch_broadcasts(bot: Bot):
+    """Фоновый цикл: раз в срок аренды проверяет, не осталось ли брошенных рассылок."""
+    while True:
+        try:
+            await resume_broadcasts(bot)
+        except Exception as e:
+            logger.error(f"Failed to resume broadcasts: {e}")
+        await asyncio.sleep(BROADCAST_LEASE_SECONDS)
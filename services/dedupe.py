@@ -0,0 +1,182 @@
+"""
+Дедупликация апдейтов по update_id.
+
+Telegram повторяет доставку, если вебхук ответил медленно или с ошибкой, и без защиты
+хендлеры (выплаты, заявки) отработали бы дважды. Повтор отбрасывается до feed_update,
+то есть до хендлеров и запросов к БД.
+
+У апдейта два состояния: «в обработке» (acquire) и «обработан» (complete). Повтор обработанного
+апдейта получает 200, повтор апдейта в обработке — 503: первая доставка ещё может упасть,
+и тогда только повтор от Telegram сохранит апдейт.
+
+В памяти хранятся последние window обработанных update_id: кольцевой буфер (array) задаёт порядок
+вытеснения, set даёт проверку за O(1). Память ограничена размером окна.
+С UPDATE_DEDUPE_DB апдейт дополнительно «занимается» в таблице processed_updates
+(INSERT ... ON CONFLICT), а после обработки получает processed_at — так повтор, пришедший
+в другой воркер, тоже отбрасывается. Заявку, не завершённую за UPDATE_DEDUPE_CLAIM_TIMEOUT
+(воркер упал посреди обработки), может перехватить следующий повтор.
+"""
+import asyncio
+import logging
+from array import array
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from config import UPDATE_DEDUPE_WINDOW, UPDATE_DEDUPE_DB, UPDATE_DEDUPE_TTL, UPDATE_DEDUPE_CLAIM_TIMEOUT
+from database import SessionLocal, ProcessedUpdate
+from services.metrics import UPDATE_DUPLICATES
+
+logger = logging.getLogger(__name__)
+
+_EMPTY = -1  # update_id неотрицательны
+
+# Результаты acquire
+NEW = "new"  # апдейт занят этим запросом — обрабатываем
+PROCESSED = "processed"  # уже обработан — отвечаем 200
+IN_PROGRESS = "in_progress"  # ещё обрабатывается — отвечаем 503, Telegram повторит позже
+
+
+class UpdateDeduplicator:
+    """Окно последних update_id в памяти и (по флагу) общая таблица processed_updates."""
+
+    def __init__(self, window: int, use_db: bool, ttl: int, claim_timeout: int = UPDATE_DEDUPE_CLAIM_TIMEOUT):
+        self.window = window
+        self.use_db = use_db
+        self.ttl = ttl
+        self.claim_timeout = claim_timeout
+        self._ring = array("q", [_EMPTY]) * window
+        self._pos = 0
+        self._seen: set[int] = set()  # обработанные
+        self._in_progress: set[int] = set()
+        self.accepted = 0
+        self.dropped_memory = 0
+        self.dropped_db = 0
+        self.busy = 0
+
+    def _remember(self, update_id: int):
+        evicted = self._ring[self._pos]
+        if evicted != _EMPTY:
+            self._seen.discard(evicted)
+        self._ring[self._pos] = update_id
+        self._pos = (self._pos + 1) % self.window
+        self._seen.add(update_id)
+
+    async def _claim(self, bot_id: int, update_id: int) -> str:
+        """Занимает апдейт в общей таблице: NEW, либо PROCESSED / IN_PROGRESS у другого воркера."""
+        now = datetime.utcnow()
+        stmt = pg_insert(ProcessedUpdate).values(bot_id=bot_id, update_id=update_id, received_at=now)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[ProcessedUpdate.bot_id, ProcessedUpdate.update_id],
+            set_={"received_at": now},
+            # Перехватываем только зависшую заявку: не обработана и занята дольше claim_timeout
+            where=ProcessedUpdate.processed_at.is_(None)
+            & (ProcessedUpdate.received_at < now - timedelta(seconds=self.claim_timeout)),
+        ).returning(ProcessedUpdate.update_id)
+        async with SessionLocal() as session:
+            claimed = (await session.execute(stmt)).first() is not None
+            processed = False
+            if not claimed:
+                processed = (await session.execute(
+                    select(ProcessedUpdate.processed_at.is_not(None)).where(
+                        ProcessedUpdate.bot_id == bot_id, ProcessedUpdate.update_id == update_id
+                    )
+                )).scalar()
+            await session.commit()
+        if claimed:
+            return NEW
+        # Строку могли удалить между запросами (release) — пусть Telegram повторит
+        return PROCESSED if processed else IN_PROGRESS
+
+    async def acquire(self, bot_id: int, update_id: int) -> str:
+        """Отмечает апдейт принятым в обработку. NEW — обрабатывать; PROCESSED / IN_PROGRESS — это повтор."""
+        if update_id in self._seen:
+            self.dropped_memory += 1
+            UPDATE_DUPLICATES.labels("memory").inc()
+            return PROCESSED
+        if update_id in self._in_progress:
+            self.busy += 1
+            UPDATE_DUPLICATES.labels("in_progress").inc()
+            return IN_PROGRESS
+        # Занимаем до запроса к БД: повтор, пришедший во время INSERT, получит IN_PROGRESS
+        self._in_progress.add(update_id)
+        if self.use_db:
+            try:
+                state = await self._claim(bot_id, update_id)
+            except Exception:
+                self._in_progress.discard(update_id)
+                raise
+            if state == PROCESSED:
+                self._in_progress.discard(update_id)
+                self._remember(update_id)
+                self.dropped_db += 1
+                UPDATE_DUPLICATES.labels("db").inc()
+                return state
+            if state == IN_PROGRESS:
+                self._in_progress.discard(update_id)
+                self.busy += 1
+                UPDATE_DUPLICATES.labels("in_progress").inc()
+                return state
+        self.accepted += 1
+        return NEW
+
+    async def complete(self, bot_id: int, update_id: int):
+        """Отмечает занятый апдейт обработанным: дальше повторы отвечают 200."""
+        self._in_progress.discard(update_id)
+        self._remember(update_id)
+        if self.use_db:
+            async with SessionLocal() as session:
+                await session.execute(
+                    update(ProcessedUpdate)
+                    .where(ProcessedUpdate.bot_id == bot_id, ProcessedUpdate.update_id == update_id)
+                    .values(processed_at=datetime.utcnow())
+                )
+                await session.commit()
+
+    async def release(self, bot_id: int, update_id: int):
+        """Снимает заявку с апдейта, который не был обработан (ошибка, очередь переполнена)."""
+        self._in_progress.discard(update_id)
+        if self.use_db:
+            async with SessionLocal() as session:
+                await session.execute(delete(ProcessedUpdate).where(
+                    ProcessedUpdate.bot_id == bot_id,
+                    ProcessedUpdate.update_id == update_id,
+                    ProcessedUpdate.processed_at.is_(None),
+                ))
+                await session.commit()
+
+    async def delete_expired(self) -> int:
+        async with SessionLocal() as session:
+            result = await session.execute(delete(ProcessedUpdate).where(
+                ProcessedUpdate.received_at <= datetime.utcnow() - timedelta(seconds=self.ttl)
+            ))
+            await session.commit()
+        return result.rowcount
+
+    def stats(self) -> dict:
+        return {
+            "window": self.window,
+            "tracked": len(self._seen),
+            "in_progress": len(self._in_progress),
+            "db": self.use_db,
+            "accepted": self.accepted,
+            "dropped_memory": self.dropped_memory,
+            "dropped_db": self.dropped_db,
+            "busy": self.busy,
+        }
+
+
+async def expire_processed_updates(deduplicator: UpdateDeduplicator, interval: float):
+    """Периодически удаляет из processed_updates записи старше TTL."""
+    while True:
+        try:
+            deleted = await deduplicator.delete_expired()
+            if deleted:
+                logger.info(f"Expired processed updates removed: {deleted}")
+        except Exception as e:
+            logger.error(f"Processed updates cleanup failed: {e}")
+        await asyncio.sleep(interval)
+
+
+update_deduplicator = UpdateDeduplicator(UPDATE_DEDUPE_WINDOW, UPDATE_DEDUPE_DB, UPDATE_DEDUPE_TTL)
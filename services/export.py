@@ -0,0 +1,133 @@
+"""
+Потоковая выгрузка users / payouts / applications в CSV или NDJSON.
+
+Строки читаются серверным курсором (session.stream + yield_per) пачками по EXPORT_BATCH_SIZE
+и сразу уходят клиенту, поэтому память не зависит от размера таблицы.
+Порядок — по первичному ключу: инкрементальная выгрузка передаёт в after последний
+полученный ключ (keyset), диапазон дат задаётся since / until.
+"""
+import csv
+import hmac
+import io
+import json
+import logging
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import NamedTuple
+
+from sqlalchemy import select
+
+from config import EXPORT_TOKEN, EXPORT_BATCH_SIZE
+from database import SessionLocal, User, Payout, Application
+
+logger = logging.getLogger(__name__)
+
+CSV = "csv"
+NDJSON = "ndjson"
+MEDIA_TYPES = {CSV: "text/csv; charset=utf-8", NDJSON: "application/x-ndjson"}
+
+
+class ExportSpec(NamedTuple):
+    key: object  # столбец keyset-пагинации (первичный ключ)
+    date_column: object  # по нему фильтруют since / until
+    columns: tuple
+
+
+EXPORTS = {
+    "users": ExportSpec(
+        User.user_id, User.joined_at,
+        (User.user_id, User.name, User.contact, User.role, User.user_rank, User.payout,
+         User.joined_at, User.banned_until),
+    ),
+    "payouts": ExportSpec(
+        Payout.id, Payout.created_at,
+        (Payout.id, Payout.user_id, Payout.amount, Payout.issued_by, Payout.created_at, Payout.idempotency_key),
+    ),
+    "applications": ExportSpec(
+        Application.id, Application.created_at,
+        (Application.id, Application.user_id, Application.message, Application.status,
+         Application.created_at, Application.resolved_by, Application.resolved_at),
+    ),
+}
+
+
+def is_authorized(authorization: str | None) -> bool:
+    """Заголовок Authorization: Bearer <EXPORT_TOKEN>; без EXPORT_TOKEN выгрузки выключены."""
+    if not EXPORT_TOKEN or not authorization:
+        return False
+    scheme, _, token = authorization.partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(token.strip().encode(), EXPORT_TOKEN.encode())
+
+
+def _naive_utc(value: datetime | None) -> datetime | None:
+    # Даты в таблицах — наивное UTC-время
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def is_valid_range(since: datetime | None, until: datetime | None) -> bool:
+    """since не позже until (наивное и aware-время сравниваются в UTC)."""
+    return since is None or until is None or _naive_utc(since) <= _naive_utc(until)
+
+
+def export_query(spec: ExportSpec, since: datetime | None = None, until: datetime | None = None,
+                 after: int | None = None, limit: int | None = None):
+    query = select(*spec.columns).order_by(spec.key)
+    if after is not None:
+        query = query.where(spec.key > after)
+    if since is not None:
+        query = query.where(spec.date_column >= _naive_utc(since))
+    if until is not None:
+        query = query.where(spec.date_column < _naive_utc(until))
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+async def stream_rows(query, batch_size: int = EXPORT_BATCH_SIZE):
+    """Пачки строк из серверного курсора; соединение занято, пока идёт выгрузка."""
+    async with SessionLocal() as session:
+        result = await session.stream(query.execution_options(yield_per=batch_size))
+        async for rows in result.partitions():
+            yield rows
+
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+async def export_csv(spec: ExportSpec, query):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([column.name for column in spec.columns])
+    yield buffer.getvalue().encode()
+    async for rows in stream_rows(query):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(rows)
+        yield buffer.getvalue().encode()
+
+
+async def export_ndjson(spec: ExportSpec, query):
+    names = [column.name for column in spec.columns]
+    dumps = json.JSONEncoder(ensure_ascii=False, default=_json_default).encode
+    async for rows in stream_rows(query):
+        yield "".join(dumps(dict(zip(names, row))) + "\n" for row in rows).encode()
+
+
+async def export_body(table: str, fmt: str, **filters):
+    """Тело ответа выгрузки порциями байтов; ошибка посреди потока только логируется — статус уже отправлен."""
+    spec = EXPORTS[table]
+    query = export_query(spec, **filters)
+    chunks = export_csv(spec, query) if fmt == CSV else export_ndjson(spec, query)
+    try:
+        async for chunk in chunks:
+            yield chunk
+    except Exception as e:
+        logger.error(f"Export of {table} failed: {e}")
+        raise
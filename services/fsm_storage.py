@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from config import FSM_STATE_TTL, FSM_CACHE_TTL, FSM_CACHE_MAX_ENTRIES
+from database import SessionLocal, FsmState
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("state", "data", "loaded_at", "dirty")
+
+    def __init__(self, state: Optional[str], data: Dict[str, Any]):
+        self.state = state
+        self.data = data
+        self.loaded_at = time.monotonic()
+        self.dirty = False
+
+
+def _row_key(key: StorageKey) -> tuple:
+    return (
+        key.bot_id,
+        key.chat_id,
+        key.user_id,
+        key.thread_id or 0,
+        key.business_connection_id or "",
+        key.destiny,
+    )
+
+
+def _where(row_key: tuple) -> list:
+    bot_id, chat_id, user_id, thread_id, business_connection_id, destiny = row_key
+    return [
+        FsmState.bot_id == bot_id,
+        FsmState.chat_id == chat_id,
+        FsmState.user_id == user_id,
+        FsmState.thread_id == thread_id,
+        FsmState.business_connection_id == business_connection_id,
+        FsmState.destiny == destiny,
+    ]
+
+
+class PostgresStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_states — состояние видно всем воркерам и репликам.
+
+    Состояние и данные читаются одним SELECT и кэшируются в процессе на cache_ttl секунд,
+    поэтому get_state в middleware и get_data/update_data в хендлере стоят один запрос.
+    Записи копятся в кэше и уходят в БД одним upsert (или DELETE для пустого состояния)
+    в flush(), который вызывает FsmFlushMiddleware после обработки апдейта.
+    Каждая запись продлевает expires_at на state_ttl; просроченные строки не читаются
+    и удаляются expire_states().
+    """
+
+    def __init__(self, state_ttl: int, cache_ttl: float, max_entries: int):
+        self.state_ttl = state_ttl
+        self.cache_ttl = cache_ttl
+        self.max_entries = max_entries
+        self._cache: OrderedDict[tuple, _Entry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+    async def _entry(self, key: StorageKey) -> _Entry:
+        row_key = _row_key(key)
+        entry = self._cache.get(row_key)
+        # Несохранённую запись отдаём всегда, иначе — пока не истёк короткий TTL кэша
+        if entry is not None and (entry.dirty or time.monotonic() - entry.loaded_at < self.cache_ttl):
+            self._cache.move_to_end(row_key)
+            self.hits += 1
+            return entry
+        self.misses += 1
+
+        async with SessionLocal() as session:
+            row = (await session.execute(
+                select(FsmState.state, FsmState.data)
+                .where(*_where(row_key), FsmState.expires_at > datetime.utcnow())
+            )).first()
+        entry = _Entry(row.state, dict(row.data or {})) if row else _Entry(None, {})
+        self._cache[row_key] = entry
+        self._cache.move_to_end(row_key)
+        self._evict()
+        return entry
+
+    def _evict(self):
+        while len(self._cache) > self.max_entries:
+            row_key, entry = next(iter(self._cache.items()))
+            if entry.dirty:
+                # Самая старая запись ещё не сохранена — не теряем её, ждём flush
+                break
+            del self._cache[row_key]
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        entry.dirty = True
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key)).state
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        entry = await self._entry(key)
+        entry.data = dict(data)
+        entry.dirty = True
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._entry(key)).data)
+
+    async def flush(self, key: StorageKey):
+        """Сохраняет накопленные за апдейт изменения ключа одним запросом."""
+        row_key = _row_key(key)
+        entry = self._cache.get(row_key)
+        if entry is None or not entry.dirty:
+            return
+        try:
+            await self._write(row_key, entry)
+        except Exception:
+            # Не держим в кэше то, чего нет в БД: следующий апдейт перечитает состояние
+            self._cache.pop(row_key, None)
+            raise
+        entry.dirty = False
+        entry.loaded_at = time.monotonic()
+        self.flushes += 1
+
+    async def _write(self, row_key: tuple, entry: _Entry):
+        async with SessionLocal() as session:
+            if entry.state is None and not entry.data:
+                await session.execute(delete(FsmState).where(*_where(row_key)))
+            else:
+                bot_id, chat_id, user_id, thread_id, business_connection_id, destiny = row_key
+                stmt = pg_insert(FsmState).values(
+                    bot_id=bot_id,
+                    chat_id=chat_id,
+                    user_id=user_id,
+                    thread_id=thread_id,
+                    business_connection_id=business_connection_id,
+                    destiny=destiny,
+                    state=entry.state,
+                    data=entry.data,
+                    expires_at=datetime.utcnow() + timedelta(seconds=self.state_ttl),
+                )
+                await session.execute(stmt.on_conflict_do_update(
+                    index_elements=[c.name for c in FsmState.__table__.primary_key.columns],
+                    set_={
+                        "state": stmt.excluded.state,
+                        "data": stmt.excluded.data,
+                        "expires_at": stmt.excluded.expires_at,
+                    },
+                ))
+            await session.commit()
+
+    async def flush_all(self):
+        for row_key, entry in list(self._cache.items()):
+            if entry.dirty:
+                await self._write(row_key, entry)
+                entry.dirty = False
+
+    async def delete_expired(self) -> int:
+        async with SessionLocal() as session:
+            result = await session.execute(
+                delete(FsmState).where(FsmState.expires_at <= datetime.utcnow())
+            )
+            await session.commit()
+        return result.rowcount
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._cache),
+            "dirty": sum(1 for entry in self._cache.values() if entry.dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "flushes": self.flushes,
+        }
+
+    async def close(self) -> None:
+        await self.flush_all()
+
+
+async def expire_states(storage: PostgresStorage, interval: float):
+    """Периодически удаляет брошенные состояния FSM."""
+    while True:
+        try:
+            deleted = await storage.delete_expired()
+            if deleted:
+                logger.info(f"Expired FSM states removed: {deleted}")
+        except Exception as e:
+            logger.error(f"FSM cleanup failed: {e}")
+        await asyncio.sleep(interval)
+
+
+fsm_storage = PostgresStorage(FSM_STATE_TTL, FSM_CACHE_TTL, FSM_CACHE_MAX_ENTRIES)
@@ -0,0 +1,261 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+from sqlalchemy import func, select
+
+from config import LEADERBOARD_SYNC_INTERVAL
+from database import SessionLocal, Payout, PayoutDaily, User, PERIOD_DAYS, payout_listeners
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = max(PERIOD_DAYS.values())  # дневные корзины за 30 дней
+WINDOWS = PERIOD_DAYS  # те же календарные периоды, что в database.period_bounds
+ZERO = Decimal(0)
+WARM_UP_MAX_DELAY = 300  # сек, предел паузы между попытками прогрева
+
+
+def _day_of(at) -> int:
+    """Номер календарного дня UTC (date.toordinal), как day в payout_daily."""
+    if at is None:
+        return datetime.utcnow().date().toordinal()
+    if isinstance(at, datetime):
+        # В БД время хранится как naive UTC (datetime.utcnow)
+        if at.tzinfo is not None:
+            at = at.astimezone(timezone.utc)
+        return at.date().toordinal()
+    if isinstance(at, date):
+        return at.toordinal()
+    return datetime.fromtimestamp(at, timezone.utc).date().toordinal()
+
+
+class Leaderboard:
+    """
+    Топ заработка за день/неделю/месяц в памяти процесса, по календарным дням UTC —
+    так же, как get_top_users по payout_daily.
+    Кольцо из BUCKETS дневных корзин {user_id: сумма}; для каждого окна поддерживаются суммы
+    по пользователям, а при смене дня из них вычитается выпавшая из окна корзина.
+    Для каждого окна держится отсортированный топ из capacity пользователей: рост суммы
+    правит его на месте, уменьшение суммы у участника топа помечает окно на пересчёт.
+    Запросы top() в БД не ходят.
+
+    Выплаты своего процесса приходят сразу через payout_listeners; выплаты других воркеров
+    и импорты подтягивает sync(), перечитывая из payout_daily корзины за последние дни.
+    События, пришедшие во время чтения, откладываются и после замены корзин применяются,
+    если их нет в прочитанном снимке (id выплаты больше последнего id журнала в снимке).
+    """
+
+    def __init__(self, capacity: int = 50):
+        self.capacity = capacity
+        self.names: dict[int, str | None] = {}
+        self.ready = False
+        self.syncs = 0
+        self._synced_day: int | None = None
+        self._pending: list[tuple] | None = None  # события выплат, пришедшие во время _load
+        self._reset(None)
+
+    def _reset(self, day: int | None):
+        self._day = day
+        self._buckets: list[dict[int, Decimal]] = [{} for _ in range(BUCKETS)]
+        self._totals: dict[str, dict[int, Decimal]] = {window: {} for window in WINDOWS}
+        self._top: dict[str, list[int]] = {window: [] for window in WINDOWS}
+        self._dirty = {window: False for window in WINDOWS}
+
+    def _key(self, window: str, user_id: int):
+        return -self._totals[window].get(user_id, ZERO), user_id
+
+    def _add(self, window: str, user_id: int, amount: Decimal):
+        totals = self._totals[window]
+        total = totals.get(user_id, ZERO) + amount
+        if total:
+            totals[user_id] = total
+        else:
+            totals.pop(user_id, None)
+
+    def _advance(self, day: int):
+        if self._day is None or day - self._day >= BUCKETS:
+            self._reset(day)
+            return
+        for current in range(self._day + 1, day + 1):
+            for window, length in WINDOWS.items():
+                expired = self._buckets[(current - length) % BUCKETS]
+                top = self._top[window]
+                for user_id, amount in expired.items():
+                    self._add(window, user_id, -amount)
+                    if user_id in top:
+                        self._dirty[window] = True
+            self._buckets[current % BUCKETS] = {}
+        self._day = day
+
+    def record(self, user_id: int, amount, at=None, name: str | None = None):
+        """Учитывает выплату amount пользователю user_id в момент at (datetime/date/epoch, по умолчанию сейчас)."""
+        amount = Decimal(amount)
+        day = _day_of(at)
+        self._advance(max(day, _day_of(None)))
+        age = self._day - day
+        if name is not None or user_id not in self.names:
+            self.names[user_id] = name
+        if age >= BUCKETS or not amount:
+            return
+
+        bucket = self._buckets[day % BUCKETS]
+        bucket[user_id] = bucket.get(user_id, ZERO) + amount
+        for window, length in WINDOWS.items():
+            if age >= length:
+                continue
+            self._add(window, user_id, amount)
+            self._update_top(window, user_id, increased=amount > 0)
+
+    def replace_day(self, day: int, amounts: dict[int, Decimal]):
+        """Заменяет корзину дня суммами из БД (sync); изменённые окна пересчитываются при запросе."""
+        self._advance(max(day, _day_of(None)))
+        age = self._day - day
+        if age >= BUCKETS:
+            return
+        old = self._buckets[day % BUCKETS]
+        self._buckets[day % BUCKETS] = amounts
+        changed = [
+            (user_id, amounts.get(user_id, ZERO) - old.get(user_id, ZERO))
+            for user_id in old.keys() | amounts.keys()
+        ]
+        for window, length in WINDOWS.items():
+            if age >= length:
+                continue
+            for user_id, delta in changed:
+                if delta:
+                    self._add(window, user_id, delta)
+                    self._dirty[window] = True
+
+    def _update_top(self, window: str, user_id: int, increased: bool):
+        if self._dirty[window]:
+            return
+        top = self._top[window]
+        totals = self._totals[window]
+        if user_id in top:
+            if not increased or user_id not in totals:
+                # Участник топа мог опуститься ниже кого-то снаружи — пересчитаем при запросе
+                self._dirty[window] = True
+                return
+        elif user_id not in totals:
+            return
+        elif len(top) < self.capacity:
+            top.append(user_id)
+        elif increased and self._key(window, user_id) < self._key(window, top[-1]):
+            top[-1] = user_id
+        else:
+            return
+        top.sort(key=lambda uid: self._key(window, uid))
+
+    def set_name(self, user_id: int, name: str | None):
+        if user_id in self.names:
+            self.names[user_id] = name
+
+    def top(self, period: str = "day", limit: int = 10) -> list[dict]:
+        """Топ за период в том же формате, что database.get_top_users: [{"name", "earned"}]."""
+        window = period if period in WINDOWS else "day"
+        self._advance(_day_of(None))
+        if self._dirty[window]:
+            totals = self._totals[window]
+            self._top[window] = heapq.nsmallest(
+                self.capacity, totals, key=lambda uid: self._key(window, uid)
+            )
+            self._dirty[window] = False
+        totals = self._totals[window]
+        return [
+            {"user_id": user_id, "name": self.names.get(user_id), "earned": totals[user_id]}
+            for user_id in self._top[window][:limit]
+        ]
+
+    async def _load(self, since: int) -> int:
+        """Перечитывает из payout_daily корзины дней начиная с since (включая пустые дни)."""
+        today = _day_of(None)
+        self._pending = []
+        # Нет строк — в снимке нет и выплат, пришедших во время чтения
+        last_payout_id = 0
+        try:
+            async with SessionLocal() as session:
+                # Последний id журнала читается тем же запросом, то есть из того же снимка, что и сводки
+                result = await session.stream(
+                    select(
+                        PayoutDaily.day, PayoutDaily.user_id, PayoutDaily.amount, User.name,
+                        select(func.max(Payout.id)).scalar_subquery(),
+                    )
+                    .join(User, User.user_id == PayoutDaily.user_id)
+                    .where(PayoutDaily.day >= date.fromordinal(since))
+                )
+                days: dict[int, dict[int, Decimal]] = {}
+                rows = 0
+                async for day, user_id, amount, name, last_payout_id in result:
+                    days.setdefault(day.toordinal(), {})[user_id] = amount
+                    self.names[user_id] = name
+                    rows += 1
+        except BaseException:
+            # Корзины не заменены — отложенные выплаты применяем как обычно
+            self._replay(-1)
+            raise
+        for day in range(since, today + 1):
+            self.replace_day(day, days.get(day, {}))
+        self._synced_day = today
+        self._replay(last_payout_id or 0)
+        return rows
+
+    def _replay(self, after: int):
+        """Применяет отложенные во время _load выплаты с id больше after (остальные уже в снимке)."""
+        pending, self._pending = self._pending, None
+        for payout_id, user_id, amount, created_at, name in pending:
+            if payout_id > after:
+                self.record(user_id, amount, created_at, name)
+
+    async def warm_up(self):
+        """Загружает сводки за последние BUCKETS дней и подписывается на выплаты своего процесса."""
+        started = time.monotonic()
+        today = _day_of(None)
+        self._reset(today)
+        if self.on_payout not in payout_listeners:
+            payout_listeners.append(self.on_payout)
+        rows = await self._load(today - BUCKETS + 1)
+        self.ready = True
+        logger.info(f"Leaderboard warmed up: {rows} user-days in {time.monotonic() - started:.2f}s.")
+
+    async def sync(self):
+        """
+        Догружает выплаты других воркеров: перечитывает сегодняшнюю корзину,
+        а после смены дня — и дни с прошлой синхронизации.
+        """
+        await self._load(self._synced_day or _day_of(None))
+        self.syncs += 1
+
+    def on_payout(self, payout_id, user_id, amount, created_at, name=None):
+        if self._pending is not None:
+            # Идёт _load: замена корзин снимком затёрла бы эту выплату
+            self._pending.append((payout_id, user_id, amount, created_at, name))
+            return
+        self.record(user_id, amount, created_at, name)
+
+    def stats(self) -> dict:
+        return {"ready": self.ready, "users": len(self.names), "syncs": self.syncs}
+
+
+async def sync_leaderboard(board: Leaderboard, interval: float = LEADERBOARD_SYNC_INTERVAL):
+    """Прогревает лидерборд (с повторами и растущей паузой), затем периодически синхронизирует с БД."""
+    delay = 1
+    while True:
+        try:
+            await board.warm_up()
+            break
+        except Exception as e:
+            logger.error(f"Leaderboard warm-up failed, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARM_UP_MAX_DELAY)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await board.sync()
+        except Exception as e:
+            logger.error(f"Leaderboard sync failed: {e}")
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,128 @@
+"""
+Метрики Prometheus: хендлеры, запросы к БД и вызовы Telegram API.
+
+Всё пишется в счётчики/гистограммы процесса (без блокировок и запросов), отдаются через /metrics.
+При нескольких воркерах uvicorn задайте PROMETHEUS_MULTIPROC_DIR — тогда /metrics
+собирает значения всех процессов. /metrics закрыт тем же Bearer-токеном, что и выгрузки (EXPORT_TOKEN).
+"""
+import os
+import time
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Histogram, REGISTRY, generate_latest
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+
+# Бакеты в секундах: от быстрых ответов из кэша до медленных запросов
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+HANDLER_LATENCY = Histogram(
+    "bot_handler_duration_seconds", "Время работы хендлера",
+    ["router", "handler"], buckets=LATENCY_BUCKETS,
+)
+HANDLER_ERRORS = Counter(
+    "bot_handler_errors_total", "Исключения в хендлерах", ["router", "handler"],
+)
+UPDATE_LATENCY = Histogram(
+    "bot_update_duration_seconds", "Полное время обработки апдейта диспетчером",
+    ["event_type"], buckets=LATENCY_BUCKETS,
+)
+UPDATE_DB_QUERIES = Histogram(
+    "bot_update_db_queries", "Число запросов к БД за апдейт",
+    ["handler"], buckets=COUNT_BUCKETS,
+)
+UPDATE_DB_TIME = Histogram(
+    "bot_update_db_seconds", "Суммарное время запросов к БД за апдейт",
+    ["handler"], buckets=LATENCY_BUCKETS,
+)
+DB_QUERIES = Counter("bot_db_queries_total", "Запросы к БД")
+DB_QUERY_LATENCY = Histogram(
+    "bot_db_query_duration_seconds", "Время одного запроса к БД", buckets=LATENCY_BUCKETS,
+)
+TELEGRAM_LATENCY = Histogram(
+    "bot_telegram_request_duration_seconds", "Время вызова метода Telegram API",
+    ["method", "status"], buckets=LATENCY_BUCKETS,
+)
+WEBHOOK_INLINED = Counter(
+    "bot_webhook_inline_replies_total", "Вызовы API, отданные Telegram в ответе на вебхук", ["method"],
+)
+WEBHOOK_INLINE_FALLBACKS = Counter(
+    "bot_webhook_inline_fallbacks_total", "Возвращённые хендлером вызовы, выполненные обычным запросом",
+    ["reason"],
+)
+UPDATE_DUPLICATES = Counter(
+    "bot_update_duplicates_total", "Повторные доставки апдейтов, отброшенные до обработки", ["source"],
+)
+BANNED_UPDATES = Counter(
+    "bot_banned_updates_total", "Апдейты забаненных пользователей, отброшенные до обработки",
+)
+THROTTLED_UPDATES = Counter(
+    "bot_throttled_updates_total", "Апдейты сверх лимита частоты пользователя", ["kind", "action"],
+)
+
+
+class UpdateStats:
+    """Счётчики текущего апдейта; лежат в ContextVar, их видят хуки SQLAlchemy из того же таска."""
+    __slots__ = ("queries", "db_time", "handler")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.handler = "unhandled"
+
+
+current_update: ContextVar[UpdateStats | None] = ContextVar("current_update", default=None)
+
+
+def instrument_engine(engine):
+    """Вешает на engine хуки, считающие запросы и их время (в целом и на текущий апдейт)."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        DB_QUERIES.inc()
+        DB_QUERY_LATENCY.observe(elapsed)
+        stats = current_update.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_time += elapsed
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        # Упавший запрос не дошёл до after_cursor_execute — не оставляем его время в стеке
+        if context.connection is not None:
+            started = context.connection.info.get("query_started")
+            if started:
+                started.pop()
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время и исход каждого вызова Telegram API по имени метода."""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        status = "error"
+        try:
+            response = await make_request(bot, method)
+            status = "ok"
+            return response
+        finally:
+            TELEGRAM_LATENCY.labels(type(method).__name__, status).observe(time.perf_counter() - started)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
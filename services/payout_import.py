@@ -0,0 +1,282 @@
+"""
+Массовый импорт выплат из CSV с колонками user_id,amount (заголовок необязателен, разделитель , или ;).
+
+Файл разбирается потоком по мере чтения и сразу уходит через asyncpg COPY во временную таблицу.
+Дальше один запрос применяет коэффициенты рангов, пишет строки в payouts, прибавляет суммы
+к users.payout и обновляет сводки. Ключ идемпотентности строки — хэш файла и номер строки,
+поэтому повторная загрузка того же файла ничего не проведёт повторно.
+
+    python -m services.payout_import payouts.csv --issued-by 1
+    python -m services.payout_import payouts.csv --dry-run     # посчитать и откатить
+"""
+import argparse
+import asyncio
+import codecs
+import csv
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal
+
+from aiogram import Bot
+from sqlalchemy import (
+    BigInteger, Column, Date, Integer, MetaData, Numeric, String, Table, cast, func, literal, select, text,
+    update
+)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import SessionLocal, User, Payout, PayoutDaily, PayoutDailyTotal
+from logging_setup import setup_logging
+from services.payouts import parse_amount, rank_factor
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+SAMPLE_SIZE = 20  # сколько номеров строк / user_id показывать в отчёте
+MAX_USER_ID = 2 ** 63 - 1
+
+# Временная таблица живёт до конца транзакции импорта
+payout_import = Table(
+    "payout_import", MetaData(),
+    Column("line", Integer, nullable=False),
+    Column("user_id", BigInteger, nullable=False),
+    Column("amount", Numeric(14, 2), nullable=False),
+)
+CREATE_IMPORT_TABLE = (
+    "CREATE TEMP TABLE payout_import (line INTEGER NOT NULL, user_id BIGINT NOT NULL, "
+    "amount NUMERIC(14, 2) NOT NULL) ON COMMIT DROP"
+)
+
+
+@dataclass
+class ImportSummary:
+    lines: int = 0  # строк с данными (без заголовка и пустых)
+    invalid: int = 0
+    applied: int = 0
+    skipped: int = 0  # уже импортированы раньше (тот же файл)
+    unknown: int = 0  # строки с пользователями, которых нет в users
+    amount: Decimal = Decimal(0)  # проведено всего, после коэффициентов
+    invalid_lines: list = field(default_factory=list)
+    unknown_users: list = field(default_factory=list)
+    applied_users: set = field(default_factory=set)
+
+    def report(self) -> str:
+        text = (
+            f"📥 Импорт выплат: строк {self.lines}\n"
+            f"✅ Проведено: {self.applied} на сумму {self.amount} USDT\n"
+            f"⏭ Пропущено (уже импортированы): {self.skipped}\n"
+            f"❓ Неизвестные пользователи: {self.unknown}"
+        )
+        if self.unknown_users:
+            text += f" ({', '.join(map(str, self.unknown_users))}{'…' if self.unknown > len(self.unknown_users) else ''})"
+        text += f"\n⚠️ Ошибки в строках: {self.invalid}"
+        if self.invalid_lines:
+            text += f" ({', '.join(map(str, self.invalid_lines))}{'…' if self.invalid > len(self.invalid_lines) else ''})"
+        return text
+
+
+class CsvPayoutRows:
+    """Асинхронный итератор записей (line, user_id, amount) по потоку байтов CSV; считает sha256 файла."""
+
+    def __init__(self, chunks, summary: ImportSummary):
+        self.chunks = chunks
+        self.summary = summary
+        self.digest = hashlib.sha256()
+        self._line = 0
+        self._delimiter = None
+
+    def _parse(self, lines: list[str]):
+        if not lines:
+            return
+        if self._delimiter is None:
+            self._delimiter = ";" if ";" in lines[0] else ","
+        for row in csv.reader(lines, delimiter=self._delimiter):
+            self._line += 1
+            if not row or not "".join(row).strip():
+                continue
+            user_id = row[0].strip()
+            if self._line == 1 and not user_id.isdigit():
+                continue  # заголовок
+            self.summary.lines += 1
+            amount = parse_amount(row[1]) if len(row) == 2 else None
+            if not user_id.isdigit() or int(user_id) > MAX_USER_ID or amount is None:
+                self.summary.invalid += 1
+                if len(self.summary.invalid_lines) < SAMPLE_SIZE:
+                    self.summary.invalid_lines.append(self._line)
+                continue
+            yield self._line, int(user_id), amount
+
+    async def __aiter__(self):
+        decoder = codecs.getincrementaldecoder("utf-8-sig")()
+        tail = ""
+        async for chunk in self.chunks:
+            self.digest.update(chunk)
+            lines = (tail + decoder.decode(chunk)).split("\n")
+            tail = lines.pop()
+            for record in self._parse(lines):
+                yield record
+        tail += decoder.decode(b"", final=True)
+        for record in self._parse([tail]):
+            yield record
+
+
+async def file_chunks(path: str, chunk_size: int = CHUNK_SIZE):
+    with open(path, "rb") as file:
+        while chunk := await asyncio.to_thread(file.read, chunk_size):
+            yield chunk
+
+
+async def telegram_file_chunks(bot: Bot, file_id: str, chunk_size: int = CHUNK_SIZE):
+    """Содержимое файла из Telegram порциями, не загружая его в память целиком."""
+    file = await bot.get_file(file_id)
+    if bot.session.api.is_local:
+        async for chunk in file_chunks(file.file_path, chunk_size):
+            yield chunk
+        return
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    async for chunk in bot.session.stream_content(url, chunk_size=chunk_size, raise_for_status=True):
+        yield chunk
+
+
+def _apply_statement(issued_by: int | None, key_prefix: str, created_at: datetime):
+    day = created_at.date()
+    ledger = (
+        pg_insert(Payout)
+        .from_select(
+            ["user_id", "amount", "issued_by", "created_at", "idempotency_key"],
+            select(
+                payout_import.c.user_id,
+                func.round(payout_import.c.amount * rank_factor(), 2),
+                literal(issued_by, BigInteger),
+                literal(created_at),
+                literal(key_prefix, String) + cast(payout_import.c.line, String),
+            )
+            .join_from(payout_import, User, User.user_id == payout_import.c.user_id)
+            .order_by(payout_import.c.line),
+        )
+        .on_conflict_do_nothing(
+            index_elements=[Payout.idempotency_key], index_where=Payout.idempotency_key.is_not(None)
+        )
+        .returning(Payout.id, Payout.user_id, Payout.amount)
+        .cte("ledger")
+    )
+    # Один пользователь может встречаться в файле несколько раз — UPDATE ... FROM нужна одна строка на него
+    per_user = (
+        select(
+            ledger.c.user_id,
+            func.sum(ledger.c.amount).label("amount"),
+            func.count().label("payouts_count"),
+        )
+        .group_by(ledger.c.user_id)
+        .cte("per_user")
+    )
+    balance = (
+        update(User)
+        .where(User.user_id == per_user.c.user_id)
+        .values(payout=func.coalesce(User.payout, 0) + per_user.c.amount)
+        .returning(User.user_id)
+        .cte("balance")
+    )
+    daily = pg_insert(PayoutDaily).from_select(
+        ["user_id", "day", "amount", "payouts_count"],
+        select(per_user.c.user_id, literal(day, Date), per_user.c.amount, per_user.c.payouts_count),
+    )
+    daily = daily.on_conflict_do_update(
+        index_elements=[PayoutDaily.user_id, PayoutDaily.day],
+        set_={
+            "amount": PayoutDaily.amount + daily.excluded.amount,
+            "payouts_count": PayoutDaily.payouts_count + daily.excluded.payouts_count,
+        },
+    ).cte("daily")
+    total = pg_insert(PayoutDailyTotal).from_select(
+        ["day", "amount", "payouts_count"],
+        select(literal(day, Date), func.sum(ledger.c.amount), func.count())
+        .select_from(ledger)
+        .having(func.count() > 0),
+    )
+    total = total.on_conflict_do_update(
+        index_elements=[PayoutDailyTotal.day],
+        set_={
+            "amount": PayoutDailyTotal.amount + total.excluded.amount,
+            "payouts_count": PayoutDailyTotal.payouts_count + total.excluded.payouts_count,
+        },
+    ).cte("total")
+    # users читается из снимка до UPDATE — имя нужно подписчикам payout_listeners
+    return (
+        select(ledger.c.id, ledger.c.user_id, ledger.c.amount, User.name)
+        .join_from(ledger, User, User.user_id == ledger.c.user_id)
+        .add_cte(balance, daily, total)
+    )
+
+
+async def import_payouts(session: AsyncSession, chunks, issued_by: int | None) -> ImportSummary:
+    """
+    Импортирует выплаты из потока байтов CSV в транзакции session. Коммит делает вызывающий;
+    после коммита выплаты уходят подписчикам payout_listeners.
+    """
+    summary = ImportSummary()
+    rows = CsvPayoutRows(chunks, summary)
+    await session.execute(text(CREATE_IMPORT_TABLE))
+    connection = await session.connection()
+    raw = (await connection.get_raw_connection()).driver_connection
+    await raw.copy_records_to_table(
+        "payout_import", records=rows, columns=["line", "user_id", "amount"]
+    )
+
+    created_at = datetime.utcnow()
+    key_prefix = f"import:{rows.digest.hexdigest()[:32]}:"
+    result = await session.execute(_apply_statement(issued_by, key_prefix, created_at))
+    events = session.info.setdefault("payout_events", [])
+    for payout_id, user_id, amount, name in result:
+        summary.applied += 1
+        summary.amount += amount
+        summary.applied_users.add(user_id)
+        events.append((payout_id, user_id, amount, created_at, name))
+
+    known = (await session.execute(
+        select(func.count()).select_from(payout_import)
+        .join(User, User.user_id == payout_import.c.user_id)
+    )).scalar()
+    copied = summary.lines - summary.invalid
+    summary.unknown = copied - known
+    summary.skipped = known - summary.applied
+    if summary.unknown:
+        summary.unknown_users = list((await session.execute(
+            select(payout_import.c.user_id)
+            .outerjoin(User, User.user_id == payout_import.c.user_id)
+            .where(User.user_id.is_(None))
+            .distinct()
+            .order_by(payout_import.c.user_id)
+            .limit(SAMPLE_SIZE)
+        )).scalars())
+    logger.info(
+        f"Payout import by {issued_by}: {summary.applied} applied, {summary.skipped} skipped, "
+        f"{summary.unknown} unknown, {summary.invalid} invalid."
+    )
+    return summary
+
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Импорт выплат из CSV (user_id,amount)")
+    parser.add_argument("path", help="CSV-файл")
+    parser.add_argument("--issued-by", type=int, help="user_id админа, от имени которого проводятся выплаты")
+    parser.add_argument("--dry-run", action="store_true", help="посчитать и откатить транзакцию")
+    args = parser.parse_args(argv)
+
+    async with SessionLocal() as session:
+        summary = await import_payouts(session, file_chunks(args.path), args.issued_by)
+        if args.dry_run:
+            await session.rollback()
+        else:
+            await session.commit()
+    print(summary.report())
+    if args.dry_run:
+        print("Dry run: изменения откатаны.")
+    return 0
+
+
+if __name__ == "__main__":
+    setup_logging()
+    raise SystemExit(asyncio.run(main()))
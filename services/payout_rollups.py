@@ -0,0 +1,132 @@
+"""
+Проверка и пересборка сводок payout_daily / payout_daily_total по сырому журналу payouts.
+
+    python -m services.payout_rollups                      # только проверка, код выхода 1 при расхождениях
+    python -m services.payout_rollups --rebuild            # пересобрать все сводки
+    python -m services.payout_rollups --rebuild --since 2024-05-01 --until 2024-06-01
+"""
+import argparse
+import asyncio
+import logging
+from datetime import date, datetime, time
+
+from sqlalchemy import Date, cast, delete, func, insert, select, text
+
+from database import SessionLocal, Payout, PayoutDaily, PayoutDailyTotal
+from logging_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+
+def _ledger_query(since: date | None, until: date | None):
+    # Полуоткрытый диапазон по created_at, чтобы работал индекс ix_payouts_created_at
+    day = cast(Payout.created_at, Date)
+    query = (
+        select(
+            Payout.user_id,
+            day.label("day"),
+            func.sum(Payout.amount).label("amount"),
+            func.count().label("payouts_count"),
+        )
+        .group_by(Payout.user_id, day)
+    )
+    if since:
+        query = query.where(Payout.created_at >= datetime.combine(since, time.min))
+    if until:
+        query = query.where(Payout.created_at < datetime.combine(until, time.min))
+    return query
+
+
+def _rollup_filter(column, since: date | None, until: date | None):
+    conditions = []
+    if since:
+        conditions.append(column >= since)
+    if until:
+        conditions.append(column < until)
+    return conditions
+
+
+async def check_rollups(since: date | None = None, until: date | None = None) -> list[dict]:
+    """Возвращает список расхождений между payouts и payout_daily."""
+    async with SessionLocal() as session:
+        ledger = {
+            (row.user_id, row.day): (row.amount, row.payouts_count)
+            for row in (await session.execute(_ledger_query(since, until))).all()
+        }
+        rollup = {
+            (row.user_id, row.day): (row.amount, row.payouts_count)
+            for row in (await session.execute(
+                select(PayoutDaily.user_id, PayoutDaily.day, PayoutDaily.amount, PayoutDaily.payouts_count)
+                .where(*_rollup_filter(PayoutDaily.day, since, until))
+            )).all()
+        }
+        totals = {
+            row.day: (row.amount, row.payouts_count)
+            for row in (await session.execute(
+                select(PayoutDailyTotal.day, PayoutDailyTotal.amount, PayoutDailyTotal.payouts_count)
+                .where(*_rollup_filter(PayoutDailyTotal.day, since, until))
+            )).all()
+        }
+
+    mismatches = []
+    for key in sorted(ledger.keys() | rollup.keys()):
+        if ledger.get(key) != rollup.get(key):
+            mismatches.append({"user_id": key[0], "day": key[1], "ledger": ledger.get(key), "rollup": rollup.get(key)})
+
+    ledger_totals: dict[date, tuple] = {}
+    for (_, day), (amount, count) in ledger.items():
+        prev_amount, prev_count = ledger_totals.get(day, (0, 0))
+        ledger_totals[day] = (prev_amount + amount, prev_count + count)
+    for day in sorted(ledger_totals.keys() | totals.keys()):
+        if ledger_totals.get(day) != totals.get(day):
+            mismatches.append({"user_id": None, "day": day, "ledger": ledger_totals.get(day), "rollup": totals.get(day)})
+    return mismatches
+
+
+async def rebuild_rollups(since: date | None = None, until: date | None = None):
+    """Пересобирает сводки за период (или целиком) одной транзакцией."""
+    async with SessionLocal() as session:
+        if session.bind.dialect.name == "postgresql":
+            # Блокируем сводки: параллельные apply_payout подождут и допишут свои суммы уже поверх пересборки
+            await session.execute(text("LOCK TABLE payout_daily, payout_daily_total IN EXCLUSIVE MODE"))
+        await session.execute(delete(PayoutDaily).where(*_rollup_filter(PayoutDaily.day, since, until)))
+        await session.execute(delete(PayoutDailyTotal).where(*_rollup_filter(PayoutDailyTotal.day, since, until)))
+
+        ledger = _ledger_query(since, until).subquery()
+        await session.execute(
+            insert(PayoutDaily).from_select(
+                ["user_id", "day", "amount", "payouts_count"],
+                select(ledger.c.user_id, ledger.c.day, ledger.c.amount, ledger.c.payouts_count),
+            )
+        )
+        await session.execute(
+            insert(PayoutDailyTotal).from_select(
+                ["day", "amount", "payouts_count"],
+                select(PayoutDaily.day, func.sum(PayoutDaily.amount), func.sum(PayoutDaily.payouts_count))
+                .where(*_rollup_filter(PayoutDaily.day, since, until))
+                .group_by(PayoutDaily.day),
+            )
+        )
+        await session.commit()
+    logger.info(f"Payout rollups rebuilt for [{since or '-inf'}, {until or '+inf'}).")
+
+
+async def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Проверка и пересборка сводок выплат")
+    parser.add_argument("--rebuild", action="store_true", help="пересобрать сводки из payouts")
+    parser.add_argument("--since", type=date.fromisoformat, help="начало периода (включительно)")
+    parser.add_argument("--until", type=date.fromisoformat, help="конец периода (не включительно)")
+    args = parser.parse_args(argv)
+
+    if args.rebuild:
+        await rebuild_rollups(args.since, args.until)
+    mismatches = await check_rollups(args.since, args.until)
+    for item in mismatches[:50]:
+        print(f"Mismatch: {item}")
+    print(f"Mismatches: {len(mismatches)}")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    setup_logging()
+    raise SystemExit(asyncio.run(main()))
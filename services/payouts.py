@@ -0,0 +1,132 @@
+"""
+Выдача и отмена выплат.
+
+Выплата проводится одним запросом: CTE вставляет строку в журнал payouts, прибавляет сумму
+к users.payout через UPDATE ... SET payout = payout + ... (без чтения баланса в Python,
+поэтому параллельные выплаты не теряются) и обновляет сводки payout_daily / payout_daily_total.
+Коэффициент ранга применяется в том же запросе. Повторная отправка с тем же idempotency_key
+упирается в уникальный индекс и ничего не меняет.
+"""
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import NamedTuple
+
+from sqlalchemy import BigInteger, Date, DateTime, Integer, Numeric, String, case, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import User, Payout, PayoutDaily, PayoutDailyTotal
+
+# Доля суммы, которую получает пользователь, по рангу
+RANK_FACTORS = {
+    "прихлебала": Decimal("0.6"),
+    "лошадь": Decimal("0.7"),
+    "музыкант": Decimal("0.8"),
+}
+DEFAULT_RANK_FACTOR = Decimal("0.8")
+
+CENT = Decimal("0.01")
+MAX_AMOUNT = Decimal("1000000000")  # влезает в Numeric(12, 2) журнала
+
+APPLIED = "applied"
+DUPLICATE = "duplicate"
+UNKNOWN_USER = "unknown_user"
+
+
+class PayoutResult(NamedTuple):
+    status: str  # applied / duplicate / unknown_user
+    payout_id: int | None
+    amount: Decimal | None  # проведённая сумма (после коэффициента ранга)
+    balance: Decimal | None  # users.payout после выплаты
+
+
+def parse_amount(value: str) -> Decimal | None:
+    """Положительная сумма с точностью до цента из ввода админа ("12", "12.5", "12,50") или None."""
+    try:
+        amount = Decimal(value.strip().replace(",", "."))
+    except InvalidOperation:
+        return None
+    if not amount.is_finite() or amount <= 0 or amount >= MAX_AMOUNT:
+        return None
+    return amount.quantize(CENT)
+
+
+def rank_factor():
+    """SQL-выражение коэффициента ранга для строки users."""
+    return case(RANK_FACTORS, value=User.user_rank, else_=DEFAULT_RANK_FACTOR)
+
+
+async def apply_payout(session: AsyncSession, user_id: int, amount: Decimal, issued_by: int | None,
+                       idempotency_key: str | None = None, apply_rank: bool = True) -> PayoutResult:
+    """
+    Проводит выплату amount (отрицательная — отмена) одним запросом в транзакции session.
+    Коммит делает вызывающий; после коммита выплата уходит подписчикам payout_listeners.
+    """
+    created_at = datetime.utcnow()
+    factor = rank_factor() if apply_rank else literal(1)
+    source = (
+        select(
+            User.user_id,
+            func.round(literal(amount, Numeric(14, 2)) * factor, 2).label("amount"),
+            literal(issued_by, BigInteger).label("issued_by"),
+            literal(created_at, DateTime).label("created_at"),
+            literal(idempotency_key, String).label("idempotency_key"),
+        )
+        .where(User.user_id == user_id)
+    )
+    ledger = (
+        pg_insert(Payout)
+        .from_select(["user_id", "amount", "issued_by", "created_at", "idempotency_key"], source)
+        .on_conflict_do_nothing(
+            index_elements=[Payout.idempotency_key], index_where=Payout.idempotency_key.is_not(None)
+        )
+        .returning(Payout.id, Payout.user_id, Payout.amount)
+        .cte("ledger")
+    )
+    balance = (
+        update(User)
+        .where(User.user_id == ledger.c.user_id)
+        .values(payout=func.coalesce(User.payout, 0) + ledger.c.amount)
+        .returning(User.user_id, User.payout, User.name)
+        .cte("balance")
+    )
+    daily = pg_insert(PayoutDaily).from_select(
+        ["user_id", "day", "amount", "payouts_count"],
+        select(ledger.c.user_id, literal(created_at.date(), Date), ledger.c.amount, literal(1, Integer)),
+    )
+    daily = daily.on_conflict_do_update(
+        index_elements=[PayoutDaily.user_id, PayoutDaily.day],
+        set_={
+            "amount": PayoutDaily.amount + daily.excluded.amount,
+            "payouts_count": PayoutDaily.payouts_count + 1,
+        },
+    ).cte("daily")
+    total = pg_insert(PayoutDailyTotal).from_select(
+        ["day", "amount", "payouts_count"],
+        select(literal(created_at.date(), Date), ledger.c.amount, literal(1, Integer)),
+    )
+    total = total.on_conflict_do_update(
+        index_elements=[PayoutDailyTotal.day],
+        set_={
+            "amount": PayoutDailyTotal.amount + total.excluded.amount,
+            "payouts_count": PayoutDailyTotal.payouts_count + 1,
+        },
+    ).cte("total")
+
+    row = (await session.execute(
+        select(ledger.c.id, ledger.c.amount, balance.c.payout, balance.c.name)
+        .join_from(ledger, balance, balance.c.user_id == ledger.c.user_id)
+        .add_cte(daily, total)
+    )).first()
+    if row is None:
+        # Выплаты нет: либо ключ уже использован, либо нет пользователя (редкий путь, второй запрос)
+        if idempotency_key is not None:
+            existing = (await session.execute(
+                select(Payout.id, Payout.amount).where(Payout.idempotency_key == idempotency_key)
+            )).first()
+            if existing is not None:
+                return PayoutResult(DUPLICATE, existing.id, existing.amount, None)
+        return PayoutResult(UNKNOWN_USER, None, None, None)
+
+    session.info.setdefault("payout_events", []).append((row.id, user_id, row.amount, created_at, row.name))
+    return PayoutResult(APPLIED, row.id, row.amount, row.payout)
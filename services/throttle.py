@@ -0,0 +1,117 @@
+"""
+Ограничение частоты апдейтов на пользователя.
+
+Для каждого класса апдейтов (сообщения, колбэки, апдейты админов) своя корзина токенов
+на пользователя: запас burst, пополнение rate токенов в секунду. Корзины лежат в LRU
+с лимитом числа записей, поэтому память ограничена; вытесненный пользователь просто
+получает полную корзину заново.
+"""
+import heapq
+import time
+from collections import OrderedDict
+
+from config import (
+    THROTTLE_MESSAGE_RATE, THROTTLE_MESSAGE_BURST, THROTTLE_CALLBACK_RATE, THROTTLE_CALLBACK_BURST,
+    THROTTLE_ADMIN_RATE, THROTTLE_ADMIN_BURST, THROTTLE_MAX_USERS, THROTTLE_NOTICE_INTERVAL
+)
+
+MESSAGE = "message"
+CALLBACK = "callback"
+ADMIN = "admin"
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "throttled", "notified_at")
+
+    def __init__(self, tokens: float, now: float):
+        self.tokens = tokens
+        self.updated = now
+        self.throttled = 0
+        self.notified_at = 0.0
+
+
+class TokenBuckets:
+    """Корзины одного класса апдейтов: LRU user_id -> _Bucket."""
+
+    def __init__(self, rate: float, burst: int, max_entries: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_entries = max_entries
+        self._buckets: OrderedDict[int, _Bucket] = OrderedDict()
+        self.allowed = 0
+        self.throttled = 0
+
+    def take(self, user_id: int, now: float) -> _Bucket | None:
+        """Списывает токен. None — апдейт пропускается, иначе корзина превысившего лимит."""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            bucket = self._buckets[user_id] = _Bucket(self.burst, now)
+            if len(self._buckets) > self.max_entries:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(user_id)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            self.allowed += 1
+            return None
+        bucket.throttled += 1
+        self.throttled += 1
+        return bucket
+
+    def stats(self) -> dict:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "users": len(self._buckets),
+            "allowed": self.allowed,
+            "throttled": self.throttled,
+        }
+
+
+class Throttler:
+    """Корзины по классам апдейтов и решение, предупреждать ли пользователя о лимите."""
+
+    def __init__(self, limits: dict[str, tuple[float, int]], max_entries: int, notice_interval: float):
+        self.notice_interval = notice_interval
+        self._classes = {
+            kind: TokenBuckets(rate, burst, max_entries) for kind, (rate, burst) in limits.items()
+        }
+
+    def check(self, kind: str, user_id: int) -> tuple[bool, bool]:
+        """(пропустить апдейт, ответить «не так быстро») для апдейта класса kind."""
+        now = time.monotonic()
+        bucket = self._classes[kind].take(user_id, now)
+        if bucket is None:
+            return True, False
+        # Предупреждаем не чаще notice_interval, остальные апдейты сверх лимита молча отбрасываются
+        if self.notice_interval and now - bucket.notified_at >= self.notice_interval:
+            bucket.notified_at = now
+            return False, True
+        return False, False
+
+    def stats(self, top: int = 10) -> dict:
+        throttled = {}
+        for buckets in self._classes.values():
+            for user_id, bucket in buckets._buckets.items():
+                if bucket.throttled:
+                    throttled[user_id] = throttled.get(user_id, 0) + bucket.throttled
+        return {
+            "classes": {kind: buckets.stats() for kind, buckets in self._classes.items()},
+            "top_users": [
+                {"user_id": user_id, "throttled": count}
+                for user_id, count in heapq.nlargest(top, throttled.items(), key=lambda item: item[1])
+            ],
+        }
+
+
+throttler = Throttler(
+    {
+        MESSAGE: (THROTTLE_MESSAGE_RATE, THROTTLE_MESSAGE_BURST),
+        CALLBACK: (THROTTLE_CALLBACK_RATE, THROTTLE_CALLBACK_BURST),
+        ADMIN: (THROTTLE_ADMIN_RATE, THROTTLE_ADMIN_BURST),
+    },
+    THROTTLE_MAX_USERS,
+    THROTTLE_NOTICE_INTERVAL,
+)
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from services.webhook_reply import resolve_reply
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update: Update) -> int:
+    """Ключ упорядочивания: id чата, а если его нет — id отправителя или самого апдейта."""
+    try:
+        event = update.event
+    except Exception:
+        return update.update_id
+    chat = getattr(event, "chat", None)
+    if chat is None:
+        message = getattr(event, "message", None)  # callback_query
+        chat = getattr(message, "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None) or getattr(event, "user", None)
+    return user.id if user else update.update_id
+
+
+def percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class UpdateQueue:
+    """
+    Очередь апдейтов для быстрого ответа вебхука.
+    Апдейты раскладываются по шардам по chat_key: один чат всегда попадает в одного воркера,
+    поэтому его апдейты обрабатываются по порядку, а разные чаты — параллельно.
+    Каждый шард ограничен по размеру; если он заполнен, put ждёт не дольше put_timeout.
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, workers: int, maxsize: int, put_timeout: float):
+        self.dp = dp
+        self.bot = bot
+        self.put_timeout = put_timeout
+        shard_size = max(1, maxsize // workers)
+        self._queues = [asyncio.Queue(maxsize=shard_size) for _ in range(workers)]
+        self._workers: list[asyncio.Task] = []
+        self._latencies = deque(maxlen=1024)  # от приёма вебхука до конца обработки, сек
+        self._handle_times = deque(maxlen=1024)  # только feed_update, сек
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    @property
+    def depth(self) -> int:
+        return sum(queue.qsize() for queue in self._queues)
+
+    def start(self):
+        for index, queue in enumerate(self._queues):
+            self._workers.append(asyncio.create_task(self._worker(queue), name=f"update-worker-{index}"))
+        logger.info(f"Update queue started: {len(self._queues)} workers.")
+
+    async def stop(self, timeout: float = 10):
+        # Даём доработать тому, что уже принято, затем останавливаем воркеров
+        try:
+            await asyncio.wait_for(asyncio.gather(*(queue.join() for queue in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Update queue stopped with {self.depth} unprocessed updates.")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+    async def put(self, update: Update) -> bool:
+        """Ставит апдейт в очередь. False — очередь переполнена, вебхук должен ответить ошибкой."""
+        queue = self._queues[chat_key(update) % len(self._queues)]
+        try:
+            await asyncio.wait_for(queue.put((update, time.monotonic())), self.put_timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            logger.warning(f"Update queue is full, update {update.update_id} rejected.")
+            return False
+        return True
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            update, received_at = await queue.get()
+            started = time.monotonic()
+            try:
+                result = await self.dp.feed_update(self.bot, update)
+                # Ответ на вебхук уже отправлен — возвращённый хендлером вызов выполняем сами
+                await resolve_reply(self.bot, result, inline=False)
+                self.processed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error processing update {update.update_id}: {e}")
+            finally:
+                finished = time.monotonic()
+                self._handle_times.append(finished - started)
+                self._latencies.append(finished - received_at)
+                queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._queues),
+            "depth": self.depth,
+            "shard_depths": [queue.qsize() for queue in self._queues],
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "latency_p50_ms": round(percentile(self._latencies, 0.5) * 1000, 2),
+            "latency_p95_ms": round(percentile(self._latencies, 0.95) * 1000, 2),
+            "handle_p50_ms": round(percentile(self._handle_times, 0.5) * 1000, 2),
+            "handle_p95_ms": round(percentile(self._handle_times, 0.95) * 1000, 2),
+        }
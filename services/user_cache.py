@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import USER_CACHE_TTL, USER_CACHE_MAX_ENTRIES
+from database import get_user_by_id
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    """Неизменяемый снимок строки users — безопасно отдавать из кэша в любые хендлеры."""
+    user_id: int
+    name: str | None
+    contact: str | None
+    role: str | None
+    user_rank: str | None
+    payout: Decimal | None
+    banned_until: datetime | None
+
+    @classmethod
+    def from_row(cls, user) -> "UserSnapshot":
+        return cls(
+            user_id=user.user_id,
+            name=user.name,
+            contact=user.contact,
+            role=user.role,
+            user_rank=user.user_rank,
+            payout=user.payout,
+            banned_until=user.banned_until,
+        )
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role in ("admin", "superadmin")
+
+    @property
+    def is_superadmin(self) -> bool:
+        return self.role == "superadmin"
+
+    @property
+    def is_banned(self) -> bool:
+        return bool(self.banned_until and self.banned_until > datetime.utcnow())
+
+
+class UserCache:
+    """
+    TTL + LRU кэш снимков пользователей.
+    Размер ограничен числом записей (снимок фиксированного размера, поэтому это и есть лимит памяти).
+    Отсутствующие пользователи тоже кэшируются (None), чтобы не спрашивать БД на каждый апдейт.
+    Все записи в users должны вызывать invalidate() или put().
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._data: OrderedDict[int, tuple[float, UserSnapshot | None]] = OrderedDict()
+        self._loading: dict[int, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, user_id: int, session: AsyncSession | None = None) -> UserSnapshot | None:
+        entry = self._data.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._data.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+
+        # Одновременные промахи по одному пользователю делают один запрос
+        pending = self._loading.get(user_id)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = future
+        try:
+            snapshot = await self._load(user_id, session)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # помечаем как полученное, чтобы не было предупреждения
+            raise
+        else:
+            # Если пока шёл запрос запись инвалидировали — не кэшируем устаревшее значение
+            if self._loading.get(user_id) is future:
+                self._store(user_id, snapshot)
+            future.set_result(snapshot)
+            return snapshot
+        finally:
+            if self._loading.get(user_id) is future:
+                del self._loading[user_id]
+
+    def peek(self, user_id: int) -> UserSnapshot | None:
+        """Снимок из кэша без обращения к БД (None — нет в кэше или запись устарела)."""
+        entry = self._data.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            return entry[1]
+        return None
+
+    async def _load(self, user_id: int, session: AsyncSession | None) -> UserSnapshot | None:
+        user = await get_user_by_id(user_id, session)
+        return UserSnapshot.from_row(user) if user else None
+
+    def _store(self, user_id: int, snapshot: UserSnapshot | None):
+        self._data[user_id] = (time.monotonic() + self.ttl, snapshot)
+        self._data.move_to_end(user_id)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def put(self, user) -> UserSnapshot:
+        """Кладёт в кэш свежую строку users (ORM-объект или UserSnapshot)."""
+        snapshot = user if isinstance(user, UserSnapshot) else UserSnapshot.from_row(user)
+        self._loading.pop(snapshot.user_id, None)
+        self._store(snapshot.user_id, snapshot)
+        return snapshot
+
+    def invalidate(self, user_id: int):
+        self._data.pop(user_id, None)
+        self._loading.pop(user_id, None)
+
+    def clear(self):
+        self._data.clear()
+        self._loading.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+user_cache = UserCache(USER_CACHE_TTL, USER_CACHE_MAX_ENTRIES)
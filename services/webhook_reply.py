@@ -0,0 +1,47 @@
+"""
+Ответ вызовом Bot API прямо в HTTP-ответе вебхука.
+
+Хендлер может вернуть метод вместо await (return message.answer(...)). Telegram выполнит
+метод из ответа на вебхук сам — это экономит один исходящий запрос на апдейт. Результат
+такого вызова боту не виден, поэтому так возвращают только последний вызов, чей ответ не нужен.
+Если встроить нельзя (файлы, очередь апдейтов, режим выключен), метод выполняется обычным запросом.
+"""
+import json
+
+from aiogram import Bot
+from aiogram.methods import TelegramMethod
+
+from services.metrics import WEBHOOK_INLINED, WEBHOOK_INLINE_FALLBACKS
+
+
+def build_inline_reply(bot: Bot, method: TelegramMethod) -> bytes | None:
+    """Тело ответа вебхука с вызовом method или None, если метод нельзя передать так (файлы)."""
+    files = {}
+    payload = {"method": method.__api_method__}
+    for key, value in method.model_dump(warnings=False).items():
+        # prepare_value подставляет parse_mode и прочие значения по умолчанию бота
+        value = bot.session.prepare_value(value, bot=bot, files=files)
+        if value is not None:
+            payload[key] = value
+    if files:
+        return None
+    return json.dumps(payload, ensure_ascii=False).encode()
+
+
+async def resolve_reply(bot: Bot, result, inline: bool) -> bytes | None:
+    """
+    Обрабатывает результат dp.feed_update: возвращает тело ответа вебхука со встроенным
+    вызовом либо выполняет метод сам и возвращает None.
+    """
+    if not isinstance(result, TelegramMethod):
+        return None
+    if inline:
+        body = build_inline_reply(bot, result)
+        if body is not None:
+            WEBHOOK_INLINED.labels(type(result).__name__).inc()
+            return body
+        WEBHOOK_INLINE_FALLBACKS.labels("files").inc()
+    else:
+        WEBHOOK_INLINE_FALLBACKS.labels("disabled").inc()
+    await bot(result)
+    return None